@@ -0,0 +1,291 @@
+"""
+Đo hiệu năng pipeline nhận diện khuôn mặt: giải mã ảnh base64, phát hiện + cắt khuôn mặt (MTCNN),
+trích xuất embedding (Facenet) và so khớp với bảng embedding 1k/10k/100k dòng.
+
+Kết quả (p50/p95/trung bình theo ms, throughput theo lượt/giây, RSS đỉnh và mức tăng RSS của từng bước theo MB)
+được in ra dạng JSON.
+Dữ liệu được sinh ngẫu nhiên với seed cố định nên các lần chạy so sánh được với nhau.
+
+Chạy từ thư mục backend:
+    python -m benchmarks.face_pipeline [--sizes 1000 10000 100000] [--iterations 100] [--image anh.jpg]
+                                       [--skip-models] [--output ket_qua.json]
+                                       [--baseline ket_qua_cu.json --max-regression 0.2]
+"""
+import argparse
+import base64
+import gc
+import json
+import os
+import platform
+import resource
+import sys
+import threading
+import time
+import cv2
+import numpy as np
+
+SEED = 1234
+EMBEDDING_DIM = 128
+ROSTER_SIZE = 40
+
+
+def _peak_rss_mb():
+    # Đỉnh RSS của cả tiến trình từ lúc khởi động (ru_maxrss tính bằng KB trên Linux, byte trên macOS)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _current_rss_mb():
+    # RSS hiện tại đọc từ /proc (Linux); None nếu hệ điều hành không hỗ trợ
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class RssSampler:
+    """
+    Lấy mẫu RSS bằng một luồng nền trong lúc một bước chạy, để báo đỉnh bộ nhớ của riêng bước đó
+    (ru_maxrss chỉ là đỉnh của cả tiến trình nên không tách được từng bước).
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.start = self.peak = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        rss = _current_rss_mb()
+        if rss is not None and rss > self.peak:
+            self.peak = rss
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        self.start = self.peak = _current_rss_mb()
+        if self.start is not None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._sample()
+        return False
+
+    def result(self):
+        if self.start is None:
+            # Không đọc được RSS hiện tại: chỉ còn đỉnh của cả tiến trình
+            return {"process_peak_rss_mb": _peak_rss_mb()}
+        return {"peak_rss_mb": round(self.peak, 1), "rss_delta_mb": round(self.peak - self.start, 1)}
+
+
+def measure(fn, iterations: int, warmup: int = 3, items_per_call: int = 1):
+    gc.collect()
+    with RssSampler() as rss:
+        for _ in range(warmup):
+            fn()
+        durations = []
+        started = time.perf_counter()
+        for _ in range(iterations):
+            t0 = time.perf_counter()
+            fn()
+            durations.append(time.perf_counter() - t0)
+        total = time.perf_counter() - started
+    durations_ms = np.asarray(durations) * 1000
+    return {
+        "iterations": iterations,
+        "p50_ms": round(float(np.percentile(durations_ms, 50)), 4),
+        "p95_ms": round(float(np.percentile(durations_ms, 95)), 4),
+        "mean_ms": round(float(durations_ms.mean()), 4),
+        "throughput_per_s": round(iterations * items_per_call / total, 2),
+        **rss.result(),
+    }
+
+
+def timed_build(fn):
+    # Đo thời gian và bộ nhớ của một bước dựng chỉ mục (chạy một lần)
+    gc.collect()
+    with RssSampler() as rss:
+        t0 = time.perf_counter()
+        value = fn()
+        seconds = time.perf_counter() - t0
+    return value, {"seconds": round(seconds, 4), **rss.result()}
+
+
+def synthetic_image(rng, width: int = 640, height: int = 480):
+    # Ảnh giả lập: nền nhiễu và một khuôn mặt đơn giản (hình elip màu da, mắt, miệng) ở giữa khung hình
+    img = rng.integers(60, 200, size=(height, width, 3), dtype=np.uint8)
+    center = (width // 2, height // 2)
+    cv2.ellipse(img, center, (70, 95), 0, 0, 360, (150, 180, 225), -1)
+    cv2.circle(img, (center[0] - 28, center[1] - 25), 9, (40, 40, 40), -1)
+    cv2.circle(img, (center[0] + 28, center[1] - 25), 9, (40, 40, 40), -1)
+    cv2.ellipse(img, (center[0], center[1] + 40), (28, 10), 0, 0, 180, (60, 60, 160), -1)
+    return img
+
+
+def load_sample_base64(path, rng):
+    if path:
+        with open(path, "rb") as f:
+            return base64.b64encode(f.read()).decode()
+    _, buffer = cv2.imencode(".jpg", synthetic_image(rng))
+    return base64.b64encode(buffer.tobytes()).decode()
+
+
+def synthetic_table(rng, size: int, vectors_per_student: int = 1):
+    # Các "học sinh" là các vector ngẫu nhiên; mỗi học sinh có vectors_per_student biến thể có nhiễu
+    base = rng.standard_normal((size, EMBEDDING_DIM)).astype(np.float32)
+    vectors = np.repeat(base, vectors_per_student, axis=0)
+    if vectors_per_student > 1:
+        vectors += 0.3 * rng.standard_normal(vectors.shape).astype(np.float32)
+    student_ids = np.repeat(np.arange(1, size + 1, dtype=np.int64), vectors_per_student)
+    return base, vectors, student_ids
+
+
+def bench_models(args, rng, results):
+    from utils.image_processing import load_image_from_base64, detect_and_crop_face, extract_face_embedding, crop_face
+    from utils.model_registry import model_registry
+
+    t0 = time.perf_counter()
+    model_registry.load()
+    results["model_load_s"] = round(time.perf_counter() - t0, 2)
+
+    image_base64 = load_sample_base64(args.image, rng)
+    img = load_image_from_base64(image_base64)
+    results["stages"]["decode_base64"] = measure(lambda: load_image_from_base64(image_base64), args.iterations)
+
+    def detect():
+        try:
+            return detect_and_crop_face(img)
+        except Exception:
+            # Ảnh giả lập có thể không được MTCNN nhận là khuôn mặt: vẫn đo thời gian phát hiện
+            return None
+
+    results["stages"]["detect_and_crop_face"] = measure(detect, args.iterations)
+    face = detect()
+    if face is None:
+        results["notes"].append("Không phát hiện được khuôn mặt trong ảnh mẫu, dùng vùng giữa ảnh cho bước embedding")
+        height, width = img.shape[:2]
+        face = crop_face(img, np.array([width * 0.3, height * 0.2, width * 0.7, height * 0.8]))
+
+    results["stages"]["extract_face_embedding"] = measure(lambda: extract_face_embedding(face), args.iterations)
+    batch = [face] * args.batch_size
+    results["stages"][f"embed_batch_{args.batch_size}"] = measure(
+        lambda: model_registry.embed_faces(batch), max(1, args.iterations // 4), items_per_call=args.batch_size
+    )
+
+
+def bench_matching(args, rng, results):
+    from utils.embedding_index import EmbeddingIndex
+    from utils.image_processing import cosine_similarity
+
+    for size in args.sizes:
+        base, vectors, student_ids = synthetic_table(rng, size)
+        probes = base[rng.integers(0, size, args.iterations + 8)] + 0.4 * rng.standard_normal((args.iterations + 8, EMBEDDING_DIM)).astype(np.float32)
+        probe_iter = iter(np.tile(probes, (4, 1)))
+
+        index, results["stages"][f"index_build_{size}"] = timed_build(lambda: EmbeddingIndex.from_arrays(student_ids, vectors))
+
+        results["stages"][f"search_exact_{size}"] = measure(lambda: index.search(next(probe_iter)), args.iterations)
+        roster = rng.choice(student_ids, ROSTER_SIZE, replace=False).tolist()
+        results["stages"][f"search_scoped_{size}"] = measure(
+            lambda: index.search_scoped(next(probe_iter), ("bench", size), roster), args.iterations
+        )
+
+        if size >= 10000:
+            # Thời gian dựng gồm cả chuẩn hoá ma trận và huấn luyện/gán cụm IVF
+            ivf, results["stages"][f"ivf_build_{size}"] = timed_build(lambda: EmbeddingIndex.from_arrays(student_ids, vectors, ann=True))
+            results["stages"][f"search_ivf_{size}"] = measure(lambda: ivf.search(next(probe_iter)), args.iterations)
+            del ivf
+
+        # Vòng lặp cũ trong routes/attendance.py: giải mã JSON và tính cosine từng dòng cho mỗi request
+        if size <= args.legacy_max_size:
+            rows = [json.dumps(vector.tolist()) for vector in vectors]
+
+            def legacy_loop():
+                probe = next(probe_iter)
+                best, best_score = None, 0.8
+                for student_id, row in zip(student_ids, rows):
+                    score = cosine_similarity(np.array(probe), np.array(json.loads(row)))
+                    if score > best_score:
+                        best, best_score = student_id, score
+                return best
+
+            results["stages"][f"legacy_loop_{size}"] = measure(legacy_loop, max(3, args.iterations // 20), warmup=1)
+
+        # So khớp hai bước khi mỗi học sinh có nhiều vector (ảnh mẫu)
+        base, vectors, student_ids = synthetic_table(rng, size // 4, vectors_per_student=4)
+        multi = EmbeddingIndex.from_arrays(student_ids, vectors)
+        results["stages"][f"search_templates_{size}"] = measure(lambda: multi.search(next(probe_iter)), args.iterations)
+        del index, multi, vectors
+        gc.collect()
+
+
+def compare(results, baseline_path: str, max_regression: float):
+    with open(baseline_path, "r") as f:
+        baseline = json.load(f)
+    regressions = []
+    for name, stage in results["stages"].items():
+        old = baseline.get("stages", {}).get(name)
+        if not old or "p50_ms" not in stage or "p50_ms" not in old or old["p50_ms"] == 0:
+            continue
+        change = stage["p50_ms"] / old["p50_ms"] - 1
+        stage["p50_change"] = round(change, 3)
+        if change > max_regression:
+            regressions.append(f"{name}: p50 {old['p50_ms']}ms -> {stage['p50_ms']}ms (+{change:.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark pipeline nhận diện khuôn mặt")
+    parser.add_argument("--sizes", type=int, nargs="*", default=[1000, 10000, 100000], help="Số dòng của bảng embedding giả lập")
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--image", help="Ảnh mẫu (JPEG/PNG) thay cho ảnh giả lập")
+    parser.add_argument("--skip-models", action="store_true", help="Chỉ đo phần so khớp (không nạp MTCNN/Facenet)")
+    parser.add_argument("--legacy-max-size", type=int, default=10000, help="Chỉ đo vòng lặp JSON cũ tới kích thước này")
+    parser.add_argument("--output", help="Ghi kết quả JSON ra file")
+    parser.add_argument("--baseline", help="File kết quả cũ để so sánh")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="Báo lỗi nếu p50 chậm hơn baseline quá tỉ lệ này")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(SEED)
+    results = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "sizes": args.sizes,
+            "iterations": args.iterations,
+        },
+        "notes": [],
+        "stages": {},
+    }
+    if not args.skip_models:
+        bench_models(args, rng, results)
+    bench_matching(args, rng, results)
+    results["process_peak_rss_mb"] = _peak_rss_mb()
+
+    regressions = compare(results, args.baseline, args.max_regression) if args.baseline else []
+    results["regressions"] = regressions
+
+    output = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+    if regressions:
+        print("⚠️ Hiệu năng giảm so với baseline:\n" + "\n".join(regressions), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
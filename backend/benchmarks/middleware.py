@@ -0,0 +1,170 @@
+"""
+So sánh số request/giây của ứng dụng khi dùng AuthMiddleware + CORSMiddleware dạng ASGI thuần (hiện tại)
+với phiên bản cũ dựa trên BaseHTTPMiddleware.
+
+Request được gọi thẳng vào ứng dụng ASGI (không qua mạng, không cần MySQL) nên kết quả chỉ phản ánh chi phí
+của middleware và định tuyến. Kết quả in ra dạng JSON.
+
+Chạy từ thư mục backend:
+    python -m benchmarks.middleware [--requests 5000] [--concurrency 32] [--output ket_qua.json]
+"""
+import argparse
+import asyncio
+import json
+import time
+from fastapi import FastAPI
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from middleware.auth_middleware import AuthMiddleware, EXCLUDED_PATHS
+from middleware.cors_middleware import CORSMiddleware, ALLOWED_ORIGIN
+from utils.security import create_access_token, decode_access_token
+
+
+class LegacyAuthMiddleware(BaseHTTPMiddleware):
+    # Bản cũ của middleware/auth_middleware.py, giữ lại để so sánh
+    async def dispatch(self, request: Request, call_next):
+        path = request.url.path
+        if path.startswith("/attendance/face-attendance/public"):
+            return await call_next(request)
+        if request.method == "OPTIONS":
+            return await call_next(request)
+        if any(path.startswith(ep) for ep in EXCLUDED_PATHS):
+            return await call_next(request)
+        auth_header = request.headers.get("Authorization")
+        if not auth_header or not auth_header.startswith("Bearer "):
+            return JSONResponse({"detail": "Thiếu token hoặc token không hợp lệ"}, status_code=401)
+        payload = decode_access_token(auth_header.split(" ")[1])
+        if not payload:
+            return JSONResponse({"detail": "Token không hợp lệ hoặc đã hết hạn"}, status_code=401)
+        request.state.user = payload
+        return await call_next(request)
+
+
+class LegacyCORSMiddleware(BaseHTTPMiddleware):
+    # Bản cũ của middleware/cors_middleware.py, giữ lại để so sánh
+    async def dispatch(self, request: Request, call_next):
+        headers = {
+            "Access-Control-Allow-Origin": ALLOWED_ORIGIN,
+            "Access-Control-Allow-Methods": "GET, POST, PUT, DELETE, OPTIONS",
+            "Access-Control-Allow-Headers": "Authorization, Content-Type",
+            "Access-Control-Allow-Credentials": "true"
+        }
+        if request.method == "OPTIONS":
+            return Response(status_code=200, headers=headers)
+        response = await call_next(request)
+        response.headers.update(headers)
+        return response
+
+
+def build_app(auth_cls, cors_cls):
+    app = FastAPI()
+
+    @app.get("/classes/{class_id}")
+    async def get_class(class_id: int, request: Request):
+        return {"id": class_id, "user": request.state.user.get("sub")}
+
+    @app.post("/attendance/face-attendance/public")
+    async def public_attendance():
+        return {"student_id": 1, "full_name": "Benchmark"}
+
+    # Cùng thứ tự với main.py: CORS bên trong, Auth bên ngoài
+    app.add_middleware(cors_cls)
+    app.add_middleware(auth_cls)
+    return app
+
+
+async def call(app, method: str, path: str, headers):
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": headers,
+        "client": ("127.0.0.1", 50000),
+        "server": ("testserver", 80),
+    }
+    status = None
+    request_sent = False
+
+    async def receive():
+        nonlocal request_sent
+        if request_sent:
+            await asyncio.sleep(3600)
+        request_sent = True
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    await app(scope, receive, send)
+    return status
+
+
+async def run_scenario(app, method, path, headers, total: int, concurrency: int):
+    # Chạy total request với concurrency request đồng thời; trả về số request/giây và độ trễ
+    assert await call(app, method, path, headers) == 200
+    durations = []
+    remaining = iter(range(total))
+
+    async def worker():
+        for _ in remaining:
+            t0 = time.perf_counter()
+            await call(app, method, path, headers)
+            durations.append(time.perf_counter() - t0)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    durations.sort()
+    return {
+        "requests_per_s": round(total / elapsed, 1),
+        "p50_ms": round(durations[len(durations) // 2] * 1000, 4),
+        "p95_ms": round(durations[int(len(durations) * 0.95)] * 1000, 4),
+    }
+
+
+async def main_async(args):
+    token = create_access_token({"sub": "benchmark@example.com"})
+    scenarios = {
+        "authenticated_get": ("GET", "/classes/1", [(b"authorization", f"Bearer {token}".encode())]),
+        "public_attendance": ("POST", "/attendance/face-attendance/public", []),
+        "preflight": ("OPTIONS", "/classes/1", [(b"origin", ALLOWED_ORIGIN.encode())]),
+    }
+    stacks = {
+        "base_http_middleware": build_app(LegacyAuthMiddleware, LegacyCORSMiddleware),
+        "pure_asgi": build_app(AuthMiddleware, CORSMiddleware),
+    }
+    results = {"requests": args.requests, "concurrency": args.concurrency, "scenarios": {}}
+    for name, (method, path, headers) in scenarios.items():
+        scenario = {}
+        for stack_name, app in stacks.items():
+            scenario[stack_name] = await run_scenario(app, method, path, headers, args.requests, args.concurrency)
+        scenario["speedup"] = round(scenario["pure_asgi"]["requests_per_s"] / scenario["base_http_middleware"]["requests_per_s"], 2)
+        results["scenarios"][name] = scenario
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark middleware xác thực + CORS")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--output", help="Ghi kết quả JSON ra file")
+    args = parser.parse_args()
+
+    output = json.dumps(asyncio.run(main_async(args)), indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,39 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from starlette.concurrency import run_in_threadpool
 from routes import router
 from middleware.auth_middleware import AuthMiddleware
 from middleware.cors_middleware import CORSMiddleware  # ✅ Import middleware CORS mới
+from middleware.metrics_middleware import MetricsMiddleware
+from utils.model_registry import model_registry, FACE_MODELS_PRELOAD
+from utils.inference_executor import inference_executor
+from utils.enrollment_queue import enrollment_worker, FACE_ENROLLMENT_WORKER
+from database.mysql import engine
+from models.session_stats_model import SessionAttendanceStats
+from models.enrollment_job_model import EnrollmentJob
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # ✅ Bảng số liệu điểm danh theo buổi học (dữ liệu cũ: python -m scripts.rebuild_session_stats)
+    SessionAttendanceStats.__table__.create(bind=engine, checkfirst=True)
+    # ✅ Bảng job đăng ký khuôn mặt: API luôn ghi job vào bảng này, kể cả khi worker chạy ở tiến trình riêng
+    EnrollmentJob.__table__.create(bind=engine, checkfirst=True)
+    # ✅ Nạp và làm nóng model nhận diện khuôn mặt trước khi worker nhận request
+    if FACE_MODELS_PRELOAD:
+        try:
+            await run_in_threadpool(model_registry.load)
+        except Exception as e:
+            print(f"⚠️ Lỗi khi nạp model nhận diện khuôn mặt: {e}")
+    # ✅ Worker nền đăng ký khuôn mặt cho học sinh mới/đổi ảnh
+    if FACE_ENROLLMENT_WORKER:
+        enrollment_worker.start()
+    yield
+    enrollment_worker.stop()
+    inference_executor.shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # ✅ Đảm bảo CORS Middleware đứng đầu tiên
 app.add_middleware(CORSMiddleware)
@@ -11,5 +41,8 @@ app.add_middleware(CORSMiddleware)
 # ✅ Thêm Middleware xác thực (AuthMiddleware)
 app.add_middleware(AuthMiddleware)
 
+# ✅ Đếm request và đo thời gian xử lý (đặt ngoài cùng để tính cả thời gian của các middleware khác)
+app.add_middleware(MetricsMiddleware)
+
 # ✅ Thêm router vào ứng dụng
 app.include_router(router)
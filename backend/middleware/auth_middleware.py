@@ -1,37 +1,46 @@
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.requests import Request
-from starlette.responses import JSONResponse, Response
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
 from utils.security import decode_access_token
 
-EXCLUDED_PATHS = ["/auth/login", "/register", "/docs", "/openapi.json"]
+EXCLUDED_PATHS = ["/auth/login", "/register", "/docs", "/openapi.json", "/health", "/metrics"]
 
-class AuthMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        path = request.url.path
-        
-        if request.url.path.startswith("/attendance/face-attendance/public"):
-            return await call_next(request)
+class AuthMiddleware:
+    # Middleware ASGI thuần: không bọc request/response trong task và stream trung gian như BaseHTTPMiddleware
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        # ✅ Chỉ kiểm tra request HTTP (WebSocket tự xác thực bằng token trên query string)
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        path = scope["path"]
+
+        if path.startswith("/attendance/face-attendance/public"):
+            return await self.app(scope, receive, send)
 
         # ✅ Nếu request là OPTIONS, bỏ qua AuthMiddleware
-        if request.method == "OPTIONS":
-            return await call_next(request)
+        if scope["method"] == "OPTIONS":
+            return await self.app(scope, receive, send)
 
         # ✅ Bỏ qua các route không yêu cầu xác thực
         if any(path.startswith(ep) for ep in EXCLUDED_PATHS):
-            return await call_next(request)
+            return await self.app(scope, receive, send)
 
         # ✅ Kiểm tra Authorization Header
-        auth_header = request.headers.get("Authorization")
+        auth_header = Headers(scope=scope).get("Authorization")
         if not auth_header or not auth_header.startswith("Bearer "):
-            return JSONResponse({"detail": "Thiếu token hoặc token không hợp lệ"}, status_code=401)
+            response = JSONResponse({"detail": "Thiếu token hoặc token không hợp lệ"}, status_code=401)
+            return await response(scope, receive, send)
 
         # ✅ Lấy token từ header
         token = auth_header.split(" ")[1]
         payload = decode_access_token(token)
 
         if not payload:
-            return JSONResponse({"detail": "Token không hợp lệ hoặc đã hết hạn"}, status_code=401)
+            response = JSONResponse({"detail": "Token không hợp lệ hoặc đã hết hạn"}, status_code=401)
+            return await response(scope, receive, send)
 
-        # ✅ Lưu thông tin user vào request.state để sử dụng trong route
-        request.state.user = payload
-        return await call_next(request)
+        # ✅ Lưu thông tin user vào request.state để sử dụng trong route (request.state đọc từ scope["state"])
+        scope.setdefault("state", {})["user"] = payload
+        return await self.app(scope, receive, send)
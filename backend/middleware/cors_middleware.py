@@ -1,28 +1,36 @@
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.requests import Request
+from starlette.datastructures import MutableHeaders
 from starlette.responses import Response
 
 ALLOWED_ORIGIN = "http://localhost:3000" 
 
-class CORSMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        # ✅ Xử lý preflight request (OPTIONS)
-        if request.method == "OPTIONS":
-            headers = {
-                "Access-Control-Allow-Origin": ALLOWED_ORIGIN,
-                "Access-Control-Allow-Methods": "GET, POST, PUT, DELETE, OPTIONS",
-                "Access-Control-Allow-Headers": "Authorization, Content-Type",
-                "Access-Control-Allow-Credentials": "true" 
-            }
-            return Response(status_code=200, headers=headers)
+CORS_HEADERS = {
+    "Access-Control-Allow-Origin": ALLOWED_ORIGIN,
+    "Access-Control-Allow-Methods": "GET, POST, PUT, DELETE, OPTIONS",
+    "Access-Control-Allow-Headers": "Authorization, Content-Type",
+    "Access-Control-Allow-Credentials": "true" 
+}
 
-        # ✅ Gọi request thực tế
-        response = await call_next(request)
+class CORSMiddleware:
+    # Middleware ASGI thuần: chỉ sửa header của message http.response.start, phần body được chuyển thẳng (kể cả streaming)
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        # ✅ Xử lý preflight request (OPTIONS)
+        if scope["method"] == "OPTIONS":
+            response = Response(status_code=200, headers=CORS_HEADERS)
+            return await response(scope, receive, send)
 
         # ✅ Đảm bảo tất cả response đều có header CORS đúng
-        response.headers["Access-Control-Allow-Origin"] = ALLOWED_ORIGIN
-        response.headers["Access-Control-Allow-Methods"] = "GET, POST, PUT, DELETE, OPTIONS"
-        response.headers["Access-Control-Allow-Headers"] = "Authorization, Content-Type"
-        response.headers["Access-Control-Allow-Credentials"] = "true" 
+        async def send_with_cors(message):
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                for name, value in CORS_HEADERS.items():
+                    headers[name] = value
+            await send(message)
 
-        return response
+        # ✅ Gọi request thực tế
+        await self.app(scope, receive, send_with_cors)
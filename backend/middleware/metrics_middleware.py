@@ -0,0 +1,33 @@
+import time
+from utils.metrics import http_requests_total, http_request_duration_seconds
+
+
+class MetricsMiddleware:
+    """
+    Đếm request và đo thời gian xử lý theo route (mẫu đường dẫn, ví dụ /students/{student_id})
+    để số nhãn không tăng theo id. Viết dạng ASGI thuần để không tạo thêm task cho mỗi request.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            route_path = getattr(route, "path", None) or "unmatched"
+            http_requests_total.inc(scope["method"], route_path, str(status_code))
+            http_request_duration_seconds.observe(time.perf_counter() - started, scope["method"], route_path)
@@ -0,0 +1,17 @@
+from sqlalchemy import Column, Integer, String, Enum, ForeignKey, DateTime
+from sqlalchemy.sql import func
+from database.mysql import Base
+
+class EnrollmentJob(Base):
+    __tablename__ = "enrollment_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    student_id = Column(Integer, ForeignKey("students.id", ondelete="CASCADE"), nullable=False, index=True)
+    image_url = Column(String(255), nullable=False)  # Ảnh dùng để tính embedding (ảnh của học sinh lúc tạo job)
+    status = Column(Enum("pending", "processing", "done", "failed", "cancelled"), default="pending", nullable=False, index=True)
+    attempts = Column(Integer, default=0, nullable=False)  # Số lần đã thử xử lý
+    last_error = Column(String(500), nullable=True)
+    next_attempt_at = Column(DateTime, default=func.now(), nullable=False)  # Chưa tới thời điểm này thì worker chưa lấy job
+    locked_at = Column(DateTime, nullable=True)  # Thời điểm worker nhận job (để lấy lại job bị treo)
+    created_at = Column(DateTime, default=func.now())
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, LargeBinary
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from database.mysql import Base
@@ -8,7 +8,10 @@ class FaceEmbedding(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     student_id = Column(Integer, ForeignKey("students.id"), nullable=False)
-    embedding = Column(String(4096), nullable=False)  # Lưu vector đặc trưng dưới dạng chuỗi JSON hoặc chuỗi dài
+    embedding = Column(String(4096), nullable=True)  # Định dạng cũ: vector dưới dạng chuỗi JSON (chỉ còn ở các dòng chưa chuyển đổi)
+    vector = Column(LargeBinary, nullable=True)  # Vector float32 kèm header (xem utils/embedding_codec.py)
+    source = Column(String(20), nullable=True)  # "profile": từ ảnh đại diện (NULL ở dữ liệu cũ), "photo": ảnh mẫu bổ sung, "capture": chụp khi điểm danh
+    image_url = Column(String(255), nullable=True)  # Ảnh mẫu bổ sung tạo ra vector này
     created_at = Column(DateTime, default=func.now())  # Lưu thời điểm tạo
 
     # Mối quan hệ với bảng students (một học sinh có nhiều embedding, nhưng thường chỉ cần 1 embedding chính)
@@ -1,6 +1,7 @@
 from sqlalchemy import Column, Integer, Date, Time, ForeignKey
 from sqlalchemy.orm import relationship
 from database.mysql import Base
+from models.session_stats_model import SessionAttendanceStats  # noqa: F401  (đăng ký model cho relationship `stats`)
 
 class Session(Base):
     __tablename__ = "sessions"
@@ -23,4 +24,6 @@ class Session(Base):
     students = relationship("SessionStudent", back_populates="session", cascade="all, delete-orphan")
     
     grades = relationship("Grade", back_populates="session", cascade="all, delete-orphan")
+
+    stats = relationship("SessionAttendanceStats", back_populates="session", uselist=False, cascade="all, delete-orphan")
     
@@ -0,0 +1,23 @@
+from sqlalchemy import Column, Integer, ForeignKey, DateTime
+from sqlalchemy.orm import relationship
+from sqlalchemy.sql import func
+from database.mysql import Base
+
+class SessionAttendanceStats(Base):
+    # Số liệu điểm danh được cập nhật cùng transaction với mỗi lần ghi điểm danh/đăng ký (xem utils/attendance_stats.py)
+    __tablename__ = "session_attendance_stats"
+
+    session_id = Column(Integer, ForeignKey("sessions.id", ondelete="CASCADE"), primary_key=True)
+    enrolled = Column(Integer, default=0, nullable=False)  # Số học sinh trong session_students
+    present = Column(Integer, default=0, nullable=False)
+    late = Column(Integer, default=0, nullable=False)
+    absent = Column(Integer, default=0, nullable=False)
+    excused = Column(Integer, default=0, nullable=False)
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+    session = relationship("Session", back_populates="stats")
+
+    @property
+    def attendance_rate(self):
+        # Tỉ lệ có mặt (%) theo sĩ số của buổi học
+        return self.present / self.enrolled * 100 if self.enrolled else 0.0
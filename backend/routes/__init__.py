@@ -15,6 +15,8 @@ from routes.banners import router as banner_router
 from routes.grades import router as grade_router 
 from routes.sessions import router as session_router 
 from routes.face import router as face_router
+from routes.health import router as health_router
+from routes.metrics import router as metrics_router
 
 # Khởi tạo router chính
 router = APIRouter()
@@ -36,3 +38,5 @@ router.include_router(banner_router, prefix="/banners", tags=["Banners"])
 router.include_router(grade_router, prefix="/grades", tags=["Grades"])
 router.include_router(session_router, prefix="/sessions", tags=["Sessions"])
 router.include_router(face_router, prefix="/face", tags=["Face"])
+router.include_router(health_router, prefix="/health", tags=["Health"])
+router.include_router(metrics_router, prefix="/metrics", tags=["Metrics"])
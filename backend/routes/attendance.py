@@ -77,7 +77,8 @@ def get_attendance_by_class(
 
 
 
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse
 from models.student_model import Student
 from models.face_embeddings import FaceEmbedding
 from models.attendance_model import Attendance
@@ -90,7 +91,7 @@ import cv2
 from deepface import DeepFace
 from datetime import date
 from pydantic import ValidationError
-from schemas.face_attendance_schema import FaceAttendanceRequest, FaceAttendanceResponse, FaceAttendanceErrorResponse
+from schemas.face_attendance_schema import FaceAttendanceRequest, FaceAttendanceResponse, FaceAttendanceErrorResponse, GroupFaceAttendanceRequest, GroupFaceAttendanceResponse, RecognizedFace
 
 router = APIRouter()
 
@@ -186,17 +187,149 @@ router = APIRouter()
 #         raise HTTPException(status_code=500, detail=f"Lỗi khi xử lý điểm danh: {str(e)}")
 
 
-import json
-
-from utils.image_processing import load_image_from_base64, detect_and_crop_face, extract_face_embedding, cosine_similarity
+import os
+import logging
+from starlette.concurrency import run_in_threadpool
+from models.session_student_model import SessionStudent
+from models.user import User
+from database.mysql import SessionLocal
+from utils.security import decode_access_token
+from utils.embedding_index import embedding_index
+from utils.image_processing import load_image_from_base64, detect_and_crop_faces, extract_face_embeddings
+from utils.inference_executor import inference_executor, InferenceQueueFull
+from utils.inference_batcher import frame_batcher
+from utils.recognition_cache import recognition_cache, frame_voter
+from utils.frame_prefilter import FrameRejected
+from utils.template_refresh import template_refresher
+from utils.attendance_writer import upsert_attendance
+from utils.metrics import face_stage_duration_seconds, face_frames_total, sample_debug
+
+# Kích thước tối đa của một khung hình JPEG gửi qua WebSocket
+FACE_WS_MAX_FRAME_BYTES = int(os.getenv("FACE_WS_MAX_FRAME_BYTES", str(2 * 1024 * 1024)))
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
 
+def _get_class_session(db: Session, class_id: int, session_date: date):
+    class_obj = db.query(Class).filter(Class.id == class_id).first()
+    if not class_obj:
+        raise HTTPException(status_code=404, detail="Lớp học không tồn tại")
+
+    session = db.query(SessionModel).filter(
+        SessionModel.class_id == class_id,
+        SessionModel.date == session_date
+    ).first()
+    if not session:
+        raise HTTPException(status_code=404, detail="Buổi học không tồn tại")
+
+    return class_obj, session
+
+
+def _get_candidate_ids(db: Session, session):
+    # Danh sách học sinh của buổi học; nếu buổi học chưa có danh sách riêng thì lấy theo lớp
+    roster = db.query(SessionStudent.student_id).filter(SessionStudent.session_id == session.id).all()
+    if not roster:
+        roster = db.query(ClassStudent.student_id).filter(ClassStudent.class_id == session.class_id).all()
+    return [student_id for (student_id,) in roster]
+
+
+def _match_embedding(db: Session, embedding, session, candidate_ids=None):
+    # Trả về (student_id, similarity) hoặc None; candidate_ids=None nghĩa là tìm trong toàn trường
+    embedding_index.ensure_loaded(db)
+    with face_stage_duration_seconds.time("match"):
+        if candidate_ids is None:
+            match = embedding_index.search(embedding)
+        else:
+            match = embedding_index.search_scoped(embedding, ("session", session.id), candidate_ids)
+    if sample_debug():
+        logger.debug("Kết quả so khớp buổi học %s (%s ứng viên): %s", session.id, "toàn trường" if candidate_ids is None else len(candidate_ids), match)
+    return match
+
+
+def _confirm_and_mark(db: Session, session, match, client_key, embedding=None):
+    # Trả về FaceAttendanceResponse khi đã xác nhận, hoặc None khi cần thêm khung hình để bỏ phiếu
+    student_id, similarity = match
+
+    # Học sinh vừa được điểm danh: trả về ngay, không ghi lại vào DB
+    full_name = recognition_cache.get(session.class_id, session.date, student_id)
+    if full_name is not None:
+        face_frames_total.inc("cached")
+        return FaceAttendanceResponse(student_id=student_id, full_name=full_name, message="Học sinh đã được điểm danh")
+
+    if not frame_voter.vote(client_key, student_id):
+        face_frames_total.inc("pending")
+        return None
+
+    student = db.query(Student).filter(Student.id == student_id).first()
+    if not student:
+        raise HTTPException(status_code=404, detail="Không tìm thấy học sinh phù hợp")
+
+    _mark_present(db, session, student)
+    face_frames_total.inc("recognized")
+    recognition_cache.add(session.class_id, session.date, student.id, student.full_name)
+    # Khung hình khớp chắc chắn được dùng làm ảnh mẫu mới (nếu bật FACE_TEMPLATE_REFRESH)
+    template_refresher.offer(db, student.id, embedding, similarity)
+    return FaceAttendanceResponse(student_id=student.id, full_name=student.full_name)
 
-@router.post("/face-attendance", response_model=FaceAttendanceResponse, responses={404: {"model": FaceAttendanceErrorResponse}, 422: {"model": FaceAttendanceErrorResponse}})
+
+def _pending_response():
+    return JSONResponse(status_code=202, content={"detail": "Đang xác nhận khuôn mặt, vui lòng giữ nguyên vị trí"})
+
+
+def _mark_present_many(db: Session, session, student_ids):
+    # Ghi nhận "Present" cho nhiều học sinh trong một transaction
+    with face_stage_duration_seconds.time("db_write"):
+        _write_present(db, session, student_ids)
+
+
+def _write_present(db: Session, session, student_ids):
+    upsert_attendance(db, session, dict.fromkeys(student_ids, "Present"))
+    db.commit()
+
+
+def _mark_present(db: Session, session, student):
+    _mark_present_many(db, session, [student.id])
+
+
+def _embed_group_photo(image_base64: str):
+    # Phát hiện tất cả khuôn mặt trong ảnh lớp học và trích xuất embedding cho cả lô
+    img = load_image_from_base64(image_base64)
+    if img is None:
+        raise Exception("Không thể giải mã ảnh")
+    faces, boxes = detect_and_crop_faces(img)
+    if not faces:
+        return [], []
+    return extract_face_embeddings(faces), boxes
+
+
+def _assign_and_mark_group(db: Session, session, embeddings, global_search: bool):
+    # Ghép một-một giữa các khuôn mặt và học sinh để không học sinh nào bị ghép hai lần, rồi ghi "Present"
+    embedding_index.ensure_loaded(db)
+    if global_search:
+        assignments = embedding_index.assign(embeddings)
+    else:
+        candidate_ids = _get_candidate_ids(db, session)
+        assignments = embedding_index.assign(embeddings, ("session", session.id), candidate_ids)
+
+    students = {}
+    if assignments:
+        student_ids = [student_id for _, student_id, _ in assignments]
+        students = {student.id: student for student in db.query(Student).filter(Student.id.in_(student_ids)).all()}
+        # Bỏ qua các học sinh vừa được điểm danh gần đây
+        to_mark = [student_id for student_id in students if recognition_cache.get(session.class_id, session.date, student_id) is None]
+        if to_mark:
+            _mark_present_many(db, session, to_mark)
+            for student_id in to_mark:
+                recognition_cache.add(session.class_id, session.date, student_id, students[student_id].full_name)
+    return assignments, students
+
+
+@router.post("/face-attendance", response_model=FaceAttendanceResponse, responses={404: {"model": FaceAttendanceErrorResponse}, 422: {"model": FaceAttendanceErrorResponse}, 503: {"model": FaceAttendanceErrorResponse}})
 async def face_attendance(
     request: FaceAttendanceRequest,
+    raw_request: Request,
     db: Session = Depends(get_db),
     current_user: dict = Depends(get_current_user)
 ):
@@ -204,135 +337,229 @@ async def face_attendance(
         raise HTTPException(status_code=403, detail="Bạn không có quyền thực hiện điểm danh")
 
     try:
-        # Xử lý ảnh nhận từ base64
-        img = load_image_from_base64(request.image)
-        face_img = detect_and_crop_face(img)
-        new_embedding = extract_face_embedding(face_img)
-        print("Embedding của ảnh điểm danh:", new_embedding)
-
-        # Lấy tất cả embedding từ database
-        face_embeddings = db.query(FaceEmbedding).all()
-
-        matched_student = None
-        max_similarity = -1
-
-        for embedding in face_embeddings:
-            stored_embedding = np.array(json.loads(embedding.embedding))
-            similarity = cosine_similarity(np.array(new_embedding), stored_embedding)
-            print(f"Độ tương đồng với học sinh ID {embedding.student_id}: {similarity:.4f}")
-            if similarity > 0.8 and similarity > max_similarity: 
-                max_similarity = similarity
-                matched_student = db.query(Student).filter(Student.id == embedding.student_id).first()
-
-
-        if matched_student:
-            class_obj = db.query(Class).filter(Class.id == request.class_id).first()
-            if not class_obj:
-                raise HTTPException(status_code=404, detail="Lớp học không tồn tại")
-
-            session = db.query(SessionModel).filter(
-                SessionModel.class_id == request.class_id,
-                SessionModel.date == request.session_date
-            ).first()
-            if not session:
-                raise HTTPException(status_code=404, detail="Buổi học không tồn tại")
-
-            existing_attendance = db.query(Attendance).filter(
-                Attendance.class_id == request.class_id,
-                Attendance.session_id == session.id,
-                Attendance.student_id == matched_student.id
-            ).first()
-
-            if existing_attendance:
-                existing_attendance.status = "Present"
-                existing_attendance.session_date = request.session_date  
-                db.commit()  
-                return FaceAttendanceResponse(student_id=matched_student.id, full_name=matched_student.full_name)
-
-            attendance = Attendance(
-                class_id=request.class_id,
-                session_id=session.id,
-                student_id=matched_student.id,
-                session_date=request.session_date,
-                status="Present"
-            )
-            db.add(attendance)
-            db.commit()
-
-            return FaceAttendanceResponse(student_id=matched_student.id, full_name=matched_student.full_name)
-        else:
+        # Truy vấn DB là code đồng bộ: chạy trong threadpool để không chặn event loop
+        _, session = await run_in_threadpool(_get_class_session, db, request.class_id, request.session_date)
+
+        # Xử lý ảnh nhận từ base64: gom lô với các khung hình đồng thời, chạy ngoài event loop
+        client_key = (request.client_id or raw_request.client.host, request.class_id)
+        new_embedding = await frame_batcher.submit((request.image, client_key))
+        if sample_debug():
+            logger.debug("Embedding của ảnh điểm danh (%s): %s", client_key, new_embedding)
+
+        # So khớp với chỉ mục embedding trong bộ nhớ
+        candidate_ids = None if request.global_search else await run_in_threadpool(_get_candidate_ids, db, session)
+        match = await run_in_threadpool(_match_embedding, db, new_embedding, session, candidate_ids)
+        if not match:
+            face_frames_total.inc("no_match")
+            frame_voter.miss(client_key)
             raise HTTPException(status_code=404, detail="Không tìm thấy học sinh phù hợp")
 
+        response = await run_in_threadpool(_confirm_and_mark, db, session, match, client_key, new_embedding)
+        if response is None:
+            return _pending_response()
+        return response
+
+    except HTTPException:
+        raise
+    except FrameRejected as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except InferenceQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
-        print(f"⚠️ Lỗi khi xử lý điểm danh: {e}")
+        logger.exception(f"⚠️ Lỗi khi xử lý điểm danh: {e}")
         raise HTTPException(status_code=500, detail=f"Lỗi khi xử lý điểm danh: {e}")
 
 
-@router.post("/face-attendance/public", response_model=FaceAttendanceResponse, responses={404: {"model": FaceAttendanceErrorResponse}, 422: {"model": FaceAttendanceErrorResponse}})
+@router.post("/face-attendance/public", response_model=FaceAttendanceResponse, responses={404: {"model": FaceAttendanceErrorResponse}, 422: {"model": FaceAttendanceErrorResponse}, 503: {"model": FaceAttendanceErrorResponse}})
 async def face_attendance_public(
     request: FaceAttendanceRequest,
+    raw_request: Request,
     db: Session = Depends(get_db)
 ):
     try:
-        # Xử lý ảnh nhận từ base64
-        img = load_image_from_base64(request.image)
-        face_img = detect_and_crop_face(img)
-        new_embedding = extract_face_embedding(face_img)
-        print("[PUBLIC] Embedding của ảnh điểm danh:", new_embedding)
-
-        # Lấy tất cả embedding từ database
-        face_embeddings = db.query(FaceEmbedding).all()
-
-        matched_student = None
-        max_similarity = -1
-
-        for embedding in face_embeddings:
-            stored_embedding = np.array(json.loads(embedding.embedding))
-            similarity = cosine_similarity(np.array(new_embedding), stored_embedding)
-            print(f"[PUBLIC] Độ tương đồng với học sinh ID {embedding.student_id}: {similarity:.4f}")
-            if similarity > 0.8 and similarity > max_similarity:
-                max_similarity = similarity
-                matched_student = db.query(Student).filter(Student.id == embedding.student_id).first()
-
-        if matched_student:
-            class_obj = db.query(Class).filter(Class.id == request.class_id).first()
-            if not class_obj:
-                raise HTTPException(status_code=404, detail="Lớp học không tồn tại")
-
-            session = db.query(SessionModel).filter(
-                SessionModel.class_id == request.class_id,
-                SessionModel.date == request.session_date
-            ).first()
-            if not session:
-                raise HTTPException(status_code=404, detail="Buổi học không tồn tại")
-
-            existing_attendance = db.query(Attendance).filter(
-                Attendance.class_id == request.class_id,
-                Attendance.session_id == session.id,
-                Attendance.student_id == matched_student.id
-            ).first()
-
-            if existing_attendance:
-                existing_attendance.status = "Present"
-                existing_attendance.session_date = request.session_date
-                db.commit()
-                return FaceAttendanceResponse(student_id=matched_student.id, full_name=matched_student.full_name)
-
-            attendance = Attendance(
-                class_id=request.class_id,
-                session_id=session.id,
-                student_id=matched_student.id,
-                session_date=request.session_date,
-                status="Present"
-            )
-            db.add(attendance)
-            db.commit()
-
-            return FaceAttendanceResponse(student_id=matched_student.id, full_name=matched_student.full_name)
-        else:
+        # Truy vấn DB là code đồng bộ: chạy trong threadpool để không chặn event loop
+        _, session = await run_in_threadpool(_get_class_session, db, request.class_id, request.session_date)
+
+        # Xử lý ảnh nhận từ base64: gom lô với các khung hình đồng thời, chạy ngoài event loop
+        client_key = (request.client_id or raw_request.client.host, request.class_id)
+        new_embedding = await frame_batcher.submit((request.image, client_key))
+        if sample_debug():
+            logger.debug("[PUBLIC] Embedding của ảnh điểm danh (%s): %s", client_key, new_embedding)
+
+        # So khớp với chỉ mục embedding trong bộ nhớ
+        candidate_ids = None if request.global_search else await run_in_threadpool(_get_candidate_ids, db, session)
+        match = await run_in_threadpool(_match_embedding, db, new_embedding, session, candidate_ids)
+        if not match:
+            face_frames_total.inc("no_match")
+            frame_voter.miss(client_key)
             raise HTTPException(status_code=404, detail="Không tìm thấy học sinh phù hợp")
 
+        response = await run_in_threadpool(_confirm_and_mark, db, session, match, client_key, new_embedding)
+        if response is None:
+            return _pending_response()
+        return response
+
+    except HTTPException:
+        raise
+    except FrameRejected as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except InferenceQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        logger.exception(f"⚠️ [PUBLIC] Lỗi khi xử lý điểm danh: {e}")
+        raise HTTPException(status_code=500, detail=f"Lỗi khi xử lý điểm danh: {e}")
+
+
+# 🟢 API: Điểm danh theo nhóm từ một ảnh chụp cả lớp
+@router.post("/face-attendance/group", response_model=GroupFaceAttendanceResponse, responses={404: {"model": FaceAttendanceErrorResponse}, 503: {"model": FaceAttendanceErrorResponse}})
+async def group_face_attendance(
+    request: GroupFaceAttendanceRequest,
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(get_current_user)
+):
+    if current_user.role not in ["teacher", "manager"]:
+        raise HTTPException(status_code=403, detail="Bạn không có quyền thực hiện điểm danh")
+
+    try:
+        _, session = await run_in_threadpool(_get_class_session, db, request.class_id, request.session_date)
+
+        embeddings, boxes = await inference_executor.run(_embed_group_photo, request.image)
+        if not embeddings:
+            raise HTTPException(status_code=404, detail="Không phát hiện được khuôn mặt trong ảnh")
+
+        # So khớp và ghi DB là code đồng bộ: chạy trong threadpool để không chặn event loop
+        assignments, students = await run_in_threadpool(_assign_and_mark_group, db, session, embeddings, request.global_search)
+
+        recognized = [
+            RecognizedFace(student_id=student_id, full_name=students[student_id].full_name, similarity=round(similarity, 4), box=boxes[face_idx])
+            for face_idx, student_id, similarity in assignments
+            if student_id in students
+        ]
+        matched_faces = {face_idx for face_idx, student_id, _ in assignments if student_id in students}
+        unmatched_boxes = [box for face_idx, box in enumerate(boxes) if face_idx not in matched_faces]
+
+        return GroupFaceAttendanceResponse(total_faces=len(boxes), recognized=recognized, unmatched_boxes=unmatched_boxes)
+
+    except HTTPException:
+        raise
+    except InferenceQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
-        print(f"⚠️ [PUBLIC] Lỗi khi xử lý điểm danh: {e}")
+        db.rollback()
+        logger.exception(f"⚠️ [GROUP] Lỗi khi xử lý điểm danh: {e}")
         raise HTTPException(status_code=500, detail=f"Lỗi khi xử lý điểm danh: {e}")
 
+
+def _authenticate_websocket(db: Session, token: str):
+    # Trình duyệt không gửi được header Authorization khi mở WebSocket nên token được truyền qua query string
+    payload = decode_access_token(token) if token else None
+    if not payload:
+        return None
+    return db.query(User).filter(User.email == payload.get("sub")).first()
+
+
+async def _recognize_ws_frame(frame: bytes, session, candidate_ids, client_key, marked):
+    try:
+        embedding = await frame_batcher.submit((frame, client_key))
+    except InferenceQueueFull as e:
+        return {"event": "busy", "detail": str(e)}
+    except FrameRejected as e:
+        return {"event": "no_face", "reason": e.reason, "detail": str(e)}
+    except Exception as e:
+        logger.exception(f"⚠️ [WS] Lỗi khi xử lý khung hình: {e}")
+        return {"event": "error", "detail": f"Lỗi khi xử lý khung hình: {e}"}
+
+    # So khớp và ghi DB là code đồng bộ: chạy trong threadpool để một truy vấn chậm không chặn các kết nối khác trên event loop
+    return await run_in_threadpool(_recognize_ws_match, embedding, session, candidate_ids, client_key, marked)
+
+
+def _recognize_ws_match(embedding, session, candidate_ids, client_key, marked):
+    db = SessionLocal()
+    try:
+        match = _match_embedding(db, embedding, session, candidate_ids)
+        if not match:
+            face_frames_total.inc("no_match")
+            frame_voter.miss(client_key)
+            return {"event": "no_match"}
+
+        # Học sinh đã được điểm danh trên kết nối này: trả về ngay, không bỏ phiếu / ghi DB lại
+        if match[0] in marked:
+            face_frames_total.inc("cached")
+            return {
+                "event": "recognized",
+                "student_id": match[0],
+                "full_name": marked[match[0]],
+                "similarity": round(match[1], 4),
+                "already_marked": True
+            }
+
+        response = _confirm_and_mark(db, session, match, client_key, embedding)
+        if response is None:
+            return {"event": "pending", "student_id": match[0]}
+        marked[response.student_id] = response.full_name
+        return {
+            "event": "recognized",
+            "student_id": response.student_id,
+            "full_name": response.full_name,
+            "similarity": round(match[1], 4),
+            "already_marked": response.message is not None
+        }
+    except HTTPException as e:
+        return {"event": "no_match", "detail": e.detail}
+    except Exception as e:
+        db.rollback()
+        logger.exception(f"⚠️ [WS] Lỗi khi xử lý điểm danh: {e}")
+        return {"event": "error", "detail": f"Lỗi khi xử lý điểm danh: {e}"}
+    finally:
+        db.close()
+
+
+# 🟢 WebSocket: Điểm danh liên tục, client gửi từng khung hình JPEG dạng nhị phân và nhận lại sự kiện nhận diện
+@router.websocket("/ws/face-attendance")
+async def face_attendance_ws(
+    websocket: WebSocket,
+    class_id: int,
+    session_date: date,
+    token: str = Query(None),
+    global_search: bool = False
+):
+    # Xác thực và nạp trạng thái của kết nối (buổi học, danh sách học sinh) một lần duy nhất
+    db = SessionLocal()
+    try:
+        user = _authenticate_websocket(db, token)
+        if not user or user.role not in ["teacher", "manager"]:
+            await websocket.close(code=4403, reason="Bạn không có quyền thực hiện điểm danh")
+            return
+        try:
+            _, session = _get_class_session(db, class_id, session_date)
+        except HTTPException as e:
+            await websocket.close(code=4404, reason=e.detail)
+            return
+        candidate_ids = None if global_search else _get_candidate_ids(db, session)
+    finally:
+        db.close()
+
+    await websocket.accept()
+    await websocket.send_json({
+        "event": "ready",
+        "session_id": session.id,
+        "roster_size": len(candidate_ids) if candidate_ids is not None else None
+    })
+
+    client_key = ("ws", id(websocket))
+    marked = {}  # student_id -> full_name của các học sinh đã được điểm danh trên kết nối này
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            frame = message.get("bytes")
+            if frame is None:
+                await websocket.send_json({"event": "error", "detail": "Chỉ nhận khung hình JPEG dạng nhị phân"})
+                continue
+            if len(frame) > FACE_WS_MAX_FRAME_BYTES:
+                await websocket.send_json({"event": "error", "detail": "Khung hình quá lớn"})
+                continue
+            await websocket.send_json(await _recognize_ws_frame(frame, session, candidate_ids, client_key, marked))
+    except WebSocketDisconnect:
+        pass
@@ -1,6 +1,6 @@
 from fastapi import APIRouter, HTTPException, Depends
 from sqlalchemy.orm import Session
-from sqlalchemy import outerjoin
+from sqlalchemy import outerjoin, insert, func
 from database import get_db
 from models.class_model import Class
 from models.schedule_model import Schedule
@@ -10,7 +10,7 @@ from models.class_students_model import ClassStudent
 from models.session_student_model import SessionStudent
 from models.user import User
 from models.attendance_model import Attendance
-from schemas.class_schema import ClassCreate, ClassUpdate, ClassResponse
+from schemas.class_schema import ClassCreate, ClassUpdate, ClassResponse, ClassEnrollmentBatch, ClassEnrollmentBatchResponse
 from schemas.student_schema import StudentResponse
 from schemas.session_schema import SessionResponse
 from schemas.attendance_schema import AttendanceCreate, AttendanceResponse
@@ -21,6 +21,10 @@ from fastapi.responses import FileResponse
 import os
 from datetime import datetime, timedelta, time, date
 from routes.user import get_current_user 
+from utils.recognition_cache import recognition_cache
+from utils.attendance_stats import StatsDelta, load_session_stats
+from utils.attendance_writer import upsert_attendance
+from models.session_stats_model import SessionAttendanceStats
 
 router = APIRouter()
 
@@ -178,7 +182,8 @@ def create_class(
                     date=session_date,
                     start_time=start_time,
                     end_time=end_time,
-                    room_id=room_id  # Lưu phòng học cho buổi học
+                    room_id=room_id,  # Lưu phòng học cho buổi học
+                    stats=SessionAttendanceStats()  # Số liệu điểm danh của buổi học (bắt đầu từ 0)
                 )
                 session_objects.append(session_obj)
 
@@ -278,7 +283,8 @@ def update_class(
                         date=current_date,
                         start_time=start_time,
                         end_time=end_time,
-                        room_id=room_id  # Lưu phòng học cho buổi học
+                        room_id=room_id,  # Lưu phòng học cho buổi học
+                        stats=SessionAttendanceStats()
                     )
                     session_list.append(new_session)
                     sessions_count += 1
@@ -438,6 +444,78 @@ def get_students_by_class(
 
 #     return {"message": "Học sinh đã được thêm vào lớp"}
 
+def _enroll_students(db: Session, class_id: int, student_ids):
+    """
+    Thêm học sinh vào lớp và vào các buổi học từ hôm nay trở đi, kèm bản ghi điểm danh "Absent" (không commit).
+    Mỗi bảng được chèn bằng một lệnh INSERT nhiều dòng cho cả học sinh × buổi học.
+    """
+    now = datetime.utcnow()
+    db.execute(insert(ClassStudent), [{"class_id": class_id, "student_id": student_id, "enrolled_at": now} for student_id in student_ids])
+
+    # Lấy danh sách tất cả các session trong lớp học từ ngày thêm học sinh cho đến ngày cuối
+    sessions = db.query(SessionModel.id, SessionModel.date).filter(SessionModel.class_id == class_id, SessionModel.date >= now.date()).order_by(SessionModel.date).all()
+    if not sessions:
+        return
+    session_ids = [session.id for session in sessions]
+
+    # Bỏ qua các cặp buổi học - học sinh đã có sẵn (dữ liệu còn sót lại từ lần đăng ký trước)
+    linked = set(db.query(SessionStudent.session_id, SessionStudent.student_id).filter(
+        SessionStudent.session_id.in_(session_ids), SessionStudent.student_id.in_(student_ids)
+    ).all())
+    marked = set(db.query(Attendance.session_id, Attendance.student_id).filter(
+        Attendance.session_id.in_(session_ids), Attendance.student_id.in_(student_ids)
+    ).all())
+
+    stats = StatsDelta()
+    session_students, attendances = [], []
+    for session in sessions:
+        for student_id in student_ids:
+            if (session.id, student_id) not in linked:
+                session_students.append({"session_id": session.id, "student_id": student_id})
+                stats.enrollment_changed(session.id, 1)
+            if (session.id, student_id) not in marked:
+                attendances.append({
+                    "session_id": session.id,
+                    "student_id": student_id,
+                    "class_id": class_id,
+                    "status": "Absent",
+                    "session_date": session.date
+                })
+                stats.status_changed(session.id, None, "Absent")
+
+    if session_students:
+        db.execute(insert(SessionStudent), session_students)
+    if attendances:
+        db.execute(insert(Attendance), attendances)
+    stats.apply(db)
+
+
+def _unenroll_students(db: Session, class_id: int, student_ids):
+    # Gỡ học sinh khỏi lớp và khỏi các buổi học từ hôm nay trở đi bằng các lệnh DELETE theo tập hợp (không commit)
+    db.query(ClassStudent).filter(ClassStudent.class_id == class_id, ClassStudent.student_id.in_(student_ids)).delete(synchronize_session=False)
+
+    session_ids = [session_id for (session_id,) in db.query(SessionModel.id).filter(SessionModel.class_id == class_id, SessionModel.date >= datetime.utcnow().date()).all()]
+    if not session_ids:
+        return
+
+    stats = StatsDelta()
+    # Khoá các bản ghi điểm danh sắp xoá để số liệu buổi học trừ đúng trạng thái hiện tại
+    for session_id, status in db.query(Attendance.session_id, Attendance.status).filter(
+        Attendance.session_id.in_(session_ids), Attendance.student_id.in_(student_ids)
+    ).with_for_update().all():
+        stats.status_changed(session_id, status, None)
+    for session_id, count in db.query(SessionStudent.session_id, func.count(SessionStudent.student_id)).filter(
+        SessionStudent.session_id.in_(session_ids), SessionStudent.student_id.in_(student_ids)
+    ).group_by(SessionStudent.session_id).all():
+        stats.enrollment_changed(session_id, -count)
+
+    db.query(SessionStudent).filter(SessionStudent.session_id.in_(session_ids), SessionStudent.student_id.in_(student_ids)).delete(synchronize_session=False)
+    db.query(Attendance).filter(Attendance.session_id.in_(session_ids), Attendance.student_id.in_(student_ids)).delete(synchronize_session=False)
+
+    # Số liệu buổi học được cập nhật cùng transaction với việc xoá
+    stats.apply(db)
+
+
 @router.post("/{class_id}/enroll/{student_id}")
 def enroll_student(
     class_id: int,
@@ -460,31 +538,9 @@ def enroll_student(
     if existing_enrollment:
         raise HTTPException(status_code=400, detail="Học sinh đã đăng ký lớp này")
 
-    # Thêm học sinh vào lớp học
-    new_enrollment = ClassStudent(class_id=class_id, student_id=student_id, enrolled_at=datetime.utcnow())
-    db.add(new_enrollment)
-    db.commit()  # Commit để lưu học sinh vào lớp
-
-    # Lấy danh sách tất cả các session trong lớp học từ ngày thêm học sinh cho đến ngày cuối
-    sessions = db.query(SessionModel).filter(SessionModel.class_id == class_id, SessionModel.date >= datetime.utcnow().date()).order_by(SessionModel.date).all()
-
-    # Thêm học sinh vào tất cả các session
-    for session in sessions:
-        # Lưu vào bảng session_students
-        session_student = SessionStudent(session_id=session.id, student_id=student_id)
-        db.add(session_student)
-
-        # Tạo bản ghi điểm danh cho học sinh trong session
-        attendance_record = Attendance(
-            session_id=session.id,
-            student_id=student_id,
-            class_id=class_id,
-            status="Absent",
-            session_date=session.date  
-        )
-        db.add(attendance_record)
-
-    db.commit() 
+    # Thêm học sinh vào lớp học và tất cả các session
+    _enroll_students(db, class_id, [student_id])
+    db.commit()
 
     return {"message": "Học sinh đã được thêm vào lớp và vào tất cả các buổi học từ ngày đăng ký, cùng với bản ghi điểm danh."}
 
@@ -512,30 +568,82 @@ def unenroll_student(
     if not existing_enrollment:
         raise HTTPException(status_code=400, detail="Học sinh không đăng ký lớp học này")
 
-    # Xóa học sinh khỏi lớp học
-    db.delete(existing_enrollment)
+    _unenroll_students(db, class_id, [student_id])
     db.commit()
-    
-    sessions = db.query(SessionModel).filter(SessionModel.class_id == class_id, SessionModel.date >= datetime.utcnow().date()).all()
-    for session in sessions:
-        session_student = db.query(SessionStudent).filter_by(session_id=session.id, student_id=student_id).first()
-        if session_student:
-            db.delete(session_student)
-            db.commit()
-        
-        # Xóa bản ghi điểm danh của học sinh trong các session này
-        attendance_record = db.query(Attendance).filter_by(session_id=session.id, student_id=student_id).first()
-        if attendance_record:
-            db.delete(attendance_record)
-            db.commit()
 
     return {"message": "Học sinh đã được gỡ khỏi lớp và tất cả các buổi học"}
 
 
+# API thêm nhiều học sinh vào lớp trong một transaction
+@router.post("/{class_id}/enroll", response_model=ClassEnrollmentBatchResponse)
+def enroll_students(
+    class_id: int,
+    data: ClassEnrollmentBatch,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    if current_user.role not in ["admin", "manager"]:
+        raise HTTPException(status_code=403, detail="Bạn không có quyền thêm học sinh vào lớp")
+
+    class_obj = db.query(Class).filter(Class.id == class_id).first()
+    if not class_obj:
+        raise HTTPException(status_code=404, detail="Lớp học không tồn tại")
+
+    student_ids = list(dict.fromkeys(data.student_ids))
+    found = {student_id for (student_id,) in db.query(Student.id).filter(Student.id.in_(student_ids)).all()}
+    missing = [student_id for student_id in student_ids if student_id not in found]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Học sinh không tồn tại: {missing}")
+
+    # Học sinh đã đăng ký lớp này thì bỏ qua
+    enrolled = {student_id for (student_id,) in db.query(ClassStudent.student_id).filter(ClassStudent.class_id == class_id, ClassStudent.student_id.in_(student_ids)).all()}
+    new_ids = [student_id for student_id in student_ids if student_id not in enrolled]
+    if new_ids:
+        _enroll_students(db, class_id, new_ids)
+        db.commit()
+
+    return {
+        "message": f"Đã thêm {len(new_ids)} học sinh vào lớp và vào tất cả các buổi học từ ngày đăng ký",
+        "students": new_ids,
+        "skipped": [student_id for student_id in student_ids if student_id in enrolled],
+    }
+
+
+# API gỡ nhiều học sinh khỏi lớp trong một transaction
+@router.post("/{class_id}/unenroll", response_model=ClassEnrollmentBatchResponse)
+def unenroll_students(
+    class_id: int,
+    data: ClassEnrollmentBatch,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    if current_user.role not in ["admin", "manager"]:
+        raise HTTPException(status_code=403, detail="Bạn không có quyền gỡ học sinh khỏi lớp")
+
+    class_obj = db.query(Class).filter(Class.id == class_id).first()
+    if not class_obj:
+        raise HTTPException(status_code=404, detail="Lớp học không tồn tại")
+
+    # Học sinh không đăng ký lớp này thì bỏ qua
+    student_ids = list(dict.fromkeys(data.student_ids))
+    enrolled = {student_id for (student_id,) in db.query(ClassStudent.student_id).filter(ClassStudent.class_id == class_id, ClassStudent.student_id.in_(student_ids)).all()}
+    removed = [student_id for student_id in student_ids if student_id in enrolled]
+    if removed:
+        _unenroll_students(db, class_id, removed)
+        db.commit()
+
+    return {
+        "message": f"Đã gỡ {len(removed)} học sinh khỏi lớp và tất cả các buổi học",
+        "students": removed,
+        "skipped": [student_id for student_id in student_ids if student_id not in enrolled],
+    }
+
+
 # API Lấy ra các sessions của lớp theo id
 @router.get("/{class_id}/sessions", response_model=List[SessionResponse])
 def get_class_sessions(
     class_id: int,
+    include_students: bool = True,
     db: Session = Depends(get_db),
     current_user=Depends(get_current_user)
 ):
@@ -555,46 +663,41 @@ def get_class_sessions(
         .order_by(SessionModel.date)
         .all()
     )
-    
-
-    session_list = []
-    for index, (session, room_name) in enumerate(sessions, start=1):
-        # Lấy danh sách học sinh của session từ bảng `session_students`
-        students = (
-            db.query(Student)
-            .join(SessionStudent, Student.id == SessionStudent.student_id)
-            .filter(SessionStudent.session_id == session.id)
+    session_ids = [session.id for session, _ in sessions]
+    if not session_ids:
+        return []
+
+    # Sĩ số và số lượt "Present" của từng buổi học lấy từ bảng số liệu (không quét bảng attendance)
+    session_stats = load_session_stats(db, session_ids)
+
+    # Danh sách học sinh của tất cả buổi học trong một truy vấn (bỏ qua khi include_students=false)
+    students_by_session = {}
+    if include_students:
+        rows = (
+            db.query(SessionStudent.session_id, Student)
+            .join(Student, Student.id == SessionStudent.student_id)
+            .filter(SessionStudent.session_id.in_(session_ids))
             .all()
         )
+        for session_id, student in rows:
+            students_by_session.setdefault(session_id, []).append(student)
 
-        # Lấy danh sách điểm danh của buổi học
-        attendance_records = (
-            db.query(Attendance)
-            .filter(Attendance.session_id == session.id)
-            .all()
-        )
-
-        # Tính tỉ lệ điểm danh
-        attendance_rate = (
-            len([a for a in attendance_records if a.status == "Present"]) / len(students)
-            if students else 0
-        )
-        class_code = db.query(Class.class_code).filter(Class.id == session.class_id).first()
-        class_code = class_code[0] if class_code else None
+    session_list = []
+    for session, room_name in sessions:
+        stats = session_stats.get(session.id)
 
         # Thêm session vào danh sách trả về (bao gồm `session_id` và `room_name`)
         session_list.append({
             "session_id": session.id,  # ✅ Thêm session_id vào response
-            # "session_number": index,
             "class_id": session.class_id,
-            "class_code": class_code,
+            "class_code": class_obj.class_code,
             "date": session.date,
             "weekday": session.date.strftime("%A"),
             "start_time": session.start_time.strftime("%H:%M"),
             "end_time": session.end_time.strftime("%H:%M"),
-            "total_students": len(students),
-            "attendance_rate": round(attendance_rate * 100, 2),
-            "students": [StudentResponse.from_orm(student) for student in students],
+            "total_students": stats.enrolled if stats else 0,
+            "attendance_rate": round(stats.attendance_rate, 2) if stats else 0.0,
+            "students": students_by_session.get(session.id, []) if include_students else None,
             "room_name": room_name  # Thêm tên phòng học vào kết quả
         })
 
@@ -629,31 +732,16 @@ def update_attendance(
     if not session:
         raise HTTPException(status_code=404, detail="Buổi học không tồn tại.")
 
-    for record in attendance_data:
-        if record.class_id != class_id:
-            raise HTTPException(status_code=400, detail="Dữ liệu không hợp lệ. class_id không khớp.")
-
-        # 🔹 Kiểm tra xem điểm danh đã tồn tại chưa
-        existing_attendance = db.query(Attendance).filter(
-            Attendance.class_id == class_id,
-            Attendance.session_id == session.id,
-            Attendance.student_id == record.student_id
-        ).first()
+    if any(record.class_id != class_id for record in attendance_data):
+        raise HTTPException(status_code=400, detail="Dữ liệu không hợp lệ. class_id không khớp.")
 
-        if existing_attendance:
-            # 🔹 Cập nhật trạng thái điểm danh nếu đã tồn tại
-            existing_attendance.status = record.status
-        else:
-            # 🔹 Tạo bản ghi điểm danh mới nếu chưa tồn tại
-            new_attendance = Attendance(
-                class_id=class_id,
-                session_id=session.id,  # ✅ Liên kết session_id thay vì chỉ dùng ngày
-                student_id=record.student_id,
-                session_date=session_date,  # 🔹 Lưu lại ngày của buổi học
-                status=record.status
-            )
-            db.add(new_attendance)
+    statuses = {record.student_id: record.status for record in attendance_data}
+    # 🔹 Cập nhật thủ công thì bỏ kết quả nhận diện khuôn mặt đã cache của các học sinh này
+    for student_id in statuses:
+        recognition_cache.discard(class_id, session.date, student_id)
 
+    # 🔹 Thêm / cập nhật điểm danh của cả lớp theo lô
+    upsert_attendance(db, session, statuses)
     db.commit()
     return {"message": "Cập nhật điểm danh thành công"}
 
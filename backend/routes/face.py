@@ -3,21 +3,30 @@ from fastapi.responses import JSONResponse
 import cv2
 import numpy as np
 from deepface import DeepFace
+from utils.inference_executor import inference_executor, InferenceQueueFull
 
 router = APIRouter()
 
+
+def _has_face(contents: bytes) -> bool:
+    nparr = np.frombuffer(contents, np.uint8)
+    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    # Sử dụng DeepFace để phát hiện khuôn mặt
+    detections = DeepFace.extract_faces(img_path = img, detector_backend = 'opencv', enforce_detection = False)
+    return bool(detections)
+
+
 @router.post("/detect")
 async def detect_face(file: UploadFile = File(...)):
     try:
         # Đọc file ảnh từ UploadFile
         contents = await file.read()
-        nparr = np.frombuffer(contents, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        # Sử dụng DeepFace để phát hiện khuôn mặt
-        detections = DeepFace.extract_faces(img_path = img, detector_backend = 'opencv', enforce_detection = False)
-        if detections and len(detections) > 0:
+        # Giải mã và phát hiện khuôn mặt trong pool luồng riêng để không chặn event loop
+        if await inference_executor.run(_has_face, contents):
             return {"success": True, "msg": "Phát hiện khuôn mặt"}
         else:
             return {"success": False, "msg": "Không phát hiện khuôn mặt"}
+    except InferenceQueueFull as e:
+        return JSONResponse(status_code=503, content={"success": False, "msg": str(e)})
     except Exception as e:
         return JSONResponse(status_code=500, content={"success": False, "msg": str(e)})
@@ -0,0 +1,13 @@
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from utils.model_registry import model_registry
+
+router = APIRouter()
+
+# 🟢 API kiểm tra trạng thái sẵn sàng của worker (model nhận diện đã nạp xong chưa)
+@router.get("")
+def health_check():
+    status = model_registry.status()
+    if not status["ready"]:
+        return JSONResponse(status_code=503, content={"status": "starting", "models": status})
+    return {"status": "ok", "models": status}
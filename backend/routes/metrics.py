@@ -0,0 +1,10 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from utils.metrics import metrics
+
+router = APIRouter()
+
+# 🟢 API xuất số liệu cho Prometheus (số request, thời gian từng bước nhận diện khuôn mặt)
+@router.get("", response_class=PlainTextResponse)
+def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -15,6 +15,7 @@ from schemas.session_schema import SessionResponse, SessionAttendanceResponse
 from database.mysql import get_db
 from models.user import User
 from routes.user import get_current_user 
+from utils.attendance_stats import load_session_stats
 
 
 router = APIRouter()
@@ -56,6 +57,9 @@ def get_session_info(session_id: int, db: Session = Depends(get_db)):
     if not session:
         raise HTTPException(status_code=404, detail="Buổi học không tồn tại")
 
+    # Số liệu điểm danh của buổi học (sĩ số, số lượt có mặt)
+    stats = load_session_stats(db, [session_id]).get(session_id)
+
     # Lấy tên phòng học
     room_name = db.query(Room.room_name).filter(Room.id == session.room_id).first()
     room_name = room_name[0] if room_name else None
@@ -73,9 +77,8 @@ def get_session_info(session_id: int, db: Session = Depends(get_db)):
     )
 
     # Tính tỉ lệ điểm danh
-    total_students = len(students)
-    attendance_records = db.query(Attendance).filter(Attendance.session_id == session_id).all()
-    attendance_rate = (len([a for a in attendance_records if a.status == "Present"]) / total_students) * 100 if total_students > 0 else 0.0
+    total_students = stats.enrolled if stats else len(students)
+    attendance_rate = stats.attendance_rate if stats else 0.0
 
     # Trả về thông tin chi tiết buổi học, bao gồm thông tin học sinh
     return SessionResponse(
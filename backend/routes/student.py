@@ -1,4 +1,5 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Query
+from sqlalchemy import insert, func
 from sqlalchemy.orm import Session
 from database.mysql import get_db
 from models.student_model import Student
@@ -7,11 +8,12 @@ from models.class_model import Class
 from models.session_student_model import SessionStudent
 from models.class_students_model import ClassStudent
 from schemas.class_schema import ClassResponse
-from schemas.student_schema import StudentCreate, StudentUpdate, StudentResponse
+from schemas.student_schema import StudentCreate, StudentUpdate, StudentResponse, EnrollmentStatusResponse, FaceTemplatesRequest
 from models.session_model import Session as SessionModel
 from models.attendance_model import Attendance
 from schemas.session_schema import StudentSessionResponse
-from typing import List
+from typing import List, Optional
+from datetime import date
 from routes.user import get_current_user  # Import xác thực user
 
 router = APIRouter()
@@ -58,8 +60,33 @@ cloudinary.config(
 )
 
 
-import json
-from utils.image_processing import load_image_from_url, detect_and_crop_face, extract_face_embedding
+from models.enrollment_job_model import EnrollmentJob
+from utils.embedding_index import embedding_index
+from utils.enrollment_queue import enqueue_enrollment, enrollment_worker
+from utils.image_processing import load_image_from_url, load_image_from_bytes, embed_face_templates
+from utils.image_fetcher import image_fetcher
+from utils.embedding_codec import encode_embedding
+from utils.attendance_stats import StatsDelta, load_session_stats
+from utils.inference_executor import inference_executor, InferenceQueueFull, FACE_INFERENCE_WORKERS
+from utils.inference_batcher import FACE_BATCH_MAX_SIZE
+from starlette.concurrency import run_in_threadpool
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from datetime import datetime
+import asyncio
+import os
+import zipfile
+import pandas as pd
+
+# Số luồng tải ảnh/upload ảnh đồng thời khi nhập học sinh hàng loạt
+STUDENT_IMPORT_FETCH_WORKERS = int(os.getenv("STUDENT_IMPORT_FETCH_WORKERS", "8"))
+STUDENT_IMPORT_MAX_ROWS = int(os.getenv("STUDENT_IMPORT_MAX_ROWS", "2000"))
+# Giới hạn file ZIP ảnh khi nhập hàng loạt (kích thước upload, số file, tổng dung lượng sau giải nén) để tránh ZIP bomb
+STUDENT_IMPORT_MAX_ZIP_BYTES = int(os.getenv("STUDENT_IMPORT_MAX_ZIP_BYTES", str(100 * 1024 * 1024)))
+STUDENT_IMPORT_MAX_ZIP_FILES = int(os.getenv("STUDENT_IMPORT_MAX_ZIP_FILES", "5000"))
+STUDENT_IMPORT_MAX_ZIP_UNCOMPRESSED = int(os.getenv("STUDENT_IMPORT_MAX_ZIP_UNCOMPRESSED", str(500 * 1024 * 1024)))
+# Số ảnh mẫu bổ sung tối đa của một học sinh (ngoài ảnh đại diện)
+FACE_TEMPLATE_MAX_PHOTOS = int(os.getenv("FACE_TEMPLATE_MAX_PHOTOS", "10"))
 
 
 @router.post("/", response_model=StudentResponse)
@@ -90,26 +117,9 @@ def create_student(
     db.commit()
     db.refresh(new_student)
 
-    # Nếu có ảnh, tiến hành xử lý khuôn mặt
+    # Nếu có ảnh, đưa vào hàng đợi đăng ký khuôn mặt (worker nền tính embedding)
     if new_student.image:
-        try:
-            img = load_image_from_url(new_student.image)
-            face_img = detect_and_crop_face(img)
-            embedding = extract_face_embedding(face_img)
-            print(img)
-            print(face_img)
-            print(embedding)
-            
-            face_embedding = FaceEmbedding(
-                student_id=new_student.id,
-                embedding=json.dumps(embedding)
-            )
-            db.add(face_embedding)
-            db.commit()
-            print("✅ Đăng ký dữ liệu khuôn mặt thành công cho học sinh ID:", new_student.id)
-        except Exception as e:
-            print(f"⚠️ Lỗi khi đăng ký dữ liệu khuôn mặt: {e}")
-            raise HTTPException(status_code=500, detail=f"Lỗi khi xử lý khuôn mặt: {e}")
+        enqueue_enrollment(db, new_student.id, new_student.image)
 
     return new_student
 
@@ -150,26 +160,278 @@ def update_student(
     db.commit()
     db.refresh(student)
 
-    # Nếu ảnh được cập nhật hoặc thay đổi, xử lý lại embedding
+    # Nếu ảnh được cập nhật hoặc thay đổi, đưa vào hàng đợi để tính lại embedding
     if student.image and student.image != old_image_url:
+        enqueue_enrollment(db, student.id, student.image)
+
+    return student
+
+
+
+def _read_import_rows(contents: bytes, filename: str):
+    if filename.endswith('.csv'):
+        df = pd.read_csv(BytesIO(contents), encoding='utf-8')
+    else:
+        df = pd.read_excel(BytesIO(contents))
+    df.columns = df.columns.str.lower().str.strip()
+    return df
+
+
+def _cell(row, column):
+    if column not in row or pd.isna(row[column]):
+        return None
+    value = str(row[column]).strip()
+    return value or None
+
+
+def _parse_import_row(row):
+    # Trả về dict các cột của bảng students, raise ValueError nếu dòng không hợp lệ
+    full_name, email, phone_number = _cell(row, 'full_name'), _cell(row, 'email'), _cell(row, 'phone_number')
+    if not full_name or not email or not phone_number:
+        raise ValueError("Thiếu thông tin bắt buộc (full_name, email, phone_number)")
+
+    date_of_birth = pd.to_datetime("2000-01-01").date()
+    if _cell(row, 'date_of_birth'):
+        try:
+            value = row['date_of_birth']
+            date_of_birth = pd.to_datetime(value).date() if isinstance(value, str) else value.date()
+        except Exception:
+            raise ValueError("Định dạng ngày sinh không hợp lệ")
+
+    admission_year = 2024
+    if _cell(row, 'admission_year'):
         try:
-            img = load_image_from_url(student.image)
-            face_img = detect_and_crop_face(img)
-            embedding = extract_face_embedding(face_img)
-            db.query(FaceEmbedding).filter(FaceEmbedding.student_id == student_id).delete()
-            face_embedding = FaceEmbedding(
-                student_id=student_id,
-                embedding=json.dumps(embedding)
-            )
-            db.add(face_embedding)
-            db.commit()
-            print("✅ Đăng ký lại dữ liệu khuôn mặt thành công cho học sinh ID:", student_id)
+            admission_year = int(float(row['admission_year']))
+        except ValueError:
+            raise ValueError("Năm nhập học không hợp lệ")
+
+    status = _cell(row, 'status') or "active"
+    if status not in ("active", "inactive", "graduated"):
+        raise ValueError("Trạng thái không hợp lệ. Chỉ chấp nhận: active, inactive, graduated")
+
+    return {
+        "full_name": full_name,
+        "email": email,
+        "phone_number": phone_number,
+        "address": _cell(row, 'address') or "Chưa cập nhật",
+        "date_of_birth": date_of_birth,
+        "admission_year": admission_year,
+        "status": status,
+        "image": _cell(row, 'image_url'),
+    }
+
+
+def _open_photo_archive(data: bytes):
+    # Kiểm tra số file và tổng dung lượng khai báo trước khi giải nén (ZipFile chỉ đọc tối đa file_size của mỗi file)
+    archive = zipfile.ZipFile(BytesIO(data))
+    entries = archive.infolist()
+    if len(entries) > STUDENT_IMPORT_MAX_ZIP_FILES:
+        raise ValueError(f"File ZIP có quá nhiều file (tối đa {STUDENT_IMPORT_MAX_ZIP_FILES})")
+    if sum(entry.file_size for entry in entries) > STUDENT_IMPORT_MAX_ZIP_UNCOMPRESSED:
+        raise ValueError(f"Dung lượng ảnh sau giải nén vượt quá {STUDENT_IMPORT_MAX_ZIP_UNCOMPRESSED // (1024 * 1024)}MB")
+    return archive
+
+
+def _fetch_import_image(student, photo_bytes):
+    # Ảnh trong file ZIP được upload lên Cloudinary để lấy URL; ảnh dạng URL được tải về.
+    # Trả về (ảnh, URL, public_id trên Cloudinary hoặc None nếu không upload)
+    if photo_bytes is not None:
+        img = load_image_from_bytes(photo_bytes)
+        if img is None:
+            raise ValueError("Không thể giải mã ảnh trong file ZIP")
+        upload_result = cloudinary.uploader.upload(BytesIO(photo_bytes))
+        return img, upload_result.get("secure_url"), upload_result.get("public_id")
+    img = load_image_from_url(student["image"])
+    if img is None:
+        raise ValueError("Không thể giải mã ảnh từ URL")
+    return img, student["image"], None
+
+
+def _destroy_uploaded_photos(public_ids):
+    # Xoá các ảnh vừa upload khi không lưu được học sinh, tránh để lại ảnh mồ côi trên Cloudinary
+    for public_id in public_ids:
+        try:
+            cloudinary.uploader.destroy(public_id)
         except Exception as e:
-            print(f"⚠️ Lỗi khi đăng ký dữ liệu khuôn mặt: {e}")
-            raise HTTPException(status_code=500, detail=f"Lỗi khi xử lý khuôn mặt: {e}")
+            print(f"⚠️ Không xoá được ảnh {public_id} trên Cloudinary: {e}")
 
-    return student
 
+def _validate_import_rows(db: Session, df, archive):
+    # Trả về (kết quả từng dòng, các cặp (kết quả, học sinh) hợp lệ, ảnh trong ZIP của từng học sinh hoặc None)
+    # Tên file ảnh trong ZIP (không phân biệt hoa thường, bỏ thư mục) -> tên đầy đủ trong ZIP
+    archive_names = {os.path.basename(name).lower(): name for name in archive.namelist() if not name.endswith('/')} if archive else {}
+
+    results, students, photo_bytes = [], [], []
+    parsed = []
+    for index, row in df.iterrows():
+        result = {"row": index + 2, "email": _cell(row, 'email'), "student_id": None, "status": "error", "face": "no_image", "error": None}
+        results.append(result)
+        try:
+            parsed.append((result, _parse_import_row(row), _cell(row, 'photo')))
+        except ValueError as e:
+            result["error"] = str(e)
+
+    # Email trùng trong file và trong DB (một truy vấn)
+    emails = [student["email"] for _, student, _ in parsed]
+    existing_emails = {email for (email,) in db.query(Student.email).filter(Student.email.in_(emails)).all()} if emails else set()
+    seen_emails = set()
+    for result, student, photo in parsed:
+        if student["email"] in existing_emails or student["email"] in seen_emails:
+            result["error"] = f"Email {student['email']} đã tồn tại"
+            continue
+        data = None
+        if photo:
+            member = archive_names.get(os.path.basename(photo).lower())
+            if member is None:
+                result["error"] = f"Không tìm thấy ảnh {photo} trong file ZIP"
+                continue
+            data = archive.read(member)
+        seen_emails.add(student["email"])
+        students.append((result, student))
+        photo_bytes.append(data)
+    return results, students, photo_bytes
+
+
+def _save_imported_students(db: Session, students, embeddings, retry):
+    # Ghi học sinh, embedding và job đăng ký lại trong một transaction; rollback rồi raise lại nếu lỗi
+    try:
+        db.execute(insert(Student), [student for _, student in students])
+        ids = dict(db.query(Student.email, Student.id).filter(Student.email.in_([student["email"] for _, student in students])).all())
+        vectors = []
+        for i, (result, student) in enumerate(students):
+            result["student_id"] = ids[student["email"]]
+            result["status"] = "created"
+            if i in embeddings:
+                vectors.extend({"student_id": result["student_id"], "vector": encode_embedding(embedding), "source": "profile"} for embedding in embeddings[i])
+                result["face"] = "enrolled"
+        if vectors:
+            db.execute(insert(FaceEmbedding), vectors)
+        if retry:
+            db.execute(insert(EnrollmentJob), [
+                {"student_id": students[i][0]["student_id"], "image_url": students[i][1]["image"], "status": "pending", "attempts": 0, "next_attempt_at": datetime.now()}
+                for i in retry
+            ])
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    embedding_index.upsert_many([(students[i][0]["student_id"], student_embeddings) for i, student_embeddings in embeddings.items()], db)
+
+
+async def _embed_import_images(imgs):
+    # Chạy phát hiện + embedding (kèm ảnh tăng cường) theo lô trên pool inference, tối đa FACE_INFERENCE_WORKERS lô cùng lúc.
+    # Khi pool đang bận (ví dụ kiosk điểm danh) thì chờ rồi thử lại thay vì báo lỗi.
+    limit = asyncio.Semaphore(max(1, FACE_INFERENCE_WORKERS))
+
+    async def run_chunk(chunk):
+        async with limit:
+            while True:
+                try:
+                    return await inference_executor.run(embed_face_templates, chunk)
+                except InferenceQueueFull:
+                    await asyncio.sleep(0.5)
+
+    chunks = [imgs[i:i + FACE_BATCH_MAX_SIZE] for i in range(0, len(imgs), FACE_BATCH_MAX_SIZE)]
+    results = await asyncio.gather(*(run_chunk(chunk) for chunk in chunks))
+    return [result for chunk in results for result in chunk]
+
+
+# 🟡 API POST: Nhập nhiều học sinh từ file Excel/CSV, kèm ảnh (cột image_url hoặc file ZIP + cột photo)
+@router.post("/bulk-import")
+async def import_students(
+    file: UploadFile = File(...),
+    photos: UploadFile = File(None),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    if current_user.role != "manager":
+        raise HTTPException(status_code=403, detail="Bạn không có quyền thêm học sinh")
+
+    if not file.filename.endswith(('.xlsx', '.xls', '.csv')):
+        raise HTTPException(status_code=400, detail="File không đúng định dạng. Chỉ chấp nhận file Excel (.xlsx, .xls) hoặc CSV")
+
+    try:
+        # Đọc Excel/CSV bằng pandas là code đồng bộ: chạy trong threadpool để không chặn event loop
+        df = await run_in_threadpool(_read_import_rows, await file.read(), file.filename)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Lỗi khi xử lý file: {str(e)}")
+
+    missing_columns = [col for col in ['full_name', 'email', 'phone_number'] if col not in df.columns]
+    if missing_columns:
+        raise HTTPException(status_code=400, detail=f"Thiếu các cột bắt buộc: {', '.join(missing_columns)}")
+    if len(df) > STUDENT_IMPORT_MAX_ROWS:
+        raise HTTPException(status_code=400, detail=f"File có quá nhiều dòng (tối đa {STUDENT_IMPORT_MAX_ROWS})")
+
+    archive = None
+    if photos is not None:
+        data = await photos.read(STUDENT_IMPORT_MAX_ZIP_BYTES + 1)
+        if len(data) > STUDENT_IMPORT_MAX_ZIP_BYTES:
+            raise HTTPException(status_code=400, detail=f"File ZIP quá lớn (tối đa {STUDENT_IMPORT_MAX_ZIP_BYTES // (1024 * 1024)}MB)")
+        try:
+            archive = await run_in_threadpool(_open_photo_archive, data)
+        except zipfile.BadZipFile:
+            raise HTTPException(status_code=400, detail="File ảnh phải là file ZIP")
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    # 1️⃣ Kiểm tra từng dòng, email trùng trong file và trong DB, giải nén ảnh (trong threadpool)
+    results, students, photo_bytes = await run_in_threadpool(_validate_import_rows, db, df, archive)
+
+    # 2️⃣ Tải/upload ảnh đồng thời, sau đó phát hiện khuôn mặt + embedding theo lô
+    with_image = [i for i, (_, student) in enumerate(students) if student["image"] or photo_bytes[i] is not None]
+
+    def fetch_all():
+        def fetch(i):
+            try:
+                return _fetch_import_image(students[i][1], photo_bytes[i])
+            except Exception as e:
+                return e
+        with ThreadPoolExecutor(max_workers=STUDENT_IMPORT_FETCH_WORKERS) as pool:
+            return list(pool.map(fetch, with_image))
+
+    fetched = await run_in_threadpool(fetch_all) if with_image else []
+    embeddings, to_embed, imgs, retry, uploaded = {}, [], [], [], []
+    for i, outcome in zip(with_image, fetched):
+        result, student = students[i]
+        if isinstance(outcome, Exception):
+            result["face"] = f"Lỗi tải ảnh: {outcome}"
+            # Lỗi tải ảnh từ URL có thể chỉ là tạm thời: để worker đăng ký khuôn mặt thử lại sau
+            if student["image"]:
+                retry.append(i)
+                result["face"] = f"Đã đưa vào hàng đợi đăng ký lại ({outcome})"
+            continue
+        img, student["image"], public_id = outcome
+        if public_id:
+            uploaded.append(public_id)
+        to_embed.append(i)
+        imgs.append(img)
+
+    for i, templates in zip(to_embed, await _embed_import_images(imgs) if imgs else []):
+        if isinstance(templates, Exception):
+            students[i][0]["face"] = str(templates)
+        else:
+            embeddings[i] = templates
+
+    # 3️⃣ Ghi tất cả học sinh và embedding trong một transaction, chèn theo lô (trong threadpool)
+    if students:
+        try:
+            await run_in_threadpool(_save_imported_students, db, students, embeddings, retry)
+        except Exception as e:
+            if uploaded:
+                await run_in_threadpool(_destroy_uploaded_photos, uploaded)
+            raise HTTPException(status_code=500, detail=f"Lỗi khi lưu danh sách học sinh: {str(e)}")
+        if retry:
+            enrollment_worker.wake()
+
+    success_count = sum(1 for result in results if result["status"] == "created")
+    return {
+        "success_count": success_count,
+        "error_count": len(results) - success_count,
+        "enrolled_count": len(embeddings),
+        "errors": [f"Dòng {result['row']}: {result['error']}" for result in results if result["error"]],
+        "results": results
+    }
 
 
 # 🔴 API DELETE: Xóa học sinh (chỉ Manager có quyền)
@@ -196,10 +458,134 @@ def delete_student(
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Lỗi khi xoá ảnh trên Cloudinary: {str(e)}")
 
+    # Bản ghi điểm danh và session_students của học sinh bị xoá theo: trừ khỏi số liệu các buổi học trong cùng transaction
+    stats = StatsDelta()
+    for (session_id,) in db.query(SessionStudent.session_id).filter(SessionStudent.student_id == student_id).all():
+        stats.enrollment_changed(session_id, -1)
+    for session_id, status in db.query(Attendance.session_id, Attendance.status).filter(Attendance.student_id == student_id).all():
+        stats.status_changed(session_id, status, None)
+
     db.delete(student)
+    stats.apply(db)
     db.commit()
+    embedding_index.remove(student_id, db)
     return {"detail": "Student deleted successfully"}
 
+def _enrollment_status(db: Session, student_id: int):
+    job = db.query(EnrollmentJob).filter(EnrollmentJob.student_id == student_id).order_by(EnrollmentJob.id.desc()).first()
+    template_count = db.query(FaceEmbedding.id).filter(FaceEmbedding.student_id == student_id).count()
+    has_embedding = template_count > 0
+    if not job:
+        return EnrollmentStatusResponse(student_id=student_id, status="done" if has_embedding else "none", has_embedding=has_embedding, template_count=template_count)
+    return EnrollmentStatusResponse(
+        student_id=student_id,
+        status=job.status,
+        has_embedding=has_embedding,
+        template_count=template_count,
+        attempts=job.attempts,
+        last_error=job.last_error,
+        next_attempt_at=job.next_attempt_at,
+        updated_at=job.updated_at
+    )
+
+
+# 🔵 API GET: Trạng thái đăng ký khuôn mặt của học sinh
+@router.get("/{student_id}/enrollment", response_model=EnrollmentStatusResponse)
+def get_student_enrollment(
+    student_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    if current_user.role != "manager":
+        raise HTTPException(status_code=403, detail="Bạn không có quyền xem trạng thái đăng ký khuôn mặt")
+
+    if not db.query(Student.id).filter(Student.id == student_id).first():
+        raise HTTPException(status_code=404, detail="Student not found")
+
+    return _enrollment_status(db, student_id)
+
+
+# 🟡 API POST: Đăng ký lại khuôn mặt từ ảnh hiện tại (ví dụ sau khi job bị lỗi)
+@router.post("/{student_id}/enrollment", response_model=EnrollmentStatusResponse)
+def retry_student_enrollment(
+    student_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    if current_user.role != "manager":
+        raise HTTPException(status_code=403, detail="Bạn không có quyền đăng ký khuôn mặt")
+
+    student = db.query(Student).filter(Student.id == student_id).first()
+    if not student:
+        raise HTTPException(status_code=404, detail="Student not found")
+    if not student.image:
+        raise HTTPException(status_code=400, detail="Học sinh chưa có ảnh")
+
+    enqueue_enrollment(db, student.id, student.image)
+    return _enrollment_status(db, student_id)
+
+# 🟡 API POST: Thêm ảnh mẫu khuôn mặt cho học sinh (nhiều góc chụp giúp nhận diện ổn định hơn)
+@router.post("/{student_id}/face-templates")
+async def add_face_templates(
+    student_id: int,
+    request: FaceTemplatesRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    if current_user.role != "manager":
+        raise HTTPException(status_code=403, detail="Bạn không có quyền đăng ký khuôn mặt")
+
+    if not db.query(Student.id).filter(Student.id == student_id).first():
+        raise HTTPException(status_code=404, detail="Student not found")
+
+    existing_photos = db.query(func.count(func.distinct(FaceEmbedding.image_url))).filter(
+        FaceEmbedding.student_id == student_id, FaceEmbedding.source == "photo"
+    ).scalar()
+    if existing_photos + len(request.image_urls) > FACE_TEMPLATE_MAX_PHOTOS:
+        raise HTTPException(status_code=400, detail=f"Mỗi học sinh có tối đa {FACE_TEMPLATE_MAX_PHOTOS} ảnh mẫu")
+
+    # Tải song song rồi phát hiện + embedding cả lô (kèm ảnh tăng cường) trên pool inference
+    fetched = await run_in_threadpool(image_fetcher.fetch_many, request.image_urls)
+    imgs = [None if isinstance(img, Exception) else img for img in fetched]
+    try:
+        templates = await inference_executor.run(embed_face_templates, imgs)
+    except InferenceQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+    results, added = [], 0
+    for image_url, img, outcome in zip(request.image_urls, fetched, templates):
+        error = img if isinstance(img, Exception) else outcome if isinstance(outcome, Exception) else None
+        if error is not None:
+            results.append({"image_url": image_url, "status": "error", "error": str(error)})
+            continue
+        db.add_all([FaceEmbedding(student_id=student_id, vector=encode_embedding(embedding), source="photo", image_url=image_url) for embedding in outcome])
+        added += len(outcome)
+        results.append({"image_url": image_url, "status": "enrolled", "error": None})
+
+    if added:
+        db.commit()
+        embedding_index.reload_student(db, student_id)
+    return {"added_count": added, "results": results, "enrollment": _enrollment_status(db, student_id)}
+
+
+# 🔴 API DELETE: Xoá các ảnh mẫu bổ sung (giữ lại dữ liệu từ ảnh đại diện)
+@router.delete("/{student_id}/face-templates")
+def delete_face_templates(
+    student_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    if current_user.role != "manager":
+        raise HTTPException(status_code=403, detail="Bạn không có quyền đăng ký khuôn mặt")
+
+    if not db.query(Student.id).filter(Student.id == student_id).first():
+        raise HTTPException(status_code=404, detail="Student not found")
+
+    deleted = db.query(FaceEmbedding).filter(FaceEmbedding.student_id == student_id, FaceEmbedding.source == "photo").delete(synchronize_session=False)
+    db.commit()
+    embedding_index.reload_student(db, student_id)
+    return {"deleted_count": deleted, "enrollment": _enrollment_status(db, student_id)}
+
 # ✅ API: Lấy danh sách lớp học mà học sinh tham gia
 @router.get("/{student_id}/classes", response_model=List[ClassResponse])
 def get_student_classes(
@@ -248,6 +634,10 @@ def get_student_classes(
 @router.get("/{student_id}/sessions", response_model=List[StudentSessionResponse])
 def get_student_sessions(
     student_id: int,
+    from_date: Optional[date] = None,
+    to_date: Optional[date] = None,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
@@ -258,37 +648,48 @@ def get_student_sessions(
     if not student:
         raise HTTPException(status_code=404, detail="Học sinh không tồn tại")
 
-    # Thay vì lấy từ ClassStudent, ta lấy từ SessionStudent để truy vấn các buổi học của học sinh
-    sessions = (
-        db.query(SessionModel, Class.name.label("class_name"), Class.class_code.label("class_code"))
+    # Trạng thái điểm danh của học sinh ở từng buổi, tính trong cùng một truy vấn:
+    # dữ liệu cũ có thể có nhiều bản ghi cho một buổi, khi đó lấy bản ghi mới nhất (id lớn nhất)
+    latest = (
+        db.query(func.max(Attendance.id).label("id"))
+        .filter(Attendance.student_id == student_id)
+        .group_by(Attendance.session_id)
+        .subquery()
+    )
+    own_status = (
+        db.query(Attendance.session_id, Attendance.status)
+        .join(latest, latest.c.id == Attendance.id)
+        .subquery()
+    )
+
+    query = (
+        db.query(
+            SessionModel,
+            Class.name.label("class_name"),
+            Class.class_code.label("class_code"),
+            own_status.c.status
+        )
         .join(SessionStudent, SessionModel.id == SessionStudent.session_id)
         .join(Class, Class.id == SessionModel.class_id)
+        .outerjoin(own_status, own_status.c.session_id == SessionModel.id)
         .filter(SessionStudent.student_id == student_id)
-        .order_by(SessionModel.date.asc())
-        .all()
     )
+    if from_date:
+        query = query.filter(SessionModel.date >= from_date)
+    if to_date:
+        query = query.filter(SessionModel.date <= to_date)
+    query = query.order_by(SessionModel.date.asc(), SessionModel.id.asc()).offset(offset)
+    if limit:
+        query = query.limit(limit)
+
+    rows = query.all()
+    # Sĩ số và số lượt "Present" của các buổi học lấy từ bảng số liệu
+    session_stats = load_session_stats(db, [session.id for session, *_ in rows])
 
     session_list = []
-    for session, class_name, class_code in sessions:
-        attendance_record = (
-            db.query(Attendance.status)
-            .filter(Attendance.session_id == session.id, Attendance.student_id == student_id)
-            .scalar()
-        )
-
-        total_present = (
-            db.query(Attendance)
-            .filter(Attendance.session_id == session.id, Attendance.status == "Present")
-            .count()
-        )
-
-        total_students = (
-            db.query(SessionStudent)
-            .filter(SessionStudent.session_id == session.id)
-            .count()
-        )
-
-        attendance_rate = (total_present / total_students * 100) if total_students > 0 else 0
+    for session, class_name, class_code, status in rows:
+        stats = session_stats.get(session.id)
+        attendance_rate = stats.attendance_rate if stats else 0
 
         session_list.append(StudentSessionResponse(
             session_id=session.id,
@@ -299,7 +700,7 @@ def get_student_sessions(
             weekday=session.date.strftime("%A"),
             start_time=session.start_time.strftime("%H:%M"),
             end_time=session.end_time.strftime("%H:%M"),
-            attendance_status=attendance_record or "Absent",
+            attendance_status=status or "Absent",
             attendance_rate=round(attendance_rate, 2)
         ))
 
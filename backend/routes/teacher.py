@@ -11,6 +11,7 @@ from schemas.class_schema import ClassTeacherResponse
 from typing import List
 from utils.security import hash_password
 from routes.user import get_current_user  # ✅ Import xác thực user
+from utils.user_cache import user_cache
 
 router = APIRouter()
 
@@ -96,6 +97,7 @@ def update_teacher(
     if not teacher:
         raise HTTPException(status_code=404, detail="Teacher not found")
 
+    old_email = teacher.email
     teacher.full_name = teacher_data.full_name
     teacher.phone_number = teacher_data.phone_number
     teacher.date_of_birth = teacher_data.date_of_birth
@@ -105,6 +107,7 @@ def update_teacher(
 
     db.commit()
     db.refresh(teacher)
+    user_cache.invalidate(old_email, teacher.email)
 
     return teacher
 
@@ -122,8 +125,10 @@ def delete_teacher(
     if not teacher:
         raise HTTPException(status_code=404, detail="Teacher not found")
 
+    email = teacher.email
     db.delete(teacher)
     db.commit()
+    user_cache.invalidate(email)
 
     return {"detail": "Teacher deleted successfully"}
 
@@ -3,25 +3,10 @@ import cloudinary.uploader
 from sqlalchemy.orm import Session
 from database import get_db
 from models.user import User
-from utils.security import decode_access_token
-from fastapi.security import OAuth2PasswordBearer
+from routes.user import get_current_user  # ✅ Dùng chung hàm xác thực (có cache người dùng)
 
 router = APIRouter()
 
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
-
-# Middleware xác thực token và lấy user hiện tại
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    payload = decode_access_token(token)
-    if not payload:
-        raise HTTPException(status_code=401, detail="Token không hợp lệ hoặc đã hết hạn")
-
-    user = db.query(User).filter(User.email == payload.get("sub")).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User không tồn tại")
-
-    return user
-
 # API upload ảnh lên Cloudinary (Chỉ dành cho Admin & Manager)
 @router.post("/upload-image/")
 async def upload_image(
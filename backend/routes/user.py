@@ -1,10 +1,11 @@
-from fastapi import APIRouter, HTTPException, Depends, UploadFile, File
+from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Request
 from sqlalchemy.orm import Session
 from fastapi.security import OAuth2PasswordBearer
 from database import get_db
 from models.user import User
 from schemas.user_schema import UserCreateRequest, UserResponse, ChangePasswordRequest
 from utils.security import hash_password, decode_access_token, verify_password
+from utils.user_cache import user_cache, AuthenticatedUser
 from typing import List
 import pandas as pd
 from io import BytesIO
@@ -14,14 +15,20 @@ router = APIRouter()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 # 🔹 Middleware kiểm tra token và lấy user hiện tại
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    payload = decode_access_token(token)
+def get_current_user(request: Request, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    # AuthMiddleware đã giải mã token và lưu payload vào request.state: dùng lại, không giải mã lần nữa
+    payload = getattr(request.state, "user", None) or decode_access_token(token)
     if not payload:
         raise HTTPException(status_code=401, detail="Token không hợp lệ hoặc đã hết hạn")
 
-    user = db.query(User).filter(User.email == payload.get("sub")).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User không tồn tại")
+    email = payload.get("sub")
+    user = user_cache.get(email)
+    if user is None:
+        db_user = db.query(User).filter(User.email == email).first()
+        if not db_user:
+            raise HTTPException(status_code=404, detail="User không tồn tại")
+        user = AuthenticatedUser.from_user(db_user)
+        user_cache.add(user)
 
     return user
 
@@ -81,11 +88,14 @@ def update_user(user_id: int, user_data: UserCreateRequest, db: Session = Depend
     if current_user.role != "admin" and current_user.id != user.id:
         raise HTTPException(status_code=403, detail="Bạn không có quyền chỉnh sửa thông tin người dùng khác")
     
+    old_email = user.email
     for key, value in user_data.dict(exclude_unset=True).items():
         setattr(user, key, value)
         
     db.commit()
     db.refresh(user)
+    # ✅ Thông tin/vai trò đã đổi: bỏ bản cache cũ (kể cả khi email đổi)
+    user_cache.invalidate(old_email, user.email)
 
     return user
 
@@ -100,8 +110,10 @@ def delete_user(user_id: int, db: Session = Depends(get_db), current_user: User
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Bạn không có quyền xóa người dùng")
 
+    email = user.email
     db.delete(user)
     db.commit()
+    user_cache.invalidate(email)
 
     return {"detail": "Người dùng đã được xóa thành công"}
 
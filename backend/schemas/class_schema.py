@@ -67,3 +67,12 @@ class ClassTeacherResponse(BaseModel):
     class Config:
         from_attributes = True  # ✅ Hỗ trợ ORM mode để convert từ SQLAlchemy model
         
+
+# Schema thêm / gỡ nhiều học sinh khỏi lớp trong một lần
+class ClassEnrollmentBatch(BaseModel):
+    student_ids: List[int]
+
+class ClassEnrollmentBatchResponse(BaseModel):
+    message: str
+    students: List[int] = []  # Học sinh được thêm / gỡ
+    skipped: List[int] = []   # Học sinh đã đăng ký (khi thêm) hoặc không đăng ký lớp (khi gỡ)
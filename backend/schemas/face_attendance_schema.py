@@ -10,13 +10,16 @@ class FaceAttendanceRequest(BaseModel):
     image: constr(min_length=10, max_length=1000000) = Field(..., description="Chuỗi base64 của ảnh khuôn mặt (phần base64 thuần, không chứa metadata như 'data:image/jpeg;base64,')")
     class_id: int = Field(..., ge=1, description="ID của lớp học, phải là số nguyên dương")
     session_date: date = Field(..., description="Ngày của buổi học, định dạng YYYY-MM-DD")
+    global_search: bool = Field(False, description="So khớp với toàn bộ học sinh trong trường thay vì chỉ danh sách của buổi học")
+    client_id: Optional[str] = Field(None, max_length=64, description="Mã kiosk/thiết bị gửi khung hình, dùng để bỏ phiếu qua nhiều khung hình (mặc định theo địa chỉ IP)")
 
     class Config:
         schema_extra = {
             "example": {
                 "image": "/9j/4AAQSkZJRgABAQAAAQABAAD/4gHYSUNDX1BST0ZJTEUAAQEAAAHIAAAAAAQwAABtbnRyUkdCIFhZWiAH4AABAAEAAAAAAABhY3Nw...",
                 "class_id": 80,
-                "session_date": "2025-02-27"
+                "session_date": "2025-02-27",
+                "global_search": False
             }
         }
 
@@ -36,6 +39,32 @@ class FaceAttendanceResponse(BaseModel):
             }
         }
 
+# Schema cho request điểm danh theo nhóm từ một ảnh chụp cả lớp
+class GroupFaceAttendanceRequest(BaseModel):
+    """
+    Schema cho điểm danh nhiều học sinh cùng lúc từ một ảnh chụp lớp học.
+    """
+    image: constr(min_length=10, max_length=10000000) = Field(..., description="Chuỗi base64 của ảnh chụp lớp học (không chứa metadata 'data:image/...;base64,')")
+    class_id: int = Field(..., ge=1, description="ID của lớp học, phải là số nguyên dương")
+    session_date: date = Field(..., description="Ngày của buổi học, định dạng YYYY-MM-DD")
+    global_search: bool = Field(False, description="So khớp với toàn bộ học sinh trong trường thay vì chỉ danh sách của buổi học")
+
+# Một khuôn mặt được nhận diện trong ảnh nhóm
+class RecognizedFace(BaseModel):
+    student_id: int = Field(..., description="ID của học sinh được nhận diện")
+    full_name: str = Field(..., description="Tên đầy đủ của học sinh")
+    similarity: float = Field(..., description="Độ tương đồng cosine với dữ liệu khuôn mặt đã đăng ký")
+    box: List[int] = Field(..., description="Toạ độ khuôn mặt trong ảnh [x1, y1, x2, y2]")
+
+# Schema cho response điểm danh theo nhóm
+class GroupFaceAttendanceResponse(BaseModel):
+    """
+    Schema cho phản hồi điểm danh theo nhóm.
+    """
+    total_faces: int = Field(..., description="Số khuôn mặt phát hiện được trong ảnh")
+    recognized: List[RecognizedFace] = Field(default_factory=list, description="Các học sinh đã được điểm danh")
+    unmatched_boxes: List[List[int]] = Field(default_factory=list, description="Các khuôn mặt không khớp với học sinh nào")
+
 # Schema cho lỗi khi không tìm thấy học sinh phù hợp
 class FaceAttendanceErrorResponse(BaseModel):
     """
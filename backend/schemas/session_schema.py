@@ -29,7 +29,7 @@ class SessionResponse(BaseModel):
     end_time: str
     total_students: int
     attendance_rate: float
-    students: List[SessionStudent]
+    students: Optional[List[SessionStudent]] = None  # None khi gọi với include_students=false
     room_name: Optional[str] = ""
 
 class StudentSessionResponse(BaseModel):
@@ -1,5 +1,5 @@
-from pydantic import BaseModel, EmailStr
-from typing import Optional
+from pydantic import BaseModel, EmailStr, Field
+from typing import List, Optional
 from datetime import date, datetime
 
 # Schema để tạo mới sinh viên
@@ -40,3 +40,19 @@ class StudentResponse(BaseModel):
 
     class Config:
         from_attributes = True  # Hỗ trợ lấy từ SQLAlchemy model
+
+
+# Schema trạng thái đăng ký khuôn mặt của học sinh
+class EnrollmentStatusResponse(BaseModel):
+    student_id: int
+    status: str  # none, pending, processing, done, failed, cancelled
+    has_embedding: bool
+    template_count: int = 0  # Số vector khuôn mặt (ảnh đại diện, ảnh mẫu và ảnh tăng cường)
+    attempts: int = 0
+    last_error: Optional[str] = None
+    next_attempt_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
+# Schema thêm ảnh mẫu khuôn mặt (URL ảnh đã upload lên Cloudinary)
+class FaceTemplatesRequest(BaseModel):
+    image_urls: List[str] = Field(..., min_length=1, max_length=10)
@@ -0,0 +1,87 @@
+"""
+Chuyển các embedding dạng chuỗi JSON trong bảng face_embeddings sang định dạng nhị phân float32.
+
+Chạy từ thư mục backend:
+    python -m scripts.migrate_face_embeddings [--batch-size 500] [--drop-json]
+"""
+import argparse
+import json
+from sqlalchemy import inspect, text
+from database.mysql import engine, SessionLocal
+import models.student_model, models.user, models.class_model, models.class_students_model  # noqa: F401
+import models.session_model, models.session_student_model, models.attendance_model  # noqa: F401
+import models.grade_model, models.room_model, models.schedule_model, models.news_model  # noqa: F401
+from models.face_embeddings import FaceEmbedding
+from utils.embedding_codec import encode_embedding
+
+
+def ensure_schema():
+    # Thêm cột `vector`, `source`, `image_url` và cho phép cột JSON cũ nhận NULL (bảng không được quản lý bằng công cụ migration)
+    columns = {column["name"]: column for column in inspect(engine).get_columns("face_embeddings")}
+    with engine.begin() as conn:
+        if "vector" not in columns:
+            conn.execute(text("ALTER TABLE face_embeddings ADD COLUMN vector BLOB NULL"))
+            print("✅ Đã thêm cột face_embeddings.vector")
+        if "source" not in columns:
+            conn.execute(text("ALTER TABLE face_embeddings ADD COLUMN source VARCHAR(20) NULL"))
+            print("✅ Đã thêm cột face_embeddings.source")
+        if "image_url" not in columns:
+            conn.execute(text("ALTER TABLE face_embeddings ADD COLUMN image_url VARCHAR(255) NULL"))
+            print("✅ Đã thêm cột face_embeddings.image_url")
+        if not columns["embedding"]["nullable"]:
+            conn.execute(text("ALTER TABLE face_embeddings MODIFY embedding VARCHAR(4096) NULL"))
+            print("✅ Cột face_embeddings.embedding đã cho phép NULL")
+
+
+def migrate(batch_size: int, drop_json: bool):
+    db = SessionLocal()
+    converted, failed, last_id = 0, 0, 0
+    try:
+        while True:
+            rows = (
+                db.query(FaceEmbedding.id, FaceEmbedding.embedding)
+                .filter(FaceEmbedding.id > last_id, FaceEmbedding.vector.is_(None), FaceEmbedding.embedding.isnot(None))
+                .order_by(FaceEmbedding.id)
+                .limit(batch_size)
+                .all()
+            )
+            if not rows:
+                break
+            last_id = rows[-1].id
+
+            mappings = []
+            for row in rows:
+                try:
+                    mapping = {"id": row.id, "vector": encode_embedding(json.loads(row.embedding))}
+                except (ValueError, TypeError) as e:
+                    failed += 1
+                    print(f"⚠️ Bỏ qua embedding ID {row.id}: {e}")
+                    continue
+                if drop_json:
+                    mapping["embedding"] = None
+                mappings.append(mapping)
+
+            db.bulk_update_mappings(FaceEmbedding, mappings)
+            db.commit()
+            converted += len(mappings)
+
+        if drop_json:
+            # Xoá chuỗi JSON ở các dòng đã có dữ liệu nhị phân từ trước
+            db.query(FaceEmbedding).filter(
+                FaceEmbedding.vector.isnot(None), FaceEmbedding.embedding.isnot(None)
+            ).update({FaceEmbedding.embedding: None}, synchronize_session=False)
+            db.commit()
+    finally:
+        db.close()
+
+    print(f"✅ Đã chuyển đổi {converted} embedding, lỗi {failed}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chuyển embedding JSON sang định dạng nhị phân")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--drop-json", action="store_true", help="Xoá chuỗi JSON sau khi chuyển đổi để giảm dung lượng bảng")
+    args = parser.parse_args()
+
+    ensure_schema()
+    migrate(args.batch_size, args.drop_json)
@@ -0,0 +1,47 @@
+"""
+Tạo (nếu chưa có) và tính lại bảng session_attendance_stats từ bảng attendance và session_students.
+Dùng sau khi triển khai lần đầu hoặc khi dữ liệu điểm danh bị sửa trực tiếp trong DB.
+
+Chạy từ thư mục backend:
+    python -m scripts.rebuild_session_stats [--batch-size 500] [--class-id 12]
+"""
+import argparse
+from database.mysql import engine, SessionLocal
+import models.student_model, models.user, models.class_model, models.class_students_model  # noqa: F401
+import models.session_model, models.session_student_model, models.attendance_model  # noqa: F401
+import models.grade_model, models.room_model, models.schedule_model, models.news_model, models.face_embeddings  # noqa: F401
+from models.session_model import Session as SessionModel
+from models.session_stats_model import SessionAttendanceStats
+from utils.attendance_stats import refresh_session_stats
+
+
+def rebuild(batch_size: int, class_id=None):
+    db = SessionLocal()
+    rebuilt, last_id = 0, 0
+    try:
+        while True:
+            query = db.query(SessionModel.id).filter(SessionModel.id > last_id)
+            if class_id is not None:
+                query = query.filter(SessionModel.class_id == class_id)
+            session_ids = [session_id for (session_id,) in query.order_by(SessionModel.id).limit(batch_size).all()]
+            if not session_ids:
+                break
+            last_id = session_ids[-1]
+
+            refresh_session_stats(db, session_ids)
+            db.commit()
+            rebuilt += len(session_ids)
+    finally:
+        db.close()
+
+    print(f"✅ Đã tính lại số liệu điểm danh của {rebuilt} buổi học")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tính lại số liệu điểm danh theo buổi học")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--class-id", type=int, help="Chỉ tính lại các buổi học của một lớp")
+    args = parser.parse_args()
+
+    SessionAttendanceStats.__table__.create(bind=engine, checkfirst=True)
+    rebuild(args.batch_size, args.class_id)
@@ -0,0 +1,56 @@
+"""
+Tính lại embedding khuôn mặt của toàn bộ học sinh từ ảnh đại diện, dùng pipeline hiện tại
+(MTCNN cắt khuôn mặt -> ảnh tăng cường -> Facenet trong model registry).
+
+Chạy từ thư mục backend:
+    python -m scripts.reembed_face_embeddings [--student-id 12 ...]
+"""
+import argparse
+from database.mysql import SessionLocal
+import models.student_model, models.user, models.class_model, models.class_students_model  # noqa: F401
+import models.session_model, models.session_student_model, models.attendance_model  # noqa: F401
+import models.grade_model, models.room_model, models.schedule_model, models.news_model  # noqa: F401
+from models.student_model import Student
+from models.face_embeddings import FaceEmbedding
+from utils.image_processing import load_image_from_url, embed_face_templates
+from utils.embedding_codec import encode_embedding
+
+
+def reembed(student_ids=None):
+    db = SessionLocal()
+    success, failed = 0, 0
+    try:
+        query = db.query(Student.id, Student.image).filter(Student.image.isnot(None))
+        if student_ids:
+            query = query.filter(Student.id.in_(student_ids))
+
+        for student_id, image_url in query.all():
+            try:
+                embeddings = embed_face_templates([load_image_from_url(image_url)])[0]
+                if isinstance(embeddings, Exception):
+                    raise embeddings
+            except Exception as e:
+                failed += 1
+                print(f"⚠️ Học sinh ID {student_id}: {e}")
+                continue
+
+            # Chỉ thay các vector từ ảnh đại diện, giữ lại ảnh mẫu bổ sung
+            db.query(FaceEmbedding).filter(
+                FaceEmbedding.student_id == student_id,
+                (FaceEmbedding.source.is_(None)) | (FaceEmbedding.source == "profile")
+            ).delete(synchronize_session=False)
+            db.add_all([FaceEmbedding(student_id=student_id, vector=encode_embedding(embedding), source="profile") for embedding in embeddings])
+            db.commit()
+            success += 1
+    finally:
+        db.close()
+
+    print(f"✅ Đã tính lại embedding cho {success} học sinh, lỗi {failed}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tính lại embedding khuôn mặt từ ảnh học sinh")
+    parser.add_argument("--student-id", type=int, nargs="*", help="Chỉ xử lý các học sinh này")
+    args = parser.parse_args()
+
+    reembed(args.student_id)
@@ -0,0 +1,33 @@
+"""
+Chạy worker đăng ký khuôn mặt như một tiến trình riêng (đặt FACE_ENROLLMENT_WORKER=false cho tiến trình API).
+
+Chạy từ thư mục backend:
+    python -m scripts.run_enrollment_worker [--once]
+"""
+import argparse
+from database.mysql import engine
+import models.student_model, models.user, models.class_model, models.class_students_model  # noqa: F401
+import models.session_model, models.session_student_model, models.attendance_model  # noqa: F401
+import models.grade_model, models.room_model, models.schedule_model, models.news_model  # noqa: F401
+from models.enrollment_job_model import EnrollmentJob
+from utils.model_registry import model_registry
+from utils.enrollment_queue import enrollment_worker
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Worker đăng ký khuôn mặt từ bảng enrollment_jobs")
+    parser.add_argument("--once", action="store_true", help="Xử lý hết các job đang chờ rồi thoát")
+    args = parser.parse_args()
+
+    EnrollmentJob.__table__.create(bind=engine, checkfirst=True)
+    model_registry.load()
+    if args.once:
+        total = 0
+        while processed := enrollment_worker.run_once():
+            total += processed
+        print(f"✅ Đã xử lý {total} job đăng ký khuôn mặt")
+    else:
+        try:
+            enrollment_worker.run_forever()
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,118 @@
+import os
+import numpy as np
+
+# Số cụm của IVF (0 là tự chọn theo căn bậc hai số vector) và số cụm được quét mỗi lần tìm kiếm.
+# Tăng FACE_IVF_NPROBE để tăng độ chính xác (recall), giảm để tìm nhanh hơn.
+FACE_IVF_NLIST = int(os.getenv("FACE_IVF_NLIST", "0"))
+FACE_IVF_NPROBE = int(os.getenv("FACE_IVF_NPROBE", "16"))
+FACE_IVF_TRAIN_ITERATIONS = int(os.getenv("FACE_IVF_TRAIN_ITERATIONS", "10"))
+FACE_IVF_TRAIN_SAMPLE = int(os.getenv("FACE_IVF_TRAIN_SAMPLE", "50000"))
+
+_CHUNK_SIZE = 16384
+
+
+def _nearest_centroids(vectors, centroids):
+    # Gán từng vector (đã chuẩn hoá) vào cụm có tâm gần nhất theo cosine, tính theo từng khối để giới hạn bộ nhớ
+    assignments = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), _CHUNK_SIZE):
+        block = vectors[start:start + _CHUNK_SIZE]
+        assignments[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+
+class IVFIndex:
+    """
+    Chỉ mục IVF (inverted file): các vector được chia vào các cụm bằng k-means trên mặt cầu đơn vị.
+    Khi tìm kiếm chỉ quét các cụm có tâm gần truy vấn nhất; các vector trong cụm được chấm điểm lại
+    chính xác bằng ma trận float32 gốc của EmbeddingIndex.
+    Chỉ mục chỉ lưu cụm của từng dòng trong ma trận, không giữ bản sao vector.
+    """
+
+    def __init__(self, nlist: int = FACE_IVF_NLIST, nprobe: int = FACE_IVF_NPROBE):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.centroids = None
+        self.trained_size = 0
+        self._assignments = np.empty(0, dtype=np.int32)
+        self._order = np.empty(0, dtype=np.int64)
+        self._offsets = np.zeros(1, dtype=np.int64)
+
+    @property
+    def trained(self):
+        return self.centroids is not None
+
+    def needs_training(self, size: int):
+        # Huấn luyện lại khi số vector đã tăng gấp đôi so với lúc huấn luyện
+        return not self.trained or size > 2 * max(self.trained_size, 1)
+
+    def train(self, matrix):
+        size = len(matrix)
+        nlist = self.nlist or max(1, int(np.sqrt(size)))
+        rng = np.random.default_rng(0)
+        sample = matrix
+        if size > FACE_IVF_TRAIN_SAMPLE:
+            sample = matrix[rng.choice(size, FACE_IVF_TRAIN_SAMPLE, replace=False)]
+        nlist = min(nlist, len(sample))
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+        for _ in range(FACE_IVF_TRAIN_ITERATIONS):
+            assignments = _nearest_centroids(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, sample)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            # Cụm rỗng giữ nguyên tâm cũ
+            empty = norms[:, 0] == 0
+            norms[empty] = 1.0
+            sums[empty] = centroids[empty]
+            centroids = (sums / norms).astype(np.float32)
+        self.centroids = np.ascontiguousarray(centroids)
+        self.trained_size = size
+
+    def build(self, matrix):
+        if self.needs_training(len(matrix)):
+            self.train(matrix)
+        self.set_assignments(_nearest_centroids(matrix, self.centroids))
+
+    def set_assignments(self, assignments):
+        # Dựng lại danh sách đảo (các dòng của từng cụm nằm liền nhau trong _order)
+        self._assignments = np.asarray(assignments, dtype=np.int32)
+        self._order = np.argsort(self._assignments, kind="stable")
+        self._offsets = np.searchsorted(self._assignments[self._order], np.arange(len(self.centroids) + 1))
+
+    @property
+    def assignments(self):
+        return self._assignments
+
+    def append(self, vectors):
+        # Các vector mới được nối vào cuối ma trận: chỉ cần gán cụm cho chúng
+        self.set_assignments(np.concatenate([self._assignments, _nearest_centroids(vectors, self.centroids)]))
+
+    def remove(self, keep):
+        # keep là mask các dòng còn lại của ma trận
+        self.set_assignments(self._assignments[keep])
+
+    def candidates(self, probes):
+        # Các dòng của ma trận nằm trong nprobe cụm gần nhất với (một hoặc nhiều) truy vấn
+        probes = np.atleast_2d(probes)
+        nprobe = min(self.nprobe, len(self.centroids))
+        scores = probes @ self.centroids.T
+        lists = np.unique(np.argpartition(-scores, nprobe - 1, axis=1)[:, :nprobe])
+        return np.concatenate([self._order[self._offsets[c]:self._offsets[c + 1]] for c in lists])
+
+    def state(self):
+        return {
+            "ivf_centroids": self.centroids,
+            "ivf_trained_size": np.int64(self.trained_size),
+            "ivf_assignments": self._assignments,
+        }
+
+    def restore(self, state, size: int):
+        # Khôi phục từ file đã lưu; trả về False nếu file không khớp với ma trận hiện tại
+        if "ivf_centroids" not in state:
+            return False
+        self.centroids = np.ascontiguousarray(state["ivf_centroids"], dtype=np.float32)
+        self.trained_size = int(state["ivf_trained_size"])
+        assignments = state["ivf_assignments"]
+        if len(assignments) != size:
+            return False
+        self.set_assignments(assignments)
+        return True
@@ -0,0 +1,128 @@
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from models.attendance_model import Attendance
+from models.session_student_model import SessionStudent
+from models.session_stats_model import SessionAttendanceStats
+
+# Cột đếm tương ứng với từng trạng thái điểm danh (trạng thái khác không được đếm)
+STATUS_COLUMNS = {"Present": "present", "Late": "late", "Absent": "absent", "Excused": "excused"}
+_COUNT_COLUMNS = ("enrolled",) + tuple(STATUS_COLUMNS.values())
+
+
+class StatsDelta:
+    """
+    Gom thay đổi số liệu điểm danh của các buổi học trong một transaction rồi ghi một lần bằng apply(db), trước db.commit().
+    Các cột được cộng dồn bằng UPDATE ... SET cot = cot + n nên nhiều request ghi cùng một buổi học không ghi đè lên nhau.
+    """
+
+    def __init__(self):
+        self._deltas = {}
+
+    def status_changed(self, session_id: int, old_status, new_status):
+        # old_status=None: bản ghi mới; new_status=None: bản ghi bị xoá
+        if old_status == new_status:
+            return
+        self._add(session_id, STATUS_COLUMNS.get(old_status), -1)
+        self._add(session_id, STATUS_COLUMNS.get(new_status), 1)
+
+    def enrollment_changed(self, session_id: int, delta: int):
+        self._add(session_id, "enrolled", delta)
+
+    def _add(self, session_id: int, column, amount: int):
+        if column is None:
+            return
+        columns = self._deltas.setdefault(session_id, {})
+        columns[column] = columns.get(column, 0) + amount
+
+    def apply(self, db):
+        deltas = {session_id: columns for session_id, columns in self._deltas.items() if any(columns.values())}
+        self._deltas = {}
+        if not deltas:
+            return
+
+        # Ghi các thay đổi đang chờ để buổi học chưa có dòng số liệu được tính lại kèm thay đổi này
+        db.flush()
+        existing = {
+            session_id for (session_id,) in db.query(SessionAttendanceStats.session_id)
+            .filter(SessionAttendanceStats.session_id.in_(list(deltas)))
+            .with_for_update()
+            .all()
+        }
+        missing = [session_id for session_id in deltas if session_id not in existing]
+        raced = []
+        for session_id in missing:
+            # Request khác có thể tạo cùng dòng này song song: chèn trong savepoint, trùng khoá thì cộng dồn vào dòng đã có
+            try:
+                with db.begin_nested():
+                    refresh_session_stats(db, [session_id])
+            except IntegrityError:
+                raced.append(session_id)
+        if raced:
+            existing.update(
+                session_id for (session_id,) in db.query(SessionAttendanceStats.session_id)
+                .filter(SessionAttendanceStats.session_id.in_(raced))
+                .with_for_update()
+                .all()
+            )
+
+        for session_id in existing:
+            values = {
+                getattr(SessionAttendanceStats, column): getattr(SessionAttendanceStats, column) + amount
+                for column, amount in deltas[session_id].items() if amount
+            }
+            values[SessionAttendanceStats.updated_at] = func.now()
+            db.query(SessionAttendanceStats).filter(SessionAttendanceStats.session_id == session_id).update(values, synchronize_session=False)
+
+
+def _compute_counts(db, session_ids):
+    counts = {session_id: dict.fromkeys(_COUNT_COLUMNS, 0) for session_id in session_ids}
+    enrolled = (
+        db.query(SessionStudent.session_id, func.count(SessionStudent.student_id))
+        .filter(SessionStudent.session_id.in_(session_ids))
+        .group_by(SessionStudent.session_id)
+        .all()
+    )
+    for session_id, count in enrolled:
+        counts[session_id]["enrolled"] = count
+    statuses = (
+        db.query(Attendance.session_id, Attendance.status, func.count(Attendance.id))
+        .filter(Attendance.session_id.in_(session_ids))
+        .group_by(Attendance.session_id, Attendance.status)
+        .all()
+    )
+    for session_id, status, count in statuses:
+        column = STATUS_COLUMNS.get(status)
+        if column:
+            counts[session_id][column] += count
+    return counts
+
+
+def refresh_session_stats(db, session_ids):
+    # Tính lại số liệu từ bảng attendance / session_students cho các buổi học (không commit)
+    session_ids = list(session_ids)
+    if not session_ids:
+        return {}
+    counts = _compute_counts(db, session_ids)
+    rows = {row.session_id: row for row in db.query(SessionAttendanceStats).filter(SessionAttendanceStats.session_id.in_(session_ids)).all()}
+    for session_id, values in counts.items():
+        row = rows.get(session_id)
+        if row is None:
+            row = rows[session_id] = SessionAttendanceStats(session_id=session_id)
+            db.add(row)
+        for column, value in values.items():
+            setattr(row, column, value)
+    return rows
+
+
+def load_session_stats(db, session_ids):
+    # Trả về {session_id: SessionAttendanceStats}; buổi học chưa có dòng số liệu (dữ liệu cũ) được tính từ bảng gốc mà không ghi vào DB
+    # (các dòng còn thiếu được tạo bởi scripts/rebuild_session_stats.py hoặc lần ghi điểm danh tiếp theo)
+    session_ids = list(session_ids)
+    if not session_ids:
+        return {}
+    stats = {row.session_id: row for row in db.query(SessionAttendanceStats).filter(SessionAttendanceStats.session_id.in_(session_ids)).all()}
+    missing = [session_id for session_id in session_ids if session_id not in stats]
+    if missing:
+        for session_id, values in _compute_counts(db, missing).items():
+            stats[session_id] = SessionAttendanceStats(session_id=session_id, **values)
+    return stats
@@ -0,0 +1,53 @@
+from sqlalchemy import insert, update
+from models.attendance_model import Attendance
+from utils.attendance_stats import StatsDelta
+
+
+def upsert_attendance(db, session, statuses):
+    """
+    Ghi trạng thái điểm danh {student_id: status} của một buổi học theo lô (không commit):
+    một câu SELECT ... FOR UPDATE lấy bản ghi hiện có, so sánh trong bộ nhớ, rồi một lệnh INSERT và một lệnh UPDATE nhiều dòng.
+    """
+    if not statuses:
+        return
+
+    # Khoá các bản ghi hiện có để trạng thái cũ dùng cho số liệu buổi học không bị request khác đổi giữa chừng
+    existing = db.execute(
+        db.query(Attendance.id, Attendance.student_id, Attendance.status, Attendance.session_date)
+        .filter(
+            Attendance.class_id == session.class_id,
+            Attendance.session_id == session.id,
+            Attendance.student_id.in_(list(statuses))
+        )
+        .with_for_update()
+        .statement
+    ).all()
+
+    stats = StatsDelta()
+    changed, seen = [], set()
+    # Dữ liệu cũ có thể có nhiều bản ghi cho cùng một học sinh: cập nhật tất cả
+    for row in existing:
+        seen.add(row.student_id)
+        status = statuses[row.student_id]
+        if row.status != status or row.session_date != session.date:
+            stats.status_changed(session.id, row.status, status)
+            changed.append({"id": row.id, "status": status, "session_date": session.date})
+
+    created = [
+        {
+            "class_id": session.class_id,
+            "session_id": session.id,
+            "student_id": student_id,
+            "session_date": session.date,
+            "status": status,
+        }
+        for student_id, status in statuses.items() if student_id not in seen
+    ]
+    for record in created:
+        stats.status_changed(session.id, None, record["status"])
+
+    if created:
+        db.execute(insert(Attendance), created)
+    if changed:
+        db.execute(update(Attendance), changed)
+    stats.apply(db)
@@ -0,0 +1,47 @@
+import json
+import struct
+import numpy as np
+
+# Định dạng nhị phân của một embedding:
+#   magic (4 byte) | phiên bản định dạng (1) | kiểu dữ liệu (1) | số chiều (2) | tên model (16) | dữ liệu float32 little-endian
+# Header dài 24 byte nên phần dữ liệu luôn được căn lề 4 byte, đọc lại bằng np.frombuffer không cần sao chép.
+EMBEDDING_MAGIC = b"FEMB"
+EMBEDDING_FORMAT_VERSION = 1
+EMBEDDING_HEADER = struct.Struct("<4sBcH16s")
+DEFAULT_EMBEDDING_MODEL = "Facenet"
+
+_DTYPES = {b"f": np.dtype("<f4")}
+
+
+def encode_embedding(embedding, model_name: str = DEFAULT_EMBEDDING_MODEL) -> bytes:
+    vector = np.asarray(embedding, dtype="<f4").ravel()
+    header = EMBEDDING_HEADER.pack(
+        EMBEDDING_MAGIC,
+        EMBEDDING_FORMAT_VERSION,
+        b"f",
+        vector.size,
+        model_name.encode("ascii")[:16],
+    )
+    return header + vector.tobytes()
+
+
+def read_embedding_header(blob: bytes):
+    magic, version, dtype_code, dim, model_name = EMBEDDING_HEADER.unpack_from(blob)
+    if magic != EMBEDDING_MAGIC:
+        raise ValueError("Dữ liệu embedding không đúng định dạng")
+    if version != EMBEDDING_FORMAT_VERSION or dtype_code not in _DTYPES:
+        raise ValueError(f"Không hỗ trợ định dạng embedding phiên bản {version}, kiểu {dtype_code!r}")
+    return _DTYPES[dtype_code], dim, model_name.rstrip(b"\0").decode("ascii")
+
+
+def decode_embedding(blob: bytes) -> np.ndarray:
+    # Trả về view chỉ đọc trên chính buffer của blob (không sao chép)
+    dtype, dim, _ = read_embedding_header(blob)
+    return np.frombuffer(blob, dtype=dtype, count=dim, offset=EMBEDDING_HEADER.size)
+
+
+def load_embedding(vector_blob, embedding_json) -> np.ndarray:
+    # Ưu tiên cột nhị phân; các dòng cũ chưa chuyển đổi vẫn đọc được từ chuỗi JSON
+    if vector_blob is not None:
+        return decode_embedding(vector_blob)
+    return np.asarray(json.loads(embedding_json), dtype=np.float32)
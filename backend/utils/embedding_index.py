@@ -0,0 +1,379 @@
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from sqlalchemy import func
+from utils.embedding_codec import load_embedding
+from utils.ann_index import IVFIndex
+
+# Ngưỡng cosine tối thiểu để coi là cùng một người
+FACE_MATCH_THRESHOLD = float(os.getenv("FACE_MATCH_THRESHOLD", "0.8"))
+# Sau bao nhiêu giây thì kiểm tra lại bảng face_embeddings (để thấy thay đổi từ worker khác)
+FACE_INDEX_CHECK_INTERVAL = float(os.getenv("FACE_INDEX_CHECK_INTERVAL", "5"))
+# Số ma trận con (theo lớp/buổi học) được giữ trong bộ nhớ đệm
+FACE_SCOPE_CACHE_SIZE = int(os.getenv("FACE_SCOPE_CACHE_SIZE", "256"))
+# Cách tìm kiếm trên toàn trường: "exact" (quét toàn bộ ma trận) hoặc "ivf" (chỉ mục xấp xỉ, xem utils/ann_index.py).
+# Dưới FACE_ANN_MIN_SIZE vector thì luôn quét toàn bộ vì đã đủ nhanh.
+FACE_INDEX_BACKEND = os.getenv("FACE_INDEX_BACKEND", "exact").lower()
+FACE_ANN_MIN_SIZE = int(os.getenv("FACE_ANN_MIN_SIZE", "5000"))
+# File lưu ảnh chụp chỉ mục (.npz) để khởi động lại không phải đọc lại bảng và huấn luyện lại; để trống là tắt
+FACE_INDEX_PATH = os.getenv("FACE_INDEX_PATH", "")
+# So khớp hai bước khi học sinh có nhiều vector: so với vector trung bình (template) của từng học sinh,
+# giữ FACE_TEMPLATE_SHORTLIST học sinh gần nhất có điểm trên (ngưỡng - FACE_TEMPLATE_MARGIN), rồi so với từng vector của họ
+FACE_TEMPLATE_SHORTLIST = int(os.getenv("FACE_TEMPLATE_SHORTLIST", "5"))
+FACE_TEMPLATE_MARGIN = float(os.getenv("FACE_TEMPLATE_MARGIN", "0.1"))
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _template_view(matrix, student_ids):
+    # Vector trung bình (đã chuẩn hoá) của từng học sinh và vị trí các dòng của mỗi học sinh trong ma trận.
+    # Trả về None khi mỗi học sinh chỉ có một vector (so khớp hai bước không có lợi).
+    if len(student_ids) == 0:
+        return None
+    order = np.argsort(student_ids, kind="stable")
+    unique_ids, starts = np.unique(student_ids[order], return_index=True)
+    if len(unique_ids) == len(student_ids):
+        return None
+    templates = np.ascontiguousarray(_normalize_rows(np.add.reduceat(matrix[order], starts, axis=0)))
+    ends = np.append(starts[1:], len(student_ids))
+    return templates, order, starts, ends
+
+
+class EmbeddingIndex:
+    """
+    Chỉ mục embedding dùng chung trong tiến trình: toàn bộ vector được chuẩn hoá sẵn
+    và xếp liền nhau trong một ma trận float32, tìm kiếm bằng một phép nhân ma trận-vector.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._matrix = np.empty((0, 0), dtype=np.float32)
+        self._student_ids = np.empty(0, dtype=np.int64)
+        self._loaded = False
+        self._signature = None
+        self._checked_at = 0.0
+        # Tăng mỗi khi dữ liệu thay đổi, dùng để loại bỏ các ma trận con đã cũ
+        self._version = 0
+        self._scoped = OrderedDict()
+        self._templates = (None, None)
+        self._ann = IVFIndex() if FACE_INDEX_BACKEND == "ivf" else None
+
+    def __len__(self):
+        return len(self._student_ids)
+
+    @classmethod
+    def from_arrays(cls, student_ids, vectors, ann: bool = False):
+        # Dựng chỉ mục trực tiếp từ mảng vector (benchmark, công cụ offline) thay vì đọc bảng face_embeddings
+        index = cls()
+        index._ann = IVFIndex() if ann else None
+        matrix, ids = index._build(student_ids, vectors)
+        if index._ann is not None and len(ids):
+            index._ann.build(matrix)
+        index._swap(matrix, ids, None)
+        return index
+
+    @staticmethod
+    def _table_signature(db):
+        # Import models khi cần đọc DB: from_arrays() dùng được mà không cần cấu hình MySQL
+        from models.face_embeddings import FaceEmbedding
+        # (số dòng, id lớn nhất) đủ để phát hiện thêm/xoá/đăng ký lại embedding
+        count, max_id = db.query(func.count(FaceEmbedding.id), func.max(FaceEmbedding.id)).one()
+        return count, max_id
+
+    def _build(self, student_ids, vectors):
+        if len(vectors) == 0:
+            return np.empty((0, 0), dtype=np.float32), np.empty(0, dtype=np.int64)
+        matrix = np.ascontiguousarray(_normalize_rows(np.asarray(vectors, dtype=np.float32)))
+        return matrix, np.asarray(student_ids, dtype=np.int64)
+
+    def _read_snapshot(self):
+        if not FACE_INDEX_PATH or not os.path.exists(FACE_INDEX_PATH):
+            return None
+        try:
+            with np.load(FACE_INDEX_PATH) as snapshot:
+                return {key: snapshot[key] for key in snapshot.files}
+        except Exception as e:
+            print(f"⚠️ Không đọc được file chỉ mục {FACE_INDEX_PATH}: {e}")
+            return None
+
+    def _write_snapshot(self, signature):
+        if not FACE_INDEX_PATH:
+            return
+        state = {
+            "signature": np.asarray([signature[0], -1 if signature[1] is None else signature[1]], dtype=np.int64),
+            "matrix": self._matrix,
+            "student_ids": self._student_ids,
+        }
+        if self._ann_ready():
+            state.update(self._ann.state())
+        # Mỗi tiến trình ghi ra file tạm riêng (cùng thư mục) rồi đổi tên, để nhiều worker lưu cùng lúc không ghi đè file tạm của nhau
+        tmp_path = None
+        try:
+            with tempfile.NamedTemporaryFile(dir=os.path.dirname(os.path.abspath(FACE_INDEX_PATH)), prefix=".face_index.", suffix=".npz", delete=False) as tmp:
+                tmp_path = tmp.name
+                np.savez(tmp, **state)
+            os.replace(tmp_path, FACE_INDEX_PATH)
+        except OSError as e:
+            print(f"⚠️ Không ghi được file chỉ mục {FACE_INDEX_PATH}: {e}")
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _ann_ready(self):
+        return self._ann is not None and self._ann.trained and len(self._ann.assignments) == len(self._student_ids)
+
+    def load(self, db, signature=None):
+        if signature is None:
+            signature = self._table_signature(db)
+        snapshot = self._read_snapshot()
+        stored_signature = tuple(int(value) for value in snapshot["signature"]) if snapshot else None
+        if snapshot and stored_signature == (signature[0], -1 if signature[1] is None else signature[1]):
+            # Bảng không đổi kể từ lần lưu: dùng lại ma trận và chỉ mục đã lưu
+            matrix, ids = np.ascontiguousarray(snapshot["matrix"], dtype=np.float32), snapshot["student_ids"]
+            if self._ann is not None and not self._ann.restore(snapshot, len(ids)) and len(ids) >= FACE_ANN_MIN_SIZE:
+                self._ann.build(matrix)
+            self._swap(matrix, ids, signature)
+            return
+
+        from models.face_embeddings import FaceEmbedding
+        rows = db.query(FaceEmbedding.student_id, FaceEmbedding.vector, FaceEmbedding.embedding).all()
+        student_ids, vectors = [], []
+        for row in rows:
+            try:
+                vectors.append(load_embedding(row.vector, row.embedding))
+            except (ValueError, TypeError) as e:
+                print(f"⚠️ Bỏ qua embedding lỗi của học sinh ID {row.student_id}: {e}")
+                continue
+            student_ids.append(row.student_id)
+        matrix, ids = self._build(student_ids, vectors)
+        if self._ann is not None and len(ids) >= FACE_ANN_MIN_SIZE:
+            # Dùng lại tâm cụm đã lưu (nếu có) để không phải huấn luyện lại k-means
+            if snapshot and not self._ann.trained and "ivf_centroids" in snapshot and snapshot["ivf_centroids"].shape[1] == matrix.shape[1]:
+                self._ann.restore(snapshot, -1)
+            self._ann.build(matrix)
+        self._swap(matrix, ids, signature)
+        self._write_snapshot(signature)
+
+    def _swap(self, matrix, ids, signature):
+        with self._lock:
+            self._matrix, self._student_ids = matrix, ids
+            self._version += 1
+            self._signature = signature
+            self._checked_at = time.monotonic()
+            self._loaded = True
+
+    def ensure_loaded(self, db):
+        now = time.monotonic()
+        if self._loaded and now - self._checked_at < FACE_INDEX_CHECK_INTERVAL:
+            return
+        signature = self._table_signature(db)
+        with self._lock:
+            if self._loaded and signature == self._signature:
+                self._checked_at = now
+                return
+        self.load(db, signature)
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded = False
+
+    def _sync_signature(self, db, previous, count_delta: int, student_ids):
+        # Sau khi tự cập nhật chỉ mục cho thay đổi của chính mình thì ghi nhận chữ ký mới của bảng,
+        # tránh ensure_loaded() phải đọc lại toàn bộ bảng chỉ vì thay đổi đó.
+        # Chỉ nhận chữ ký mới khi nó khớp với chữ ký cũ cộng thay đổi của chính mình; nếu tiến trình khác cũng vừa ghi
+        # thì giữ chữ ký cũ để lần ensure_loaded() tiếp theo đọc lại bảng
+        if db is None or previous is None:
+            return
+        from models.face_embeddings import FaceEmbedding
+        signature = self._table_signature(db)
+        count, max_id = previous
+        if signature[0] != count + count_delta:
+            return
+        # Dòng mới (id lớn hơn chữ ký cũ) chỉ được thuộc về các học sinh vừa cập nhật
+        if max_id is not None:
+            foreign = db.query(func.count(FaceEmbedding.id)).filter(
+                FaceEmbedding.id > max_id,
+                ~FaceEmbedding.student_id.in_(student_ids)
+            ).scalar()
+            if foreign:
+                return
+        with self._lock:
+            if self._signature == previous:
+                self._signature = signature
+
+    def upsert(self, student_id: int, embeddings, db=None):
+        # Thay toàn bộ vector của học sinh bằng danh sách mới (dùng sau khi đăng ký/cập nhật ảnh)
+        self.upsert_many([(student_id, embeddings)], db)
+
+    def upsert_many(self, items, db=None):
+        # items: danh sách (student_id, embeddings); cập nhật nhiều học sinh với một lần sao chép ma trận
+        if not items:
+            return
+        with self._lock:
+            if not self._loaded:
+                return
+            replaced = np.fromiter((student_id for student_id, _ in items), dtype=np.int64, count=len(items))
+            keep = ~np.isin(self._student_ids, replaced)
+            new_vectors = _normalize_rows(np.vstack([
+                np.asarray(embeddings, dtype=np.float32).reshape(len(embeddings), -1) for _, embeddings in items
+            ]))
+            new_ids = np.concatenate([np.full(len(embeddings), student_id, dtype=np.int64) for student_id, embeddings in items])
+            if self._matrix.size:
+                matrix = np.vstack([self._matrix[keep], new_vectors])
+            else:
+                matrix = new_vectors
+            ids = np.concatenate([self._student_ids[keep], new_ids])
+            if self._ann_ready():
+                self._ann.remove(keep)
+                self._ann.append(new_vectors)
+            count_delta = len(new_ids) - int(np.count_nonzero(~keep))
+            self._matrix, self._student_ids = np.ascontiguousarray(matrix), ids
+            self._version += 1
+            previous = self._signature
+        self._sync_signature(db, previous, count_delta, replaced.tolist())
+
+    def reload_student(self, db, student_id: int):
+        # Đọc lại toàn bộ vector của một học sinh từ DB (sau khi thêm/xoá ảnh mẫu)
+        from models.face_embeddings import FaceEmbedding
+        rows = db.query(FaceEmbedding.vector, FaceEmbedding.embedding).filter(FaceEmbedding.student_id == student_id).all()
+        vectors = [load_embedding(row.vector, row.embedding) for row in rows]
+        if vectors:
+            self.upsert(student_id, vectors, db)
+        else:
+            self.remove(student_id, db)
+
+    def remove(self, student_id: int, db=None):
+        with self._lock:
+            if not self._loaded:
+                return
+            keep = self._student_ids != student_id
+            if self._ann_ready():
+                self._ann.remove(keep)
+            count_delta = -int(np.count_nonzero(~keep))
+            self._matrix = np.ascontiguousarray(self._matrix[keep])
+            self._student_ids = self._student_ids[keep]
+            self._version += 1
+            previous = self._signature
+        self._sync_signature(db, previous, count_delta, [student_id])
+
+    def _global_view(self, probes):
+        # Ma trận dùng để tìm trên toàn trường: toàn bộ (kèm template từng học sinh),
+        # hoặc chỉ các dòng ứng viên của chỉ mục xấp xỉ
+        with self._lock:
+            matrix, student_ids = self._matrix, self._student_ids
+            if not self._ann_ready() or len(student_ids) == 0:
+                if self._templates[0] != self._version:
+                    self._templates = (self._version, _template_view(matrix, student_ids))
+                return matrix, student_ids, self._templates[1]
+            rows = self._ann.candidates(probes)
+        # Các vector ứng viên được chấm điểm lại chính xác trên ma trận float32 gốc
+        return matrix[rows], student_ids[rows], None
+
+    @staticmethod
+    def _best_match(matrix, student_ids, embedding, threshold):
+        if len(student_ids) == 0:
+            return None
+        probe = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(probe)
+        if norm == 0:
+            return None
+        scores = matrix @ (probe / norm)
+        best = int(np.argmax(scores))
+        if scores[best] <= threshold:
+            return None
+        return int(student_ids[best]), float(scores[best])
+
+    @classmethod
+    def _match(cls, matrix, student_ids, templates, embedding, threshold):
+        if templates is None:
+            return cls._best_match(matrix, student_ids, embedding, threshold)
+
+        # Bước 1: so với template của từng học sinh để chọn danh sách rút gọn
+        template_matrix, order, starts, ends = templates
+        probe = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(probe)
+        if norm == 0:
+            return None
+        scores = template_matrix @ (probe / norm)
+        shortlist = min(FACE_TEMPLATE_SHORTLIST, len(scores))
+        top = np.argpartition(-scores, shortlist - 1)[:shortlist]
+        top = top[scores[top] > threshold - FACE_TEMPLATE_MARGIN]
+        if len(top) == 0:
+            return None
+
+        # Bước 2: so với từng vector của các học sinh trong danh sách rút gọn
+        rows = np.concatenate([order[starts[t]:ends[t]] for t in top])
+        return cls._best_match(matrix[rows], student_ids[rows], probe, threshold)
+
+    def search(self, embedding, threshold: float = FACE_MATCH_THRESHOLD):
+        # Trả về (student_id, similarity) của vector gần nhất vượt ngưỡng, hoặc None
+        probe = np.asarray(embedding, dtype=np.float32)
+        matrix, student_ids, templates = self._global_view(probe)
+        return self._match(matrix, student_ids, templates, probe, threshold)
+
+    def _scoped_view(self, scope_key, candidate_ids):
+        # Ma trận con chỉ gồm các học sinh trong danh sách (kèm template), được cache theo scope_key
+        roster = frozenset(candidate_ids)
+        with self._lock:
+            cached = self._scoped.get(scope_key)
+            if cached and cached[0] == self._version and cached[1] == roster:
+                self._scoped.move_to_end(scope_key)
+                return cached[2], cached[3], cached[4]
+
+            mask = np.isin(self._student_ids, np.fromiter(roster, dtype=np.int64, count=len(roster)))
+            matrix = np.ascontiguousarray(self._matrix[mask]) if self._matrix.size else self._matrix
+            student_ids = self._student_ids[mask]
+            templates = _template_view(matrix, student_ids)
+            self._scoped[scope_key] = (self._version, roster, matrix, student_ids, templates)
+            self._scoped.move_to_end(scope_key)
+            while len(self._scoped) > FACE_SCOPE_CACHE_SIZE:
+                self._scoped.popitem(last=False)
+            return matrix, student_ids, templates
+
+    def search_scoped(self, embedding, scope_key, candidate_ids, threshold: float = FACE_MATCH_THRESHOLD):
+        # Giống search() nhưng chỉ so khớp trong candidate_ids (ví dụ: danh sách học sinh của buổi học)
+        matrix, student_ids, templates = self._scoped_view(scope_key, candidate_ids)
+        return self._match(matrix, student_ids, templates, embedding, threshold)
+
+    def assign(self, embeddings, scope_key=None, candidate_ids=None, threshold: float = FACE_MATCH_THRESHOLD):
+        # Ghép nhiều khuôn mặt với học sinh theo nguyên tắc một-một (mỗi học sinh chỉ được ghép một lần):
+        # xét các cặp (khuôn mặt, học sinh) vượt ngưỡng theo độ tương đồng giảm dần và nhận cặp nếu cả hai còn trống.
+        # Trả về danh sách (vị trí khuôn mặt, student_id, similarity).
+        if len(embeddings) == 0:
+            return []
+        probes = _normalize_rows(np.asarray(embeddings, dtype=np.float32).reshape(len(embeddings), -1))
+        if candidate_ids is None:
+            matrix, student_ids, _ = self._global_view(probes)
+        else:
+            matrix, student_ids, _ = self._scoped_view(scope_key, candidate_ids)
+        if len(student_ids) == 0:
+            return []
+
+        scores = probes @ matrix.T
+
+        # Một học sinh có thể có nhiều vector: lấy điểm cao nhất theo từng học sinh
+        unique_ids, columns = np.unique(student_ids, return_inverse=True)
+        per_student = np.full((len(probes), len(unique_ids)), -np.inf, dtype=np.float32)
+        np.maximum.at(per_student, (slice(None), columns), scores)
+
+        probe_idx, student_idx = np.nonzero(per_student > threshold)
+        order = np.argsort(-per_student[probe_idx, student_idx], kind="stable")
+        used_probes, used_students, assignments = set(), set(), []
+        for k in order:
+            p, c = int(probe_idx[k]), int(student_idx[k])
+            if p in used_probes or c in used_students:
+                continue
+            used_probes.add(p)
+            used_students.add(c)
+            assignments.append((p, int(unique_ids[c]), float(per_student[p, c])))
+        return assignments
+
+
+# Chỉ mục dùng chung cho toàn bộ tiến trình
+embedding_index = EmbeddingIndex()
@@ -0,0 +1,190 @@
+import os
+import threading
+from datetime import datetime, timedelta
+from database.mysql import SessionLocal
+from models.enrollment_job_model import EnrollmentJob
+from models.face_embeddings import FaceEmbedding
+from models.student_model import Student
+from utils.image_processing import embed_face_templates
+from utils.image_fetcher import image_fetcher
+from utils.inference_executor import inference_executor, InferenceQueueFull
+from utils.embedding_index import embedding_index
+from utils.embedding_codec import encode_embedding
+
+# Chạy worker đăng ký khuôn mặt trong tiến trình API (tắt khi chạy worker riêng: python -m scripts.run_enrollment_worker)
+FACE_ENROLLMENT_WORKER = os.getenv("FACE_ENROLLMENT_WORKER", "true").lower() in ("1", "true", "yes")
+FACE_ENROLLMENT_POLL_INTERVAL = float(os.getenv("FACE_ENROLLMENT_POLL_INTERVAL", "2"))
+FACE_ENROLLMENT_BATCH_SIZE = int(os.getenv("FACE_ENROLLMENT_BATCH_SIZE", "8"))
+# Thử lại tối đa FACE_ENROLLMENT_MAX_ATTEMPTS lần, lần sau chờ gấp đôi lần trước (bắt đầu từ FACE_ENROLLMENT_RETRY_DELAY giây)
+FACE_ENROLLMENT_MAX_ATTEMPTS = int(os.getenv("FACE_ENROLLMENT_MAX_ATTEMPTS", "3"))
+FACE_ENROLLMENT_RETRY_DELAY = float(os.getenv("FACE_ENROLLMENT_RETRY_DELAY", "30"))
+# Job "processing" lâu hơn thời gian này được coi là bị treo (worker chết giữa chừng) và được lấy lại
+FACE_ENROLLMENT_STALE_AFTER = float(os.getenv("FACE_ENROLLMENT_STALE_AFTER", "600"))
+# Pool chạy model đang đầy (điểm danh trực tiếp được ưu tiên): chờ bao nhiêu giây rồi gửi lại lô embedding
+FACE_ENROLLMENT_BUSY_RETRY = float(os.getenv("FACE_ENROLLMENT_BUSY_RETRY", "0.5"))
+
+_UNFINISHED = ("pending", "processing")
+
+
+def enqueue_enrollment(db, student_id: int, image_url: str):
+    # Huỷ các job chưa xong của học sinh (ảnh cũ) rồi tạo job mới và báo cho worker
+    db.query(EnrollmentJob).filter(
+        EnrollmentJob.student_id == student_id,
+        EnrollmentJob.status.in_(_UNFINISHED)
+    ).update({"status": "cancelled"}, synchronize_session=False)
+    job = EnrollmentJob(student_id=student_id, image_url=image_url, status="pending", attempts=0, next_attempt_at=datetime.now())
+    db.add(job)
+    db.commit()
+    enrollment_worker.wake()
+    return job
+
+
+class EnrollmentWorker:
+    """
+    Worker nền lấy các job đăng ký khuôn mặt từ bảng enrollment_jobs: tải ảnh, tính embedding (kèm ảnh tăng cường) theo lô,
+    ghi vào face_embeddings và cập nhật chỉ mục. Job lỗi được thử lại với thời gian chờ tăng dần.
+    Nhiều worker (nhiều tiến trình) có thể chạy cùng lúc vì job được nhận bằng SELECT ... FOR UPDATE SKIP LOCKED.
+    """
+
+    def __init__(self):
+        self._thread = None
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run_forever, name="face-enrollment", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+            self._thread = None
+
+    def wake(self):
+        self._wake.set()
+
+    def run_forever(self):
+        while not self._stop.is_set():
+            try:
+                processed = self.run_once()
+            except Exception as e:
+                print(f"⚠️ Lỗi worker đăng ký khuôn mặt: {e}")
+                processed = 0
+            if not processed:
+                self._wake.wait(FACE_ENROLLMENT_POLL_INTERVAL)
+                self._wake.clear()
+
+    def _claim(self, db):
+        now = datetime.now()
+        stale_before = now - timedelta(seconds=FACE_ENROLLMENT_STALE_AFTER)
+        jobs = (
+            db.query(EnrollmentJob)
+            .filter(
+                ((EnrollmentJob.status == "pending") & (EnrollmentJob.next_attempt_at <= now))
+                | ((EnrollmentJob.status == "processing") & (EnrollmentJob.locked_at < stale_before))
+            )
+            .order_by(EnrollmentJob.id)
+            .limit(FACE_ENROLLMENT_BATCH_SIZE)
+            .with_for_update(skip_locked=True)
+            .all()
+        )
+        for job in jobs:
+            job.status = "processing"
+            job.locked_at = now
+            job.attempts += 1
+        db.commit()
+        return jobs
+
+    def run_once(self):
+        # Xử lý một lô job; trả về số job đã nhận
+        db = SessionLocal()
+        try:
+            jobs = self._claim(db)
+            if not jobs:
+                return 0
+
+            # Tải song song các ảnh của lô (ảnh đã có trong cache thì không tải lại)
+            imgs, errors = [], {}
+            for job, img in zip(jobs, image_fetcher.fetch_many([job.image_url for job in jobs])):
+                if isinstance(img, Exception):
+                    imgs.append(None)
+                    errors[job.id] = img
+                else:
+                    imgs.append(img)
+
+            try:
+                results = self._embed(imgs)
+            except Exception as e:
+                results = [e] * len(jobs)
+            for job, result in zip(jobs, results):
+                error = errors.get(job.id, result if isinstance(result, Exception) else None)
+                if error is not None:
+                    self._fail(db, job, error)
+                else:
+                    self._complete(db, job, result)
+            return len(jobs)
+        finally:
+            db.close()
+
+    def _embed(self, imgs):
+        # Chạy MTCNN/Facenet trên pool luồng có giới hạn của inference_executor (dùng chung với điểm danh)
+        # để đăng ký cả lớp không chạy song song ngoài giới hạn và tranh CPU với điểm danh trực tiếp
+        while True:
+            try:
+                return inference_executor.submit(embed_face_templates, imgs).result()
+            except InferenceQueueFull:
+                if self._stop.wait(FACE_ENROLLMENT_BUSY_RETRY):
+                    raise
+
+    def _finish(self, db, job, values):
+        # Chỉ cập nhật job còn đang "processing": job có thể đã bị huỷ (học sinh đổi ảnh) trong lúc xử lý.
+        # Trả về False nếu job không còn thuộc về worker này
+        values = dict(values, locked_at=None)
+        return db.query(EnrollmentJob).filter(
+            EnrollmentJob.id == job.id,
+            EnrollmentJob.status == "processing"
+        ).update(values, synchronize_session=False) > 0
+
+    def _complete(self, db, job, embeddings):
+        # Ảnh của học sinh đã đổi (hoặc học sinh đã bị xoá) trong lúc xử lý: bỏ kết quả cũ
+        student = db.query(Student.id, Student.image).filter(Student.id == job.student_id).first()
+        if not student or student.image != job.image_url:
+            self._finish(db, job, {"status": "cancelled"})
+            db.commit()
+            return
+
+        # Job đã bị huỷ trong lúc tính embedding: không ghi đè vector của job mới hơn
+        if not self._finish(db, job, {"status": "done", "last_error": None}):
+            db.rollback()
+            return
+
+        # Chỉ thay các vector từ ảnh đại diện; ảnh mẫu bổ sung của học sinh được giữ lại
+        db.query(FaceEmbedding).filter(
+            FaceEmbedding.student_id == job.student_id,
+            (FaceEmbedding.source.is_(None)) | (FaceEmbedding.source == "profile")
+        ).delete(synchronize_session=False)
+        db.add_all([FaceEmbedding(student_id=job.student_id, vector=encode_embedding(embedding), source="profile") for embedding in embeddings])
+        db.commit()
+        embedding_index.reload_student(db, job.student_id)
+        print("✅ Đăng ký dữ liệu khuôn mặt thành công cho học sinh ID:", job.student_id)
+
+    def _fail(self, db, job, error):
+        values = {"last_error": str(error)[:500]}
+        if job.attempts >= FACE_ENROLLMENT_MAX_ATTEMPTS:
+            values["status"] = "failed"
+        else:
+            values["status"] = "pending"
+            values["next_attempt_at"] = datetime.now() + timedelta(seconds=FACE_ENROLLMENT_RETRY_DELAY * 2 ** (job.attempts - 1))
+        if not self._finish(db, job, values):
+            db.rollback()
+            return
+        db.commit()
+        print(f"⚠️ Lỗi khi đăng ký dữ liệu khuôn mặt cho học sinh ID {job.student_id} (lần {job.attempts}): {error}")
+
+
+enrollment_worker = EnrollmentWorker()
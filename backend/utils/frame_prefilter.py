@@ -0,0 +1,118 @@
+import os
+import threading
+from collections import OrderedDict
+import cv2
+import numpy as np
+
+# Các bước lọc rẻ tiền chạy trước MTCNN/Facenet, cách nhau bởi dấu phẩy (để trống là tắt):
+#   motion   - bỏ khung hình gần như không đổi so với khung trước của cùng kiosk (khi khung trước không có khuôn mặt)
+#   quality  - bỏ khung hình quá mờ, quá tối hoặc quá sáng
+#   presence - bỏ khung hình mà Haar cascade ở độ phân giải thấp không thấy khuôn mặt nào.
+#              Mặc định tắt: Haar bỏ sót khuôn mặt nghiêng, quay ngang hoặc nhỏ mà MTCNN vẫn phát hiện được,
+#              chỉ nên bật sau khi đo trên khung hình thật của kiosk rằng không làm mất khung hình MTCNN nhận được
+FACE_PREFILTER_STAGES = [stage.strip() for stage in os.getenv("FACE_PREFILTER_STAGES", "motion,quality").split(",") if stage.strip()]
+FACE_PREFILTER_MOTION_THRESHOLD = float(os.getenv("FACE_PREFILTER_MOTION_THRESHOLD", "4.0"))
+FACE_PREFILTER_BLUR_THRESHOLD = float(os.getenv("FACE_PREFILTER_BLUR_THRESHOLD", "40"))
+FACE_PREFILTER_MIN_BRIGHTNESS = float(os.getenv("FACE_PREFILTER_MIN_BRIGHTNESS", "40"))
+FACE_PREFILTER_MAX_BRIGHTNESS = float(os.getenv("FACE_PREFILTER_MAX_BRIGHTNESS", "220"))
+FACE_PREFILTER_PRESENCE_WIDTH = int(os.getenv("FACE_PREFILTER_PRESENCE_WIDTH", "320"))
+
+_MOTION_SIZE = (64, 48)
+_MAX_CLIENTS = 1000
+
+
+class FrameRejected(Exception):
+    def __init__(self, reason: str, message: str):
+        super().__init__(message)
+        self.reason = reason
+
+
+class FramePrefilter:
+    """
+    Loại sớm các khung hình không có khuôn mặt dùng được (hành lang trống, ảnh mờ, khung hình lặp lại)
+    để không phải chạy MTCNN và Facenet cho chúng.
+    """
+
+    def __init__(self, stages):
+        self.stages = list(stages)
+        self._lock = threading.Lock()
+        self._previous = OrderedDict()
+        self._local = threading.local()
+
+    def _cascade(self):
+        # CascadeClassifier không an toàn khi dùng chung giữa các luồng nên mỗi luồng giữ một instance
+        cascade = getattr(self._local, "cascade", None)
+        if cascade is None:
+            cascade = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
+            self._local.cascade = cascade
+        return cascade
+
+    def _check_motion(self, gray, client_key):
+        thumbnail = cv2.resize(gray, _MOTION_SIZE, interpolation=cv2.INTER_AREA).astype(np.int16)
+        with self._lock:
+            previous = self._previous.pop(client_key, None)
+            # [thumbnail, có khuôn mặt]: giả định khung hình bị loại; check() chuyển sang None (chờ kết quả phát hiện)
+            # khi khung hình qua hết các bước, record_detection() ghi lại kết quả MTCNN
+            entry = [thumbnail, False]
+            self._previous[client_key] = entry
+            while len(self._previous) > _MAX_CLIENTS:
+                self._previous.popitem(last=False)
+        if previous is None:
+            return entry
+        previous_thumbnail, previous_face = previous
+        # Chỉ bỏ khi chắc chắn khung trước không có khuôn mặt; khung trước có khuôn mặt (hoặc chưa có kết quả)
+        # thì vẫn cho qua để nhận diện lại, cache nhận diện sẽ chặn ghi trùng
+        if previous_face is False and np.abs(thumbnail - previous_thumbnail).mean() < FACE_PREFILTER_MOTION_THRESHOLD:
+            raise FrameRejected("unchanged", "Khung hình không thay đổi so với khung hình trước")
+        return entry
+
+    def _check_quality(self, gray):
+        brightness = float(gray.mean())
+        if brightness < FACE_PREFILTER_MIN_BRIGHTNESS:
+            raise FrameRejected("too_dark", "Ảnh quá tối")
+        if brightness > FACE_PREFILTER_MAX_BRIGHTNESS:
+            raise FrameRejected("too_bright", "Ảnh quá sáng")
+        if cv2.Laplacian(gray, cv2.CV_64F).var() < FACE_PREFILTER_BLUR_THRESHOLD:
+            raise FrameRejected("blurry", "Ảnh bị mờ")
+
+    def _check_presence(self, gray):
+        height, width = gray.shape[:2]
+        if width > FACE_PREFILTER_PRESENCE_WIDTH:
+            scale = FACE_PREFILTER_PRESENCE_WIDTH / width
+            gray = cv2.resize(gray, (FACE_PREFILTER_PRESENCE_WIDTH, max(1, int(height * scale))), interpolation=cv2.INTER_AREA)
+        cascade = self._cascade()
+        if cascade.empty():
+            # Không có file Haar cascade: bỏ qua bước này thay vì loại mọi khung hình
+            return
+        faces = cascade.detectMultiScale(gray, scaleFactor=1.2, minNeighbors=3, minSize=(24, 24))
+        if len(faces) == 0:
+            raise FrameRejected("no_face", "Không phát hiện được khuôn mặt trong ảnh")
+
+    def check(self, img, client_key=None):
+        # Raise FrameRejected nếu khung hình bị loại ở một bước nào đó.
+        # Trả về token để báo kết quả phát hiện khuôn mặt qua record_detection() (None nếu không theo dõi chuyển động)
+        if not self.stages:
+            return None
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        entry = None
+        if "motion" in self.stages and client_key is not None:
+            entry = self._check_motion(gray, client_key)
+        if "quality" in self.stages:
+            self._check_quality(gray)
+        if "presence" in self.stages:
+            self._check_presence(gray)
+        if entry is not None:
+            with self._lock:
+                entry[1] = None
+        return entry
+
+    def record_detection(self, token, face_found: bool):
+        # Ghi kết quả MTCNN của khung hình đã qua check(); khung hình không có khuôn mặt cho phép bước motion
+        # bỏ các khung hình tiếp theo không thay đổi (hành lang trống, đủ sáng)
+        if token is None:
+            return
+        with self._lock:
+            token[1] = bool(face_found)
+
+
+frame_prefilter = FramePrefilter(FACE_PREFILTER_STAGES)
@@ -0,0 +1,175 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Thời gian chờ kết nối / đọc dữ liệu (giây) và số lượt tải ảnh đồng thời tối đa trong tiến trình
+IMAGE_FETCH_CONNECT_TIMEOUT = float(os.getenv("IMAGE_FETCH_CONNECT_TIMEOUT", "3"))
+IMAGE_FETCH_READ_TIMEOUT = float(os.getenv("IMAGE_FETCH_READ_TIMEOUT", "10"))
+IMAGE_FETCH_MAX_CONCURRENCY = int(os.getenv("IMAGE_FETCH_MAX_CONCURRENCY", "8"))
+IMAGE_FETCH_MAX_BYTES = int(os.getenv("IMAGE_FETCH_MAX_BYTES", str(10 * 1024 * 1024)))
+# Thư mục cache ảnh đã giải mã (để trống là tắt). Ảnh lớn được thu nhỏ về cạnh dài IMAGE_CACHE_MAX_SIDE trước khi lưu.
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", "cache/images")
+IMAGE_CACHE_MAX_SIDE = int(os.getenv("IMAGE_CACHE_MAX_SIDE", "1280"))
+# Trong khoảng thời gian này ảnh trong cache được dùng luôn; sau đó hỏi lại server bằng ETag/Last-Modified
+IMAGE_CACHE_TTL = float(os.getenv("IMAGE_CACHE_TTL", "86400"))
+
+
+def _sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _downscale(img):
+    height, width = img.shape[:2]
+    longest = max(height, width)
+    if IMAGE_CACHE_MAX_SIDE <= 0 or longest <= IMAGE_CACHE_MAX_SIDE:
+        return img
+    scale = IMAGE_CACHE_MAX_SIDE / longest
+    return cv2.resize(img, (max(1, int(width * scale)), max(1, int(height * scale))), interpolation=cv2.INTER_AREA)
+
+
+class ImageFetcher:
+    """
+    Tải ảnh qua một HTTP session dùng chung (giữ kết nối, có timeout và giới hạn số lượt tải đồng thời).
+    Ảnh đã giải mã được lưu trên đĩa theo nội dung (sha256 của bytes gốc); mỗi URL trỏ tới nội dung kèm ETag/Last-Modified
+    nên tải lại cùng một ảnh (đăng ký lại, tính lại embedding) không phải tải và giải mã lại.
+    """
+
+    def __init__(self, cache_dir: str):
+        self._cache_dir = cache_dir
+        self._slots = threading.BoundedSemaphore(max(1, IMAGE_FETCH_MAX_CONCURRENCY))
+        self._session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=IMAGE_FETCH_MAX_CONCURRENCY,
+            pool_maxsize=IMAGE_FETCH_MAX_CONCURRENCY,
+            max_retries=Retry(total=2, backoff_factor=0.5, status_forcelist=(429, 502, 503, 504), allowed_methods=("GET",))
+        )
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        if cache_dir:
+            try:
+                os.makedirs(os.path.join(cache_dir, "urls"), exist_ok=True)
+                os.makedirs(os.path.join(cache_dir, "objects"), exist_ok=True)
+            except OSError as e:
+                print(f"⚠️ Không tạo được thư mục cache ảnh {cache_dir}, tắt cache: {e}")
+                self._cache_dir = ""
+
+    def _url_path(self, url: str):
+        return os.path.join(self._cache_dir, "urls", _sha256(url.encode("utf-8")) + ".json")
+
+    def _object_path(self, content_hash: str):
+        return os.path.join(self._cache_dir, "objects", content_hash + ".npy")
+
+    def _read_entry(self, url: str):
+        try:
+            with open(self._url_path(url), "r") as f:
+                entry = json.load(f)
+            img = np.load(self._object_path(entry["content"]))
+            return entry, img
+        except (OSError, ValueError, KeyError):
+            return None, None
+
+    def _write_atomic(self, path: str, write):
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            write(f)
+        os.replace(tmp_path, path)
+
+    def _store(self, url: str, response, content_hash: str, img):
+        object_path = self._object_path(content_hash)
+        if not os.path.exists(object_path):
+            self._write_atomic(object_path, lambda f: np.save(f, img))
+        self._touch(url, {
+            "content": content_hash,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        })
+
+    def _touch(self, url: str, entry: dict):
+        entry = dict(entry, checked_at=time.time())
+        self._write_atomic(self._url_path(url), lambda f: f.write(json.dumps(entry).encode("utf-8")))
+
+    def _download(self, url: str, headers=None):
+        with self._slots:
+            response = self._session.get(
+                url,
+                headers=headers or {},
+                stream=True,
+                timeout=(IMAGE_FETCH_CONNECT_TIMEOUT, IMAGE_FETCH_READ_TIMEOUT)
+            )
+            try:
+                if response.status_code == 304:
+                    return response, None
+                if response.status_code != 200:
+                    raise Exception("Không thể tải ảnh từ URL")
+                chunks, size = [], 0
+                for chunk in response.iter_content(64 * 1024):
+                    size += len(chunk)
+                    if size > IMAGE_FETCH_MAX_BYTES:
+                        raise Exception("Ảnh quá lớn")
+                    chunks.append(chunk)
+                return response, b"".join(chunks)
+            finally:
+                response.close()
+
+    def fetch(self, url: str):
+        # Trả về ảnh BGR (numpy); raise Exception nếu không tải hoặc không giải mã được
+        entry, cached = (None, None)
+        if self._cache_dir:
+            entry, cached = self._read_entry(url)
+            if cached is not None and time.time() - entry.get("checked_at", 0) < IMAGE_CACHE_TTL:
+                return cached
+
+        headers = {}
+        if cached is not None:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        try:
+            response, data = self._download(url, headers)
+        except requests.RequestException:
+            raise Exception("Không thể tải ảnh từ URL")
+
+        if data is None:
+            # 304 Not Modified: ảnh trong cache vẫn đúng
+            try:
+                self._touch(url, entry)
+            except OSError:
+                pass
+            return cached
+
+        img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+        if img is None:
+            raise Exception("Không thể giải mã ảnh từ URL")
+        img = _downscale(img)
+        if self._cache_dir:
+            try:
+                self._store(url, response, _sha256(data), img)
+            except OSError as e:
+                print(f"⚠️ Không ghi được cache ảnh: {e}")
+        return img
+
+    def fetch_many(self, urls):
+        # Tải nhiều ảnh song song; mỗi phần tử kết quả là ảnh hoặc Exception của URL đó
+        def fetch(url):
+            try:
+                return self.fetch(url)
+            except Exception as e:
+                return e
+
+        if not urls:
+            return []
+        with ThreadPoolExecutor(max_workers=max(1, min(IMAGE_FETCH_MAX_CONCURRENCY, len(urls)))) as pool:
+            return list(pool.map(fetch, urls))
+
+
+image_fetcher = ImageFetcher(IMAGE_CACHE_DIR)
@@ -1,49 +1,164 @@
+import os
 import base64
 import cv2
 import numpy as np
-import requests
 import json
-from facenet_pytorch import MTCNN
-from deepface import DeepFace
+from utils.model_registry import model_registry
+from utils.image_fetcher import image_fetcher
+from utils.metrics import face_stage_duration_seconds
 
-# Khởi tạo MTCNN, bạn có thể cấu hình device là "cuda" nếu có GPU
-mtcnn_detector = MTCNN(keep_all=False, device="cpu")
+# Tăng cường dữ liệu khi đăng ký khuôn mặt (cách nhau bởi dấu phẩy, để trống là tắt):
+#   flip   - thêm ảnh lật ngang của khuôn mặt
+#   jitter - thêm các vùng cắt dịch/phóng nhẹ quanh hộp khuôn mặt
+FACE_TEMPLATE_AUGMENT = [item.strip() for item in os.getenv("FACE_TEMPLATE_AUGMENT", "flip").split(",") if item.strip()]
+# (dịch ngang, dịch dọc, tỉ lệ) theo kích thước hộp khuôn mặt
+_JITTERS = [(-0.08, 0.0, 1.0), (0.08, 0.0, 1.0), (0.0, -0.06, 1.0), (0.0, 0.0, 1.12)]
 
 def load_image_from_url(image_url: str):
-    response = requests.get(image_url, stream=True)
-    if response.status_code != 200:
-        raise Exception("Không thể tải ảnh từ URL")
-    img_data = response.content
-    nparr = np.frombuffer(img_data, np.uint8)
-    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-    return img
+    # Tải qua session dùng chung (timeout, giới hạn đồng thời) và cache ảnh trên đĩa
+    return image_fetcher.fetch(image_url)
 
 def load_image_from_base64(image_base64: str):
     img_data = base64.b64decode(image_base64)
+    return load_image_from_bytes(img_data)
+
+def load_image_from_bytes(img_data: bytes):
+    # Giải mã ảnh nhị phân (JPEG/PNG) gửi trực tiếp, ví dụ qua WebSocket
     nparr = np.frombuffer(img_data, np.uint8)
     img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
     return img
 
+def crop_face(img, face_box):
+    # Cắt khuôn mặt theo hộp giới hạn, giới hạn toạ độ trong khung ảnh (MTCNN có thể trả về toạ độ âm)
+    height, width = img.shape[:2]
+    x1, y1, x2, y2 = face_box.astype(int)
+    x1, y1 = max(x1, 0), max(y1, 0)
+    x2, y2 = min(x2, width), min(y2, height)
+    return img[y1:y2, x1:x2]
+
 def detect_and_crop_face(img):
     # Sử dụng MTCNN để phát hiện khuôn mặt
-    boxes, probs = mtcnn_detector.detect(img)
+    boxes, probs = model_registry.get_detector().detect(img)
     if boxes is None or len(boxes) == 0:
         raise Exception("Không phát hiện được khuôn mặt trong ảnh")
     # Lấy hộp giới hạn của khuôn mặt với xác suất cao nhất
     face_box = boxes[0]
-    x1, y1, x2, y2 = face_box.astype(int)
-    face_img = img[y1:y2, x1:x2]
-    return face_img
+    return crop_face(img, face_box)
+
+def detect_and_crop_faces(img, min_confidence: float = 0.9):
+    # Phát hiện tất cả khuôn mặt trong ảnh (ví dụ: ảnh chụp cả lớp), bỏ qua các hộp có xác suất thấp
+    boxes, probs = model_registry.get_detector().detect(img)
+    if boxes is None or len(boxes) == 0:
+        return [], []
+    faces, face_boxes = [], []
+    for face_box, prob in zip(boxes, probs):
+        if prob is None or prob < min_confidence:
+            continue
+        face_img = crop_face(img, face_box)
+        if face_img.size == 0:
+            continue
+        faces.append(face_img)
+        face_boxes.append([int(v) for v in face_box])
+    return faces, face_boxes
+
+def detect_faces_batch(imgs):
+    # Phát hiện khuôn mặt cho nhiều ảnh; các ảnh cùng kích thước được đưa vào MTCNN trong một lần gọi
+    detector = model_registry.get_detector()
+    results = [None] * len(imgs)
+    groups = {}
+    for i, img in enumerate(imgs):
+        groups.setdefault(img.shape, []).append(i)
+    for indices in groups.values():
+        batch_boxes, _ = detector.detect(np.stack([imgs[i] for i in indices]))
+        for i, boxes in zip(indices, batch_boxes):
+            results[i] = boxes
+    return results
 
 def extract_face_embedding(face_img):
-    # Resize ảnh khuôn mặt về kích thước chuẩn (ví dụ: 160x160 đối với Facenet)
-    face_img_resized = cv2.resize(face_img, (160, 160))
-    # Trích xuất vector embedding sử dụng DeepFace với model Facenet
-    result = DeepFace.represent(face_img_resized, model_name="Facenet")
-    if not result or len(result) == 0:
+    # Khuôn mặt đã được MTCNN cắt sẵn nên đưa thẳng vào model Facenet đã nạp trong registry,
+    # không chạy lại bước phát hiện khuôn mặt bên trong DeepFace.represent
+    return extract_face_embeddings([face_img])[0]
+
+def extract_face_embeddings(face_imgs):
+    # Trích xuất embedding cho nhiều khuôn mặt trong một lần gọi model
+    if not face_imgs or any(face_img is None or face_img.size == 0 for face_img in face_imgs):
         raise Exception("Không thể trích xuất embedding từ khuôn mặt")
-    embedding = result[0]["embedding"]
-    return embedding
+    return [embedding.tolist() for embedding in model_registry.embed_faces(face_imgs)]
+
+def detect_and_embed_batch(imgs):
+    # Pipeline theo lô: phát hiện khuôn mặt lớn nhất trong từng ảnh rồi trích xuất embedding cho cả lô.
+    # Trả về danh sách cùng độ dài với imgs, mỗi phần tử là embedding hoặc Exception của ảnh đó.
+    results = [None] * len(imgs)
+    valid = [i for i, img in enumerate(imgs) if img is not None]
+    for i in range(len(imgs)):
+        if imgs[i] is None:
+            results[i] = Exception("Không thể giải mã ảnh")
+
+    faces, face_indices = [], []
+    with face_stage_duration_seconds.time("detect", count=len(valid)):
+        detections = detect_faces_batch([imgs[i] for i in valid])
+    for i, boxes in zip(valid, detections):
+        if boxes is None or len(boxes) == 0:
+            results[i] = Exception("Không phát hiện được khuôn mặt trong ảnh")
+            continue
+        face_img = crop_face(imgs[i], boxes[0])
+        if face_img.size == 0:
+            results[i] = Exception("Không thể trích xuất embedding từ khuôn mặt")
+            continue
+        faces.append(face_img)
+        face_indices.append(i)
+
+    if faces:
+        with face_stage_duration_seconds.time("embed", count=len(faces)):
+            embeddings = extract_face_embeddings(faces)
+        for i, embedding in zip(face_indices, embeddings):
+            results[i] = embedding
+    return results
+
+def augment_face_crops(img, face_box):
+    # Khuôn mặt gốc và các biến thể tăng cường (theo FACE_TEMPLATE_AUGMENT) từ cùng một hộp giới hạn
+    face_img = crop_face(img, face_box)
+    crops = [face_img]
+    if "flip" in FACE_TEMPLATE_AUGMENT:
+        crops.append(cv2.flip(face_img, 1))
+    if "jitter" in FACE_TEMPLATE_AUGMENT:
+        x1, y1, x2, y2 = np.asarray(face_box, dtype=np.float32)
+        width, height = x2 - x1, y2 - y1
+        cx, cy = (x1 + x2) / 2, (y1 + y2) / 2
+        for dx, dy, scale in _JITTERS:
+            half_w, half_h = width * scale / 2, height * scale / 2
+            box = np.array([cx + dx * width - half_w, cy + dy * height - half_h, cx + dx * width + half_w, cy + dy * height + half_h])
+            crop = crop_face(img, box)
+            if crop.size:
+                crops.append(crop)
+    return crops
+
+def embed_face_templates(imgs):
+    # Dùng khi đăng ký: mỗi ảnh cho ra nhiều embedding (khuôn mặt gốc + biến thể tăng cường), tất cả chạy trong một lô.
+    # Trả về danh sách cùng độ dài với imgs, mỗi phần tử là danh sách embedding hoặc Exception của ảnh đó.
+    results = [None] * len(imgs)
+    valid = [i for i, img in enumerate(imgs) if img is not None]
+    for i in range(len(imgs)):
+        if imgs[i] is None:
+            results[i] = Exception("Không thể giải mã ảnh")
+
+    crops, owners = [], []
+    for i, boxes in zip(valid, detect_faces_batch([imgs[i] for i in valid])):
+        if boxes is None or len(boxes) == 0:
+            results[i] = Exception("Không phát hiện được khuôn mặt trong ảnh")
+            continue
+        face_crops = augment_face_crops(imgs[i], boxes[0])
+        if face_crops[0].size == 0:
+            results[i] = Exception("Không thể trích xuất embedding từ khuôn mặt")
+            continue
+        crops.extend(face_crops)
+        owners.extend([i] * len(face_crops))
+        results[i] = []
+
+    if crops:
+        for i, embedding in zip(owners, extract_face_embeddings(crops)):
+            results[i].append(embedding)
+    return results
 
 def normalize_embedding(embedding):
     norm = np.linalg.norm(embedding)
@@ -0,0 +1,114 @@
+import os
+import asyncio
+from utils.image_processing import load_image_from_base64, load_image_from_bytes, detect_and_embed_batch
+from utils.inference_executor import inference_executor
+from utils.frame_prefilter import frame_prefilter, FrameRejected
+from utils.metrics import face_stage_duration_seconds, face_batch_size, face_frames_total
+
+# Gom các khung hình đến trong khoảng thời gian ngắn thành một lô (tối đa FACE_BATCH_MAX_SIZE ảnh)
+FACE_BATCH_WINDOW_MS = float(os.getenv("FACE_BATCH_WINDOW_MS", "25"))
+FACE_BATCH_MAX_SIZE = int(os.getenv("FACE_BATCH_MAX_SIZE", "8"))
+
+
+class MicroBatcher:
+    """
+    Gom các request đồng thời thành lô để chạy model một lần cho cả lô, sau đó trả kết quả
+    về đúng request đang chờ. process_batch(items) chạy trong inference_executor và phải trả về
+    danh sách kết quả cùng thứ tự; phần tử là Exception sẽ được raise cho request tương ứng.
+    Mỗi lô chiếm một slot của executor.
+    """
+
+    def __init__(self, process_batch, window_ms: float, max_size: int, executor=inference_executor):
+        self._process_batch = process_batch
+        self._window = window_ms / 1000
+        self._max_size = max(1, max_size)
+        self._executor = executor
+        self._pending = []
+        self._timer = None
+        # Giữ tham chiếu tới các task đang chạy lô để chúng không bị garbage collector thu hồi giữa chừng
+        self._tasks = set()
+
+    async def submit(self, item):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self._max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self._window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch):
+        try:
+            results = await self._executor.run(self._process_batch, [item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+
+def _decode_frame(frame):
+    # frame là chuỗi base64 (HTTP) hoặc bytes JPEG (WebSocket); ảnh lỗi chỉ làm hỏng request của chính nó
+    try:
+        if isinstance(frame, (bytes, bytearray)):
+            return load_image_from_bytes(frame)
+        return load_image_from_base64(frame)
+    except Exception:
+        return None
+
+
+def _prefilter_frame(frame, client_key):
+    # Giải mã rồi chạy các bước lọc rẻ tiền; trả về (ảnh, token của bộ lọc) hoặc Exception nếu khung hình bị loại
+    with face_stage_duration_seconds.time("decode"):
+        img = _decode_frame(frame)
+    if img is None:
+        face_frames_total.inc("invalid")
+        return FrameRejected("invalid", "Không thể giải mã ảnh")
+    try:
+        with face_stage_duration_seconds.time("prefilter"):
+            token = frame_prefilter.check(img, client_key)
+    except FrameRejected as e:
+        face_frames_total.inc("rejected")
+        return e
+    return img, token
+
+
+def embed_frames(items):
+    # items là các cặp (khung hình, client_key); chỉ các khung hình qua bộ lọc mới chạy phát hiện + embedding theo lô
+    results = [_prefilter_frame(frame, client_key) for frame, client_key in items]
+    accepted = [i for i, result in enumerate(results) if not isinstance(result, Exception)]
+    if accepted:
+        face_batch_size.observe(len(accepted))
+        tokens = [results[i][1] for i in accepted]
+        for i, token, result in zip(accepted, tokens, detect_and_embed_batch([results[i][0] for i in accepted])):
+            # Báo lại cho bộ lọc để khung hình tiếp theo không đổi của kiosk chỉ được bỏ khi khung này không có khuôn mặt
+            frame_prefilter.record_detection(token, not isinstance(result, Exception))
+            if isinstance(result, Exception):
+                # Không tìm thấy / không cắt được khuôn mặt là kết quả bình thường của khung hình, không phải lỗi hệ thống
+                face_frames_total.inc("no_face")
+                result = FrameRejected("no_face", str(result))
+            results[i] = result
+    return results
+
+
+# Bộ gom lô cho các khung hình điểm danh (kiosk, webcam)
+frame_batcher = MicroBatcher(embed_frames, FACE_BATCH_WINDOW_MS, FACE_BATCH_MAX_SIZE)
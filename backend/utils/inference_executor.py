@@ -0,0 +1,46 @@
+import os
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Số luồng chạy model và số request được phép chờ thêm; vượt quá sẽ bị từ chối (503)
+FACE_INFERENCE_WORKERS = int(os.getenv("FACE_INFERENCE_WORKERS", "2"))
+FACE_INFERENCE_QUEUE_SIZE = int(os.getenv("FACE_INFERENCE_QUEUE_SIZE", "8"))
+
+
+class InferenceQueueFull(Exception):
+    pass
+
+
+class InferenceExecutor:
+    """
+    Pool luồng có giới hạn để chạy các bước tốn CPU (giải mã ảnh, MTCNN, Facenet) ngoài event loop.
+    Dùng luồng thay vì tiến trình để các worker dùng chung model đã nạp trong registry;
+    torch/TensorFlow nhả GIL khi tính toán nên các luồng vẫn chạy song song.
+    """
+
+    def __init__(self, workers: int, queue_size: int):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="face-inference")
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+
+    def submit(self, fn, *args):
+        # Trả về concurrent.futures.Future (dùng được từ luồng nền); raise InferenceQueueFull khi hết slot
+        if not self._slots.acquire(blocking=False):
+            raise InferenceQueueFull("Hệ thống nhận diện đang quá tải, vui lòng thử lại sau")
+        try:
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        # Trả slot khi công việc thực sự kết thúc, kể cả khi client đã ngắt kết nối
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    async def run(self, fn, *args):
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+inference_executor = InferenceExecutor(FACE_INFERENCE_WORKERS, FACE_INFERENCE_QUEUE_SIZE)
@@ -0,0 +1,145 @@
+import os
+import time
+import random
+import bisect
+import threading
+from contextlib import contextmanager
+
+# Tỉ lệ request điểm danh được ghi log debug chi tiết (embedding, kết quả so khớp); 0 là tắt
+FACE_DEBUG_SAMPLE_RATE = float(os.getenv("FACE_DEBUG_SAMPLE_RATE", "0.01"))
+
+# Mốc histogram (giây) cho thời gian từng bước của pipeline và của request HTTP
+_STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+_REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for label_values, value in values:
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """
+    Histogram kiểu Prometheus: đếm số lần quan sát rơi vào từng mốc, kèm tổng và số lượng.
+    observe(..., count=n) ghi n lần cùng một giá trị (một lô ảnh dùng chung thời gian chạy model).
+    """
+
+    def __init__(self, name: str, help_text: str, labels=(), buckets=_STAGE_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, value: float, *label_values, count: int = 1):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += count
+            series[1] += value * count
+            series[2] += count
+
+    @contextmanager
+    def time(self, *label_values, count: int = 1):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *label_values, count=count)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((label_values, (list(counts), total, n)) for label_values, (counts, total, n) in self._series.items())
+        for label_values, (counts, total, n) in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labels, label_values, ("le", _format_value(float(bound))))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {n}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name: str, help_text: str, labels=()):
+        metric = Counter(name, help_text, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help_text: str, labels=(), buckets=_STAGE_BUCKETS):
+        metric = Histogram(name, help_text, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        # Định dạng text exposition của Prometheus
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def sample_debug():
+    # Chỉ ghi log chi tiết cho một phần nhỏ request để không làm chậm đường xử lý chính
+    return FACE_DEBUG_SAMPLE_RATE > 0 and random.random() < FACE_DEBUG_SAMPLE_RATE
+
+
+metrics = MetricsRegistry()
+
+http_requests_total = metrics.counter(
+    "http_requests_total", "Số request HTTP theo phương thức, route và mã trạng thái", ("method", "route", "status")
+)
+http_request_duration_seconds = metrics.histogram(
+    "http_request_duration_seconds", "Thời gian xử lý request HTTP", ("method", "route"), _REQUEST_BUCKETS
+)
+# stage: decode, prefilter, detect, embed, match, db_write
+face_stage_duration_seconds = metrics.histogram(
+    "face_stage_duration_seconds", "Thời gian từng bước của pipeline nhận diện khuôn mặt (mỗi ảnh một lần quan sát)", ("stage",)
+)
+face_batch_size = metrics.histogram(
+    "face_batch_size", "Số khung hình trong mỗi lô chạy model", buckets=(1, 2, 4, 8, 16, 32)
+)
+face_frames_total = metrics.counter(
+    "face_frames_total", "Số khung hình điểm danh theo kết quả", ("result",)
+)
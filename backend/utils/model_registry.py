@@ -0,0 +1,93 @@
+import os
+import threading
+import time
+import numpy as np
+from facenet_pytorch import MTCNN
+from deepface import DeepFace
+from deepface.modules import preprocessing
+
+# Thiết bị chạy MTCNN, đặt "cuda" nếu có GPU
+FACE_DEVICE = os.getenv("FACE_DEVICE", "cpu")
+FACE_EMBEDDING_MODEL = os.getenv("FACE_EMBEDDING_MODEL", "Facenet")
+# Backend detector mà DeepFace.extract_faces dùng trong routes/face.py
+FACE_PRESENCE_BACKEND = os.getenv("FACE_PRESENCE_BACKEND", "opencv")
+# Nạp model ngay khi khởi động (tắt khi chạy các lệnh không cần model)
+FACE_MODELS_PRELOAD = os.getenv("FACE_MODELS_PRELOAD", "true").lower() in ("1", "true", "yes")
+
+
+class ModelRegistry:
+    """
+    Giữ các instance detector (MTCNN) và embedder (Facenet) dùng chung cho cả tiến trình.
+    Model được nạp một lần khi khởi động, chạy thử một lượt để "làm nóng" trước khi nhận request.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.detector = None
+        self.embedder = None
+        self.input_size = (160, 160)
+        self.ready = False
+        self.error = None
+        self.load_seconds = None
+
+    def load(self):
+        with self._lock:
+            if self.ready:
+                return
+            started = time.perf_counter()
+            try:
+                self.detector = MTCNN(keep_all=False, device=FACE_DEVICE)
+                self.embedder = DeepFace.build_model(FACE_EMBEDDING_MODEL)
+                self.input_size = tuple(self.embedder.input_shape)
+                self._warm_up()
+            except Exception as e:
+                self.error = str(e)
+                raise
+            self.error = None
+            self.load_seconds = round(time.perf_counter() - started, 2)
+            self.ready = True
+            print(f"✅ Đã nạp model nhận diện khuôn mặt trong {self.load_seconds}s")
+
+    def _warm_up(self):
+        # Chạy thử mỗi model một lần để khởi tạo graph/bộ nhớ trước request đầu tiên
+        dummy_frame = np.zeros((240, 320, 3), dtype=np.uint8)
+        self.detector.detect(dummy_frame)
+        self.embed_faces([np.zeros((*self.input_size, 3), dtype=np.uint8)])
+        DeepFace.extract_faces(img_path=dummy_frame, detector_backend=FACE_PRESENCE_BACKEND, enforce_detection=False)
+
+    def get_detector(self):
+        if not self.ready:
+            self.load()
+        return self.detector
+
+    def get_embedder(self):
+        if not self.ready:
+            self.load()
+        return self.embedder
+
+    def _prepare_face(self, face_img):
+        # Tiền xử lý giống hệt DeepFace.represent để embedding khớp với vector đã lưu trong DB:
+        # giữ thứ tự kênh BGR, chuẩn hoá về [0, 1], resize giữ tỉ lệ và đệm viền (resize_image), rồi normalize_input "base"
+        face_img = face_img.astype(np.float32) / 255.0
+        face_img = preprocessing.resize_image(img=face_img, target_size=(self.input_size[1], self.input_size[0]))
+        return preprocessing.normalize_input(img=face_img, normalization="base")
+
+    def embed_faces(self, face_imgs):
+        # Trích xuất embedding cho nhiều khuôn mặt trong một lần gọi model
+        embedder = self.embedder if self.embedder is not None else self.get_embedder()
+        # resize_image trả về mảng (1, h, w, 3) cho mỗi khuôn mặt
+        batch = np.concatenate([self._prepare_face(face_img) for face_img in face_imgs], axis=0)
+        return np.asarray(embedder.model(batch, training=False), dtype=np.float32)
+
+    def status(self):
+        return {
+            "ready": self.ready,
+            "detector": type(self.detector).__name__ if self.detector is not None else None,
+            "embedder": FACE_EMBEDDING_MODEL if self.embedder is not None else None,
+            "device": FACE_DEVICE,
+            "load_seconds": self.load_seconds,
+            "error": self.error,
+        }
+
+
+model_registry = ModelRegistry()
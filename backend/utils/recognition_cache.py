@@ -0,0 +1,87 @@
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+# Học sinh đã được điểm danh sẽ không ghi lại vào DB trong khoảng thời gian này (giây)
+FACE_RECOGNITION_TTL = float(os.getenv("FACE_RECOGNITION_TTL", "300"))
+FACE_RECOGNITION_CACHE_SIZE = int(os.getenv("FACE_RECOGNITION_CACHE_SIZE", "10000"))
+# Bỏ phiếu nhiều khung hình: cần FACE_VOTE_FRAMES lần khớp cùng một học sinh trong FACE_VOTE_WINDOW
+# khung hình gần nhất của cùng một kiosk (và trong FACE_VOTE_MAX_AGE giây). FACE_VOTE_FRAMES=1 là tắt.
+FACE_VOTE_FRAMES = int(os.getenv("FACE_VOTE_FRAMES", "1"))
+FACE_VOTE_WINDOW = int(os.getenv("FACE_VOTE_WINDOW", "3"))
+FACE_VOTE_MAX_AGE = float(os.getenv("FACE_VOTE_MAX_AGE", "10"))
+
+
+class RecognitionCache:
+    """
+    Cache ngắn hạn các học sinh vừa được điểm danh, khoá theo (class_id, session_date, student_id).
+    """
+
+    def __init__(self, ttl: float, max_size: int):
+        self._ttl = ttl
+        self._max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, class_id, session_date, student_id):
+        key = (class_id, session_date, student_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if not entry:
+                return None
+            expires_at, full_name = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            return full_name
+
+    def add(self, class_id, session_date, student_id, full_name):
+        key = (class_id, session_date, student_id)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self._ttl, full_name)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def discard(self, class_id, session_date, student_id):
+        with self._lock:
+            self._entries.pop((class_id, session_date, student_id), None)
+
+
+class FrameVoter:
+    """
+    Chỉ xác nhận một học sinh khi nhiều khung hình gần nhất của cùng kiosk đều khớp với học sinh đó.
+    """
+
+    def __init__(self, required: int, window: int, max_age: float):
+        self._required = required
+        self._window = window
+        self._max_age = max_age
+        self._lock = threading.Lock()
+        self._history = {}
+
+    def vote(self, client_key, student_id) -> bool:
+        if self._required <= 1:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            history = self._history.setdefault(client_key, deque(maxlen=self._window))
+            history.append((now, student_id))
+            votes = sum(1 for seen_at, voted_id in history if voted_id == student_id and now - seen_at <= self._max_age)
+            if votes >= self._required:
+                history.clear()
+                return True
+            # Dọn lịch sử của các kiosk không còn gửi khung hình
+            if len(self._history) > 1000:
+                self._history = {key: value for key, value in self._history.items() if value and now - value[-1][0] <= self._max_age}
+            return False
+
+    def miss(self, client_key):
+        # Khung hình không khớp ai cũng được tính vào cửa sổ bỏ phiếu
+        if self._required > 1:
+            self.vote(client_key, None)
+
+
+recognition_cache = RecognitionCache(FACE_RECOGNITION_TTL, FACE_RECOGNITION_CACHE_SIZE)
+frame_voter = FrameVoter(FACE_VOTE_FRAMES, FACE_VOTE_WINDOW, FACE_VOTE_MAX_AGE)
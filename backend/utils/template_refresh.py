@@ -0,0 +1,69 @@
+import os
+import threading
+import time
+from models.face_embeddings import FaceEmbedding
+from utils.embedding_codec import encode_embedding
+from utils.embedding_index import embedding_index
+
+# Bật cập nhật ảnh mẫu từ các lần điểm danh đã xác nhận (tắt mặc định)
+FACE_TEMPLATE_REFRESH = os.getenv("FACE_TEMPLATE_REFRESH", "false").lower() in ("1", "true", "yes")
+# Chỉ nhận khung hình khớp chắc chắn; khung hình gần như trùng với mẫu đã có thì không thêm thông tin mới
+FACE_REFRESH_MIN_SIMILARITY = float(os.getenv("FACE_REFRESH_MIN_SIMILARITY", "0.9"))
+FACE_REFRESH_MAX_SIMILARITY = float(os.getenv("FACE_REFRESH_MAX_SIMILARITY", "0.98"))
+# Số ảnh mẫu lấy từ điểm danh giữ lại cho mỗi học sinh (bỏ ảnh cũ nhất khi đầy)
+FACE_REFRESH_BUFFER_SIZE = int(os.getenv("FACE_REFRESH_BUFFER_SIZE", "5"))
+# Khoảng cách tối thiểu (giây) giữa hai lần thêm ảnh mẫu của cùng một học sinh
+FACE_REFRESH_MIN_INTERVAL = float(os.getenv("FACE_REFRESH_MIN_INTERVAL", "3600"))
+
+
+class TemplateRefresher:
+    """
+    Giữ một bộ đệm vòng các embedding chụp được khi điểm danh (source="capture") cho mỗi học sinh,
+    để chỉ mục theo kịp thay đổi ngoại hình trong học kỳ mà không cần đăng ký lại ảnh.
+    """
+
+    def __init__(self, enabled: bool):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._last_added = {}
+
+    def _claim_slot(self, student_id: int):
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_added.get(student_id, float("-inf")) < FACE_REFRESH_MIN_INTERVAL:
+                return False
+            self._last_added[student_id] = now
+            return True
+
+    def offer(self, db, student_id: int, embedding, similarity: float):
+        # Trả về True nếu embedding được thêm vào bộ mẫu của học sinh
+        if not self.enabled or embedding is None:
+            return False
+        if not FACE_REFRESH_MIN_SIMILARITY <= similarity <= FACE_REFRESH_MAX_SIMILARITY:
+            return False
+        if not self._claim_slot(student_id):
+            return False
+
+        try:
+            db.add(FaceEmbedding(student_id=student_id, vector=encode_embedding(embedding), source="capture"))
+            db.flush()
+            stale_ids = [
+                row.id for row in db.query(FaceEmbedding.id)
+                .filter(FaceEmbedding.student_id == student_id, FaceEmbedding.source == "capture")
+                .order_by(FaceEmbedding.id.desc())
+                .offset(FACE_REFRESH_BUFFER_SIZE)
+                .all()
+            ]
+            if stale_ids:
+                db.query(FaceEmbedding).filter(FaceEmbedding.id.in_(stale_ids)).delete(synchronize_session=False)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"⚠️ Không cập nhật được ảnh mẫu của học sinh ID {student_id}: {e}")
+            return False
+
+        embedding_index.reload_student(db, student_id)
+        return True
+
+
+template_refresher = TemplateRefresher(FACE_TEMPLATE_REFRESH)
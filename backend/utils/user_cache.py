@@ -0,0 +1,85 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date
+from typing import Optional
+
+# Thông tin người dùng đã xác thực được giữ trong bộ nhớ trong khoảng thời gian này (giây); 0 là tắt.
+# Cache nằm trong từng tiến trình: khi chạy nhiều worker, thay đổi ở worker khác được thấy sau tối đa USER_CACHE_TTL giây.
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "1024"))
+
+
+@dataclass(frozen=True)
+class AuthenticatedUser:
+    """
+    Bản sao chỉ đọc các cột của User (không gồm mật khẩu và token) dùng làm current_user trong route,
+    để dùng lại được giữa các request mà không gắn với một DB session.
+    """
+    id: int
+    email: str
+    full_name: str
+    phone_number: str
+    role: str
+    gender: Optional[str] = None
+    date_of_birth: Optional[date] = None
+    avatar_url: Optional[str] = None
+    address: Optional[str] = None
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(
+            id=user.id,
+            email=user.email,
+            full_name=user.full_name,
+            phone_number=user.phone_number,
+            role=user.role,
+            gender=user.gender,
+            date_of_birth=user.date_of_birth,
+            avatar_url=user.avatar_url,
+            address=user.address
+        )
+
+
+class UserCache:
+    """
+    Cache TTL + LRU người dùng theo email (claim "sub" của JWT).
+    Các route sửa/xoá người dùng phải gọi invalidate(email) sau khi commit.
+    """
+
+    def __init__(self, ttl: float, max_size: int):
+        self._ttl = ttl
+        self._max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, email: str):
+        with self._lock:
+            entry = self._entries.get(email)
+            if not entry:
+                return None
+            expires_at, user = entry
+            if expires_at < time.monotonic():
+                del self._entries[email]
+                return None
+            self._entries.move_to_end(email)
+            return user
+
+    def add(self, user: AuthenticatedUser):
+        if self._ttl <= 0:
+            return
+        with self._lock:
+            self._entries[user.email] = (time.monotonic() + self._ttl, user)
+            self._entries.move_to_end(user.email)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, *emails):
+        with self._lock:
+            for email in emails:
+                self._entries.pop(email, None)
+
+
+user_cache = UserCache(USER_CACHE_TTL, USER_CACHE_SIZE)
@@ -199,6 +199,34 @@ export const unenrollStudent = async (classId, studentId) => {
     }
 };
 
+// Enroll many students at once
+export const enrollStudents = async (classId, studentIds) => {
+    try {
+        const response = await axios.post(
+            `${API_BASE_URL}/classes/${classId}/enroll`,
+            { student_ids: studentIds },
+            { headers: getAuthHeaders() }
+        );
+        return response.data;
+    } catch (error) {
+        throw error;
+    }
+};
+
+// Unenroll many students at once
+export const unenrollStudents = async (classId, studentIds) => {
+    try {
+        const response = await axios.post(
+            `${API_BASE_URL}/classes/${classId}/unenroll`,
+            { student_ids: studentIds },
+            { headers: getAuthHeaders() }
+        );
+        return response.data;
+    } catch (error) {
+        throw error;
+    }
+};
+
 // Fetch class attendance
 export const fetchClassAttendance = async (classId) => {
     try {
@@ -35,6 +35,23 @@ export const sendFaceAttendancePublic = async ({ image, classId, sessionDate })
   return response.data;
 };
 
+// Mở kết nối WebSocket điểm danh liên tục: gửi khung hình JPEG dạng nhị phân, nhận lại sự kiện nhận diện
+export const openFaceAttendanceSocket = ({ classId, sessionDate, onEvent }) => {
+  const token = localStorage.getItem("token");
+  if (!token) throw new Error("Unauthorized");
+  const params = new URLSearchParams({
+    class_id: parseInt(classId, 10),
+    session_date: sessionDate,
+    token,
+  });
+  const socket = new WebSocket(
+    `${API_BASE_URL.replace(/^http/, "ws")}/attendance/ws/face-attendance?${params}`
+  );
+  socket.binaryType = "arraybuffer";
+  socket.onmessage = (event) => onEvent && onEvent(JSON.parse(event.data));
+  return socket;
+};
+
 // Lấy danh sách học sinh của lớp
 export const fetchClassStudents = async (classId) => {
   const response = await axios.get(
@@ -54,11 +54,12 @@ export const fetchStudentClasses = async (studentId) => {
     }
 };
 
-// Fetch student's sessions
-export const fetchStudentSessions = async (studentId) => {
+// Fetch student's sessions (optional params: from_date, to_date, limit, offset)
+export const fetchStudentSessions = async (studentId, params = {}) => {
     try {
         const response = await axios.get(`${API_BASE_URL}/students/${studentId}/sessions`, {
             headers: getAuthHeaders(),
+            params,
         });
         return response.data;
     } catch (error) {
@@ -106,4 +107,36 @@ export const uploadStudentImage = async (imageFile) => {
     } catch (error) {
         throw error;
     }
-}; 
\ No newline at end of file
+}; 
+// Import many students from an Excel/CSV file, with an optional ZIP of photos
+export const importStudents = async (file, photosZip) => {
+    try {
+        const formData = new FormData();
+        formData.append("file", file);
+        if (photosZip) {
+            formData.append("photos", photosZip);
+        }
+
+        const response = await axios.post(`${API_BASE_URL}/students/bulk-import`, formData, {
+            headers: {
+                ...getAuthHeaders(),
+                "Content-Type": "multipart/form-data",
+            },
+        });
+        return response.data;
+    } catch (error) {
+        throw error;
+    }
+};
+
+// Get face enrollment status of a student
+export const getStudentEnrollment = async (studentId) => {
+    try {
+        const response = await axios.get(`${API_BASE_URL}/students/${studentId}/enrollment`, {
+            headers: getAuthHeaders(),
+        });
+        return response.data;
+    } catch (error) {
+        throw error;
+    }
+};